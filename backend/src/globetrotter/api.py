@@ -6,6 +6,7 @@ from trips.api import trips_router
 from trips.stops_api import stops_router
 from trips.activities_api import activities_router
 from trips.budget_api import budget_router
+from globetrotter.pagination import InvalidCursor, MAX_PAGE_SIZE
 
 # Create main API instance
 api = NinjaExtraAPI(
@@ -18,6 +19,10 @@ api = NinjaExtraAPI(
 # Add JWT controller for token refresh
 api.register_controllers(NinjaJWTDefaultController)
 
+@api.exception_handler(InvalidCursor)
+def invalid_cursor(request, exc):
+    return api.create_response(request, {"message": str(exc), "success": False}, status=400)
+
 # Add all routers
 api.add_router("/auth", auth_router)
 api.add_router("/users", users_router)
@@ -28,40 +33,53 @@ api.add_router("/", budget_router)
 
 # Public endpoints (no auth required)
 from ninja import Router
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from authentication.schemas import MessageResponseSchema
 from trips.models import SharedItinerary
 from trips.schemas import TripSchema
+from trips.snapshots import get_public_snapshot
+from trips.counters import record_shared_view, record_shared_copy
 
 public_router = Router(tags=["Public"])
 
-@public_router.get("/public/{slug}", response=TripSchema)
+# Browsers and proxies may reuse a public itinerary for this long without revalidating
+PUBLIC_TRIP_MAX_AGE = 60
+
+@public_router.get("/public/{slug}", response={200: TripSchema, 404: MessageResponseSchema})
 def get_public_trip(request, slug: str):
-    """Get public shared trip by slug"""
-    shared = get_object_or_404(SharedItinerary, public_slug=slug)
-    
-    if not shared.trip.is_public:
-        return 404, {"message": "Trip not found or not public"}
-    
-    # Increment view count
-    shared.view_count += 1
-    shared.save()
-    
-    # Import the helper function
-    from trips.api import get_trip_with_relations
-    return get_trip_with_relations(shared.trip)
+    """Get public shared trip by slug (served from a cached snapshot, supports ETag/Last-Modified)"""
+    snapshot = get_public_snapshot(slug)
+    
+    if not snapshot or not snapshot['available'] or (
+        snapshot['expires_at'] and snapshot['expires_at'] <= timezone.now()
+    ):
+        return 404, {"message": "Trip not found or not public", "success": False}
+    
+    record_shared_view(snapshot['shared_id'])
+    
+    response = get_conditional_response(
+        request, etag=snapshot['etag'], last_modified=snapshot['last_modified']
+    ) or HttpResponse(snapshot['body'], content_type='application/json')
+    response['ETag'] = snapshot['etag']
+    response['Last-Modified'] = http_date(snapshot['last_modified'])
+    response['Cache-Control'] = f'public, max-age={PUBLIC_TRIP_MAX_AGE}'
+    return response
 
-@public_router.post("/public/{slug}/copy", auth=None)
+@public_router.post("/public/{slug}/copy", response={200: MessageResponseSchema, 403: MessageResponseSchema}, auth=None)
 def copy_public_trip(request, slug: str):
     """Copy a public trip to user's account"""
-    shared = get_object_or_404(SharedItinerary, public_slug=slug)
+    shared = get_object_or_404(SharedItinerary.objects.select_related('trip'), public_slug=slug)
     
     if not shared.trip.is_public or not shared.allow_copying:
-        return 403, {"message": "Trip copying not allowed"}
+        return 403, {"message": "Trip copying not allowed", "success": False}
     
     # For now, just increment copy count
     # Full implementation would require user authentication
-    shared.copy_count += 1
-    shared.save()
+    record_shared_copy(shared.id)
     
     return {"message": "Trip copied successfully", "success": True}
 
@@ -73,76 +91,62 @@ search_router = Router(tags=["Search & Discovery"])
 
 @search_router.get("/search/cities", response=list)
 def search_cities(request, query: str = "", limit: int = 10):
-    """Search for cities"""
-    from trips.models import City
-    
-    cities = City.objects.all()
+    """Search for cities, ranked and typo tolerant"""
+    from trips.search import search_cities as run_city_search
+    from trips.cache import search_cache
     
-    if query:
-        cities = cities.filter(
-            name__icontains=query
-        ) | cities.filter(
-            country__icontains=query
-        )
+    def build():
+        return run_city_search(query, limit)
     
-    cities = cities[:limit]
+    return search_cache.get_or_set('cities', (query.lower(), limit), build)
+
+@search_router.get("/search/cities/autocomplete", response=list)
+def autocomplete_cities(request, query: str = "", limit: int = 8):
+    """City suggestions for a partially typed name or country"""
+    from trips.search import autocomplete_cities as run_autocomplete
     
-    return [
-        {
-            "name": city.name,
-            "country": city.country,
-            "latitude": float(city.latitude) if city.latitude else None,
-            "longitude": float(city.longitude) if city.longitude else None,
-            "timezone": city.timezone,
-            "popular_attractions": city.popular_attractions[:3]  # First 3 attractions
-        }
-        for city in cities
-    ]
-
-@search_router.get("/search/activities", response=list)
+    return run_autocomplete(query, limit)
+
+@search_router.get("/search/activities", response={200: dict, 400: MessageResponseSchema})
 def search_activities(request, 
                      query: str = "", 
                      city: str = "", 
                      category: str = "", 
+                     difficulty: str = "",
                      min_cost: float = None, 
                      max_cost: float = None,
+                     cursor: str = None,
                      limit: int = 20):
-    """Search for activities"""
-    from trips.models import ActivityCatalog
-    
-    activities = ActivityCatalog.objects.filter(is_verified=True)
-    
-    if query:
-        activities = activities.filter(name__icontains=query)
-    
-    if city:
-        activities = activities.filter(city_name__icontains=city)
-    
-    if category:
-        activities = activities.filter(category=category)
-    
-    if min_cost is not None:
-        activities = activities.filter(average_cost__gte=min_cost)
-    
-    if max_cost is not None:
-        activities = activities.filter(average_cost__lte=max_cost)
+    """Search for activities, with facet counts and cursors for the next/previous page"""
+    from trips.catalog_search import search_activity_catalog, activity_facets
+    from trips.cache import search_cache
+    
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    filters = dict(
+        query=query.strip(), city=city.strip(), category=category, difficulty=difficulty,
+        min_cost=min_cost, max_cost=max_cost
+    )
+    filters_key = (query.strip().lower(), city.strip().lower(), category, difficulty, min_cost, max_cost)
+    
+    page = search_cache.get_or_set(
+        'activities', ('page', *filters_key, cursor, limit),
+        lambda: search_activity_catalog(cursor=cursor, limit=limit, **filters)
+    )
+    
+    # Facets do not depend on the page, so every page shares one cached copy
+    facets = search_cache.get_or_set('activities', ('facets', *filters_key), lambda: activity_facets(**filters))
+    return {**page, "facets": facets}
+
+@search_router.get("/search/activities/nearby", response={200: list, 400: MessageResponseSchema})
+def search_nearby_activities(request, lat: float, lng: float, radius_km: float = 5, category: str = "", limit: int = 20):
+    """Verified activities within radius_km of a point, nearest first"""
+    from trips.catalog_search import nearby_activities, nearby_params_error
     
-    activities = activities.order_by('-rating', '-review_count')[:limit]
+    error = nearby_params_error(lat, lng, radius_km)
+    if error:
+        return 400, {"message": error, "success": False}
     
-    return [
-        {
-            "name": activity.name,
-            "category": activity.category,
-            "description": activity.description,
-            "city_name": activity.city_name,
-            "country": activity.country,
-            "estimated_cost": float(activity.average_cost) if activity.average_cost else None,
-            "duration_minutes": activity.estimated_duration_minutes,
-            "rating": float(activity.rating) if activity.rating else None,
-            "image_url": activity.image_urls[0] if activity.image_urls else None
-        }
-        for activity in activities
-    ]
+    return nearby_activities(lat, lng, radius_km, category=category, limit=limit)
 
 # Add search router
 api.add_router("/", search_router)
\ No newline at end of file
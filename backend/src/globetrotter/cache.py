@@ -0,0 +1,157 @@
+"""
+Namespaced, versioned caching shared by the API apps.
+
+Each app declares a CacheNamespace and caches values per *scope* (for example
+a trip id). Values are stored under the scope's current version, so bumping the
+version invalidates everything cached for that scope without tracking keys.
+Versions are bumped from model post_save/post_delete via version_on_change().
+
+Namespaces declared shared_only hold data that a write must invalidate in every
+worker, so they cache nothing unless settings.CACHE_SHARED says all workers use
+the same cache backend. Hit/miss counters cost extra round trips and are only
+kept with settings.CACHE_TRACK_STATS.
+"""
+
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+_MISSING = object()
+
+# Key parts longer than this are hashed to keep keys short and backend-safe
+MAX_KEY_PART_LENGTH = 64
+
+
+def _key_part(part):
+    part = str(part)
+    if len(part) > MAX_KEY_PART_LENGTH or any(char.isspace() or char == ':' for char in part):
+        return hashlib.md5(part.encode('utf-8')).hexdigest()
+    return part
+
+
+def _new_version():
+    # Time based so a version evicted from the cache is never handed out again
+    return time.time_ns()
+
+
+class CacheNamespace:
+    """Cache keys of one app or area, with per-scope versions and hit/miss counters"""
+
+    def __init__(self, name, timeout=None, alias='default', shared_only=False):
+        self.name = name
+        self.timeout = timeout
+        self.alias = alias
+        self.shared_only = shared_only
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        """False for shared_only namespaces while workers do not share the cache"""
+        return not self.shared_only or settings.CACHE_SHARED
+
+    def key(self, *parts):
+        """Namespaced key built from the given parts"""
+        return ':'.join([self.name, *(_key_part(part) for part in parts)])
+
+    def version(self, scope):
+        """Current version of a scope"""
+        return self.cache.get_or_set(self.key('version', scope), _new_version, timeout=None)
+
+    def bump(self, scope):
+        """Invalidate every value cached for a scope"""
+        if not self.enabled:
+            return None
+        key = self.key('version', scope)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            version = _new_version()
+            self.cache.set(key, version, timeout=None)
+            return version
+
+    def versioned_key(self, scope, *parts):
+        return self.key(scope, f"v{self.version(scope)}", *parts)
+
+    def get(self, scope, *parts):
+        """Cached value for the scope's current version, or None"""
+        if not self.enabled:
+            return None
+        value = self.cache.get(self.versioned_key(scope, *parts), _MISSING)
+        self._count('misses' if value is _MISSING else 'hits')
+        return None if value is _MISSING else value
+
+    def set(self, scope, parts, value, timeout=None):
+        if not self.enabled:
+            return
+        self.cache.set(self.versioned_key(scope, *parts), value, timeout or self.timeout)
+
+    def get_or_set(self, scope, parts, builder, timeout=None):
+        """Return the cached value, calling builder() and storing its result on a miss"""
+        if not self.enabled:
+            return builder()
+        key = self.versioned_key(scope, *parts)
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count('hits')
+            return value
+
+        self._count('misses')
+        value = builder()
+        self.cache.set(key, value, timeout or self.timeout)
+        return value
+
+    def _count(self, outcome):
+        if not settings.CACHE_TRACK_STATS:
+            return
+        key = self.key('stats', outcome)
+        if not self.cache.add(key, 1, timeout=None):
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                pass
+
+    def stats(self):
+        """Hit/miss counters of this namespace"""
+        values = self.cache.get_many([self.key('stats', 'hits'), self.key('stats', 'misses')])
+        hits = values.get(self.key('stats', 'hits'), 0)
+        misses = values.get(self.key('stats', 'misses'), 0)
+        total = hits + misses
+        return {
+            'namespace': self.name,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0
+        }
+
+    def reset_stats(self):
+        self.cache.delete_many([self.key('stats', 'hits'), self.key('stats', 'misses')])
+
+
+def version_on_change(namespace, model, scopes, cascade_from=()):
+    """Bump namespace versions whenever instances of model are saved or deleted
+
+    scopes maps an instance to an iterable of scopes whose cached values depend
+    on it. Deletes cascading from a cascade_from model are skipped, since that
+    model's own handler already bumps the same scopes. Versions are bumped again
+    on commit so a value cached from pre-commit data does not survive.
+    """
+    def bump(sender, instance, **kwargs):
+        if cascade_from and isinstance(kwargs.get('origin'), cascade_from) and kwargs.get('origin') is not instance:
+            return
+        for scope in scopes(instance):
+            if scope is None:
+                continue
+            namespace.bump(scope)
+            transaction.on_commit(partial(namespace.bump, scope))
+
+    uid = f"cache-version:{namespace.name}:{model._meta.label}"
+    post_save.connect(bump, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(bump, sender=model, weak=False, dispatch_uid=uid)
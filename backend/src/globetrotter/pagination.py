@@ -0,0 +1,148 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Pages are selected with a WHERE clause on the ordering columns of the last
+row seen instead of OFFSET, so every page costs the same however deep it is.
+The position is handed to clients as an opaque cursor string.
+
+CursorPagination plugs this into ninja's @paginate for list endpoints; views
+that build their own payload use keyset_paginate() directly.
+"""
+
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import uuid
+from functools import reduce
+from operator import or_
+from typing import Any, List, NamedTuple, Optional
+
+from django.db.models import Q
+from ninja import Field, Schema
+from ninja.pagination import PaginationBase
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+NEXT, PREVIOUS = 'n', 'p'
+
+
+class InvalidCursor(ValueError):
+    """Raised for cursors that were not produced by encode_cursor()"""
+
+
+def _json_value(value):
+    # Full precision: DjangoJSONEncoder would cut microseconds to milliseconds
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"Cannot put {type(value).__name__} in a cursor")
+
+
+def encode_cursor(values):
+    payload = json.dumps(list(values), default=_json_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """Ordering values stored in a cursor, which must hold exactly length of them"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError) as error:
+        raise InvalidCursor("Invalid cursor") from error
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def order_by_fields(ordering):
+    return [f"-{field}" if descending else field for field, descending in ordering]
+
+
+def keyset_filter(ordering, values):
+    """Q selecting the rows that come after values in ordering
+
+    ordering is a sequence of (field, descending) pairs whose values are never
+    NULL and whose last field is unique, e.g. (('rating', True), ('id', False)).
+    """
+    clauses = []
+    equal = Q()
+    for (field, descending), value in zip(ordering, values):
+        clauses.append(equal & Q(**{f"{field}__{'lt' if descending else 'gt'}": value}))
+        equal &= Q(**{field: value})
+    return reduce(or_, clauses)
+
+
+class KeysetPage(NamedTuple):
+    items: list
+    next: Optional[str]
+    prev: Optional[str]
+
+
+def _reversed(ordering):
+    return tuple((field, not descending) for field, descending in ordering)
+
+
+def _cursor(direction, row, ordering):
+    return encode_cursor([direction, *(getattr(row, field) for field, _ in ordering)])
+
+
+def keyset_paginate(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of queryset in keyset order with the cursors of the pages around it
+
+    Cursors remember a direction, so a prev cursor walks the ordering
+    backwards from the first row of the page it came from.
+    """
+    direction, values = NEXT, None
+    if cursor:
+        direction, *values = decode_cursor(cursor, len(ordering) + 1)
+        if direction not in (NEXT, PREVIOUS):
+            raise InvalidCursor("Invalid cursor")
+
+    walk = ordering if direction == NEXT else _reversed(ordering)
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(walk, values))
+
+    rows = list(queryset.order_by(*order_by_fields(walk))[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == PREVIOUS:
+        rows.reverse()
+
+    has_next = more if direction == NEXT else values is not None
+    has_prev = values is not None if direction == NEXT else more
+    return KeysetPage(
+        items=rows,
+        next=_cursor(NEXT, rows[-1], ordering) if rows and has_next else None,
+        prev=_cursor(PREVIOUS, rows[0], ordering) if rows and has_prev else None,
+    )
+
+
+class CursorPagination(PaginationBase):
+    """Keyset pagination for ninja list endpoints
+
+    Use as @paginate(CursorPagination, ordering=((field, descending), ...)),
+    with a unique last field. Views return a queryset; responses carry the
+    page's items plus next/prev cursors.
+    """
+
+    class Input(Schema):
+        cursor: Optional[str] = None
+        limit: int = Field(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+
+    class Output(Schema):
+        items: List[Any]
+        next: Optional[str] = None
+        prev: Optional[str] = None
+
+    def __init__(self, ordering=(('created_at', True), ('id', True)), **kwargs):
+        self.ordering = tuple(ordering)
+        super().__init__(**kwargs)
+
+    def paginate_queryset(self, queryset, pagination: Input, **params):
+        page = keyset_paginate(queryset, self.ordering, pagination.cursor, pagination.limit)
+        return {"items": page.items, "next": page.next, "prev": page.prev}
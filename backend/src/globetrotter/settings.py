@@ -54,6 +54,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # Third party apps
     "ninja_extra",
     "ninja_jwt",
@@ -124,6 +125,60 @@ DATABASES = {
 #     }
 # }
 
+# Bulk endpoints accept thousands of rows per request
+DATA_UPLOAD_MAX_MEMORY_SIZE = config('DATA_UPLOAD_MAX_MEMORY_SIZE', default=10 * 1024 * 1024, cast=int)
+
+# Cache
+# CACHE_BACKEND=redis uses Django's Redis backend (requires the redis package),
+# anything else falls back to a per-process local-memory cache.
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHE_TIMEOUT = config('CACHE_TIMEOUT', default=300, cast=int)
+
+# Whether every worker process uses the same cache. Trip graphs, stats and public
+# snapshots are only cached when it does, since a write handled by one worker
+# could not invalidate the copies held by the others.
+CACHE_SHARED = config('CACHE_SHARED', default=CACHE_BACKEND == 'redis', cast=bool)
+
+# Keep hit/miss counters per cache namespace (see the cache_stats command).
+# Each counted lookup costs an extra cache round trip.
+CACHE_TRACK_STATS = config('CACHE_TRACK_STATS', default=False, cast=bool)
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": config('CACHE_URL', default='redis://localhost:6379/1'),
+            "TIMEOUT": CACHE_TIMEOUT,
+            "KEY_PREFIX": "globetrotter",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "globetrotter",
+            "TIMEOUT": CACHE_TIMEOUT,
+            "OPTIONS": {"MAX_ENTRIES": config('CACHE_MAX_ENTRIES', default=10000, cast=int)},
+        }
+    }
+
+# Buffer SharedItinerary view/copy counters in the cache and write them with the
+# flush_shared_counters command. Only useful with a cache shared by all workers;
+# otherwise each process buffers its own counts and writes them every
+# SHARED_COUNTERS_FLUSH_INTERVAL seconds (0 leaves them to the command/exit).
+# Those in-process counts are lost if a worker dies without running its exit
+# handlers (SIGKILL, OOM, some recycling), up to one interval's worth.
+SHARED_COUNTERS_BUFFERED = config('SHARED_COUNTERS_BUFFERED', default=CACHE_SHARED, cast=bool)
+SHARED_COUNTERS_FLUSH_INTERVAL = config('SHARED_COUNTERS_FLUSH_INTERVAL', default=60, cast=float)
+
+# Seconds between checks of the City change journal by each process's in-memory
+# city index (autocomplete and non-PostgreSQL city search). The journal lives in
+# the cache, so it is only kept with CACHE_SHARED; otherwise each process picks
+# up City writes made elsewhere by rebuilding its index every
+# CITY_INDEX_REBUILD_INTERVAL seconds.
+CITY_INDEX_SYNC_INTERVAL = config('CITY_INDEX_SYNC_INTERVAL', default=1.0, cast=float)
+CITY_INDEX_REBUILD_INTERVAL = config('CITY_INDEX_REBUILD_INTERVAL', default=300.0, cast=float)
+
 # Ninja JWT Settings
 NINJA_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
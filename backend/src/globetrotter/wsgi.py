@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "globetrotter.settings")
 
 application = get_wsgi_application()
+
+from trips.search import warm_city_index  # noqa: E402
+
+warm_city_index()
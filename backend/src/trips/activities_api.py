@@ -1,17 +1,31 @@
-from ninja import Router
+from ninja import Router, Query
+from ninja.pagination import paginate
 from ninja_jwt.authentication import JWTAuth
 from django.shortcuts import get_object_or_404
-from typing import List
-from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, TimeField, Value
+from django.db.models.functions import Coalesce
+from typing import List, Optional
+from datetime import date, time
 from .models import Stop, Activity
+from .budgeting import deferred_budget_updates
+from .itinerary import MAX_TIMELINE_DAYS, ItineraryTimeline
+from .conflicts import ACTIVITY_FIELDS as CONFLICT_ACTIVITY_FIELDS, new_activity_conflicts
+from .bulk import BULK_CREATE_BATCH_SIZE, collect_row_errors, bulk_error_response
 from .schemas import (
     ActivitySchema, ActivityCreateSchema, ActivityUpdateSchema,
-    BulkActivityCreateSchema
+    BulkActivityCreateSchema, BulkErrorResponseSchema, TripItinerarySchema
 )
 from authentication.schemas import MessageResponseSchema
+from globetrotter.pagination import CursorPagination, order_by_fields
+from globetrotter.streaming import STREAM_FORMATS, stream_queryset
 
 activities_router = Router(tags=["Activities"])
 
+# Itinerary order: stop by stop, then by start time with unscheduled activities last
+UNSCHEDULED_START = time(23, 59, 59)
+ACTIVITY_LIST_ORDERING = (('stop_order', False), ('stop_id', False), ('start_sort', False), ('id', False))
+
 # Activity CRUD endpoints
 @activities_router.get("/stops/{stop_id}/activities", response=List[ActivitySchema], auth=JWTAuth())
 def list_activities(request, stop_id: str):
@@ -20,6 +34,7 @@ def list_activities(request, stop_id: str):
     return list(stop.activities.all())
 
 @activities_router.post("/stops/{stop_id}/activities", response=ActivitySchema, auth=JWTAuth())
+@transaction.atomic
 def create_activity(request, stop_id: str, payload: ActivityCreateSchema):
     """Create a new activity in a stop"""
     stop = get_object_or_404(Stop, id=stop_id, trip__user=request.user)
@@ -38,6 +53,7 @@ def get_activity(request, activity_id: str):
     return activity
 
 @activities_router.put("/activities/{activity_id}", response=ActivitySchema, auth=JWTAuth())
+@transaction.atomic
 def update_activity(request, activity_id: str, payload: ActivityUpdateSchema):
     """Update activity details"""
     activity = get_object_or_404(Activity, id=activity_id, stop__trip__user=request.user)
@@ -56,20 +72,26 @@ def delete_activity(request, activity_id: str):
     return {"message": "Activity deleted successfully", "success": True}
 
 # Bulk operations for activities
-@activities_router.post("/stops/{stop_id}/activities/bulk", response=List[ActivitySchema], auth=JWTAuth())
+@activities_router.post("/stops/{stop_id}/activities/bulk", response={200: List[ActivitySchema], 400: BulkErrorResponseSchema}, auth=JWTAuth())
 def bulk_create_activities(request, stop_id: str, payload: BulkActivityCreateSchema):
-    """Create multiple activities at once"""
+    """Create multiple activities at once (all or nothing)"""
     stop = get_object_or_404(Stop, id=stop_id, trip__user=request.user)
     
-    created_activities = []
-    for activity_data in payload.activities:
-        activity = Activity.objects.create(
-            stop=stop,
-            **activity_data.dict()
-        )
-        created_activities.append(activity)
-    
-    return created_activities
+    activities = [Activity(stop=stop, **activity_data.dict()) for activity_data in payload.activities]
+    row_errors = collect_row_errors(activities, exclude=['stop'])
+    if not row_errors and payload.check_conflicts:
+        row_errors = new_activity_conflicts(stop, [
+            {field: getattr(activity, field) for field in CONFLICT_ACTIVITY_FIELDS} for activity in activities
+        ])
+    if row_errors:
+        return 400, bulk_error_response(row_errors)
+    
+    # bulk_create skips signals, so the budget is recomputed once on exit
+    with deferred_budget_updates() as pending:
+        Activity.objects.bulk_create(activities, batch_size=BULK_CREATE_BATCH_SIZE)
+        pending.add_trip(stop.trip_id)
+    
+    return activities
 
 # Activity management endpoints
 @activities_router.post("/activities/{activity_id}/book", response=ActivitySchema, auth=JWTAuth())
@@ -94,53 +116,59 @@ def mark_activity_paid(request, activity_id: str):
     
     return activity
 
+def trip_activities(trip, category=None):
+    """A trip's activities, annotated with the keys of ACTIVITY_LIST_ORDERING"""
+    activities = Activity.objects.filter(stop__trip=trip).annotate(
+        stop_order=F('stop__order_index'),
+        start_sort=Coalesce('start_time', Value(UNSCHEDULED_START), output_field=TimeField())
+    )
+    
+    if category:
+        activities = activities.filter(category=category)
+    
+    return activities
+
 @activities_router.get("/trips/{trip_id}/activities", response=List[ActivitySchema], auth=JWTAuth())
+@paginate(CursorPagination, ordering=ACTIVITY_LIST_ORDERING)
 def list_trip_activities(request, trip_id: str, category: str = None):
-    """List all activities in a trip, optionally filtered by category"""
+    """List a trip's activities in itinerary order, optionally filtered by category"""
     from .models import Trip
     
     trip = get_object_or_404(Trip, id=trip_id, user=request.user)
+    return trip_activities(trip, category)
+
+@activities_router.get("/trips/{trip_id}/activities/stream", response={400: MessageResponseSchema}, auth=JWTAuth())
+def stream_trip_activities(request, trip_id: str, category: str = None, format: str = "ndjson"):
+    """Stream all of a trip's activities in itinerary order as NDJSON or a JSON array"""
+    from .models import Trip
     
-    activities = Activity.objects.filter(stop__trip=trip)
-    
-    if category:
-        activities = activities.filter(category=category)
+    if format not in STREAM_FORMATS:
+        return 400, {"message": f"format must be one of: {', '.join(STREAM_FORMATS)}", "success": False}
     
-    return list(activities.order_by('stop__order_index', 'start_time'))
+    trip = get_object_or_404(Trip, id=trip_id, user=request.user)
+    activities = trip_activities(trip, category).order_by(*order_by_fields(ACTIVITY_LIST_ORDERING))
+    return stream_queryset(activities, ActivitySchema, format)
+
+@activities_router.get("/trips/{trip_id}/activities/by-date", response={200: TripItinerarySchema, 400: MessageResponseSchema}, auth=JWTAuth())
+def get_activities_by_date(
+    request, trip_id: str,
+    date_from: Optional[date] = Query(None, alias="from"), date_to: Optional[date] = Query(None, alias="to")
+):
+    """Get the trip's activities day by day, optionally between from and to
 
-@activities_router.get("/trips/{trip_id}/activities/by-date", response=dict, auth=JWTAuth())
-def get_activities_by_date(request, trip_id: str):
-    """Get activities grouped by date"""
+    Activities have no date, so their days are inferred from planning order and start times.
+    """
     from .models import Trip
-    from collections import defaultdict
     
-    trip = get_object_or_404(Trip, id=trip_id, user=request.user)
+    trip = get_object_or_404(Trip.objects.only('id', 'start_date', 'end_date'), id=trip_id, user=request.user)
+    timeline = ItineraryTimeline(trip, date_from, date_to)
+    
+    if timeline.last_day < timeline.first_day:
+        return 400, {"message": "'to' must not be before 'from'", "success": False}
+    if timeline.day_count > MAX_TIMELINE_DAYS:
+        return 400, {"message": f"Request at most {MAX_TIMELINE_DAYS} days at a time using 'from' and 'to'", "success": False}
     
-    activities_by_date = defaultdict(list)
-    
-    for stop in trip.stops.all():
-        stop_date = stop.start_date
-        for activity in stop.activities.all():
-            activities_by_date[str(stop_date)].append({
-                'id': activity.id,
-                'name': activity.name,
-                'category': activity.category,
-                'start_time': activity.start_time,
-                'end_time': activity.end_time,
-                'cost': activity.cost,
-                'location': f"{stop.city_name}, {stop.country}",
-                'is_booked': activity.is_booked,
-                'is_paid': activity.is_paid
-            })
-        
-        # If stop spans multiple days, add activities to each day
-        current_date = stop.start_date
-        while current_date <= stop.end_date:
-            if str(current_date) not in activities_by_date:
-                activities_by_date[str(current_date)] = []
-            current_date += timedelta(days=1)
-    
-    return dict(activities_by_date)
+    return timeline.as_dict()
 
 # Activity categories and filtering
 @activities_router.get("/activities/categories", response=List[dict])
@@ -52,10 +52,6 @@ class TripAdmin(admin.ModelAdmin):
         return obj.user.email
     user_email.short_description = 'User Email'
     user_email.admin_order_field = 'user__email'
-    
-    def stops_count(self, obj):
-        return obj.stops.count()
-    stops_count.short_description = 'Stops'
 
 @admin.register(Stop)
 class StopAdmin(admin.ModelAdmin):
@@ -94,10 +90,6 @@ class StopAdmin(admin.ModelAdmin):
         return obj.trip.name
     trip_name.short_description = 'Trip'
     trip_name.admin_order_field = 'trip__name'
-    
-    def activities_count(self, obj):
-        return obj.activities.count()
-    activities_count.short_description = 'Activities'
 
 @admin.register(Activity)
 class ActivityAdmin(admin.ModelAdmin):
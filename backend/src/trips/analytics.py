@@ -0,0 +1,106 @@
+"""
+Daily spend per budget category across many trips, for /trips/analytics.
+
+Costs are spread over days the same way as trips.stats: a stop's
+accommodation (stay) and activity totals over the stop's dates, and the
+trip-wide categories over the trip's dates. Every cost comes from one
+values_list query, a UNION ALL of one row per trip and one row per stop,
+each with a date range and a cost per category. The rows become NumPy
+columns and are spread with a difference array: each row adds its daily
+share on its first day and removes it after its last, and a cumulative sum
+over the days gives the series.
+"""
+
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import BooleanField, DecimalField, F, Value
+from django.db.models.functions import Coalesce
+
+from .models import Stop
+
+CATEGORIES = ('transport', 'stay', 'activity', 'meal', 'shopping', 'miscellaneous')
+
+# Budget categories not tied to a stop, read from the trip's budget
+TRIP_WIDE_CATEGORIES = ('transport', 'meal', 'shopping', 'miscellaneous')
+
+# Budget categories spread over a stop's dates, with the stop column they come from
+STOP_CATEGORIES = {'stay': 'accommodation_cost', 'activity': 'activities_cost'}
+
+
+def _amount(expression):
+    return Coalesce(expression, Value(Decimal('0.00')), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def cost_rows(trips):
+    """(is_trip, start_date, end_date, *CATEGORIES costs) rows of the trips and of their stops"""
+    zero = _amount(Value(None))
+    columns = ('is_trip', 'start_date', 'end_date', *(f'cost_{category}' for category in CATEGORIES))
+    kind = lambda is_trip: Value(is_trip, output_field=BooleanField())
+    trip_rows = trips.order_by().annotate(is_trip=kind(True), **{
+        f'cost_{category}': _amount(F(f'budget__{category}_cost')) if category in TRIP_WIDE_CATEGORIES else zero
+        for category in CATEGORIES
+    }).values_list(*columns)
+    stops = Stop.objects.filter(trip__in=trips.values('pk')).order_by()
+    stop_rows = stops.annotate(is_trip=kind(False), **{
+        f'cost_{category}': _amount(F(STOP_CATEGORIES[category])) if category in STOP_CATEGORIES else zero
+        for category in CATEGORIES
+    }).values_list(*columns)
+    return trip_rows.union(stop_rows, all=True)
+
+
+def daily_costs(rows, start_date=None, end_date=None):
+    """Spread cost rows over their days
+
+    Returns the number of trip rows, the days as datetime64[D] and a days x
+    CATEGORIES array of costs, limited to start_date..end_date when given.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0, np.array([], dtype='datetime64[D]'), np.zeros((0, len(CATEGORIES)))
+
+    is_trip, starts, ends, *costs = zip(*rows)
+    starts = np.array(starts, dtype='datetime64[D]')
+    ends = np.maximum(np.array(ends, dtype='datetime64[D]'), starts)
+    costs = np.array(costs, dtype=float).T
+
+    first_day = starts.min()
+    first = (starts - first_day).astype(int)
+    last = (ends - first_day).astype(int)
+    shares = costs / (last - first + 1)[:, None]
+
+    changes = np.zeros((last.max() + 2, len(CATEGORIES)))
+    np.add.at(changes, first, shares)
+    np.add.at(changes, last + 1, -shares)
+    by_day = np.cumsum(changes[:-1], axis=0)
+    days = first_day + np.arange(len(by_day))
+
+    keep = np.ones(len(days), dtype=bool)
+    if start_date:
+        keep &= days >= np.datetime64(start_date, 'D')
+    if end_date:
+        keep &= days <= np.datetime64(end_date, 'D')
+    return sum(is_trip), days[keep], by_day[keep]
+
+
+def trip_analytics(trips, start_date=None, end_date=None):
+    """TripAnalyticsResultSchema payload of a queryset of trips"""
+    trip_count, days, by_day = daily_costs(cost_rows(trips), start_date, end_date)
+    by_day = np.round(by_day, 2)
+    return {
+        "trip_count": trip_count,
+        "dates": days.astype(object).tolist(),
+        "cost_by_category": {category: by_day[:, index].tolist() for index, category in enumerate(CATEGORIES)},
+        "daily_totals": np.round(by_day.sum(axis=1), 2).tolist(),
+        "category_totals": dict(zip(CATEGORIES, np.round(by_day.sum(axis=0), 2).tolist())),
+    }
+
+
+def trips_in_range(trips, start_date=None, end_date=None):
+    """Trips with at least one day between start_date and end_date"""
+    if start_date:
+        trips = trips.filter(end_date__gte=start_date)
+    if end_date:
+        trips = trips.filter(start_date__lte=end_date)
+    return trips
+
@@ -1,7 +1,11 @@
-from ninja import Router
+import io
+
+from ninja import Router, File, Form
+from ninja.files import UploadedFile
+from ninja.pagination import paginate
 from ninja_jwt.authentication import JWTAuth
 from django.shortcuts import get_object_or_404
-from django.db.models import Count, Q
+from django.db.models import Q
 from typing import List, Optional
 from .models import (
     Trip, Stop, Activity, Budget, SharedItinerary, 
@@ -17,49 +21,122 @@ from .schemas import (
     TripTemplateSchema, TripTemplateCreateSchema,
     CitySchema, CityListSchema, CityCreateSchema, CityUpdateSchema,
     ActivityCatalogSchema, ActivityCatalogListSchema, ActivityCatalogCreateSchema,
-    TripStatsSchema, UserTripStatsSchema,
+    TripStatsSchema, UserTripStatsSchema, TripAnalyticsSchema, TripAnalyticsResultSchema, TripConflictsSchema,
     CitySearchSchema, ActivitySearchSchema, SearchFiltersSchema,
     BulkActivityCreateSchema, BulkStopCreateSchema,
-    TripExportSchema, TripImportSchema
+    TripExportSchema, TripImportSchema, TripImportResultSchema, BulkErrorResponseSchema
 )
+from .loaders import trip_graph_queryset, load_trip_graph
+from .cache import trip_cache, trip_scope
+from .stats import cached_trip_stats
+from .analytics import trip_analytics, trips_in_range
+from .conflicts import trip_conflicts
+from .exports import EXPORT_FORMATS, TripExport, export_response
+from .imports import TripImportError, ImportRejected, TripImporter, parse_documents
+from .bulk import bulk_error_response
 from authentication.schemas import MessageResponseSchema
+from globetrotter.pagination import CursorPagination, order_by_fields
+from globetrotter.streaming import STREAM_FORMATS, stream_queryset
 
 trips_router = Router(tags=["Trip Management"])
 
+TRIP_LIST_ORDERING = (('created_at', True), ('id', True))
+
+MAX_ANALYTICS_TRIPS = 1000
+
+def user_trips(user, status=None, is_public=None):
+    """The user's trips as listed by list_trips; counts and totals are stored on the rows"""
+    trips = Trip.objects.filter(user=user)
+    
+    if status:
+        trips = trips.filter(status=status)
+    if is_public is not None:
+        trips = trips.filter(is_public=is_public)
+    
+    return trips
+
 # Trip CRUD endpoints
 @trips_router.get("/trips", response=List[TripListSchema], auth=JWTAuth())
+@paginate(CursorPagination, ordering=TRIP_LIST_ORDERING)
 def list_trips(request, status: Optional[str] = None, is_public: Optional[bool] = None):
-    """List all trips for the authenticated user"""
-    trips = Trip.objects.filter(user=request.user).annotate(
-        stops_count=Count('stops'),
-        activities_count=Count('stops__activities')
-    )
+    """List the authenticated user's trips, newest first, one cursor page at a time"""
+    return user_trips(request.user, status, is_public)
+
+# Declared before /trips/{trip_id} so "stream" is not taken for a trip id
+@trips_router.get("/trips/stream", response={400: MessageResponseSchema}, auth=JWTAuth())
+def stream_trips(request, status: Optional[str] = None, is_public: Optional[bool] = None, format: str = "ndjson"):
+    """Stream all of the user's trips as NDJSON or a JSON array, newest first"""
+    if format not in STREAM_FORMATS:
+        return 400, {"message": f"format must be one of: {', '.join(STREAM_FORMATS)}", "success": False}
     
+    trips = user_trips(request.user, status, is_public).order_by(*order_by_fields(TRIP_LIST_ORDERING))
+    return stream_queryset(trips, TripListSchema, format)
+
+def export_error(payload):
+    if payload.format not in EXPORT_FORMATS:
+        return {"message": f"Unsupported export format '{payload.format}', use one of: {', '.join(EXPORT_FORMATS)}", "success": False}
+    return None
+
+# Declared before /trips/{trip_id} for the same reason as /trips/stream
+@trips_router.post("/trips/export", response={400: MessageResponseSchema}, auth=JWTAuth())
+def export_trips(request, payload: TripExportSchema, status: Optional[str] = None):
+    """Download all of the user's trips as one JSON document, NDJSON records or CSV rows"""
+    error = export_error(payload)
+    if error:
+        return 400, error
+    
+    trips = Trip.objects.filter(user=request.user)
     if status:
         trips = trips.filter(status=status)
-    if is_public is not None:
-        trips = trips.filter(is_public=is_public)
     
-    result = []
-    for trip in trips:
-        trip_data = {
-            'id': trip.id,
-            'name': trip.name,
-            'description': trip.description,
-            'start_date': trip.start_date,
-            'end_date': trip.end_date,
-            'cover_image': trip.cover_image,
-            'status': trip.status,
-            'estimated_budget': trip.estimated_budget,
-            'currency': trip.currency,
-            'stops_count': trip.stops_count,
-            'activities_count': trip.activities_count,
-            'duration_days': (trip.end_date - trip.start_date).days + 1,
-            'created_at': trip.created_at
-        }
-        result.append(trip_data)
-    
-    return result
+    export = TripExport(trips, payload.include_activities, payload.include_budget, payload.include_notes)
+    return export_response(export, payload.format, 'trips')
+
+# Declared before /trips/{trip_id} for the same reason as /trips/stream
+@trips_router.post("/trips/analytics", response={200: TripAnalyticsResultSchema, 400: MessageResponseSchema}, auth=JWTAuth())
+def trip_cost_analytics(request, payload: TripAnalyticsSchema):
+    """Daily spend per budget category across the given trips and/or the trips in a date range"""
+    if not payload.trip_ids and not (payload.start_date or payload.end_date):
+        return 400, {"message": "Provide trip_ids, a date range, or both", "success": False}
+    if payload.start_date and payload.end_date and payload.end_date < payload.start_date:
+        return 400, {"message": "end_date must not be before start_date", "success": False}
+    if len(payload.trip_ids) > MAX_ANALYTICS_TRIPS:
+        return 400, {"message": f"At most {MAX_ANALYTICS_TRIPS} trip_ids per request", "success": False}
+    
+    trips = Trip.objects.filter(user=request.user)
+    if payload.trip_ids:
+        trips = trips.filter(id__in=payload.trip_ids)
+    trips = trips_in_range(trips, payload.start_date, payload.end_date)
+    return trip_analytics(trips, payload.start_date, payload.end_date)
+
+def run_import(user, source_format, merge_with_existing, data=None, lines=None):
+    """Import parsed trip documents, returning the endpoint response"""
+    try:
+        documents = parse_documents(source_format, data=data, lines=lines)
+        counts = TripImporter(user, merge_with_existing).run(documents)
+    except TripImportError as exc:
+        return 400, {"message": str(exc), "success": False}
+    except ImportRejected as exc:
+        return 400, bulk_error_response(exc.row_errors)
+    
+    return {
+        "message": f"Imported {counts['trips_created']} new and {counts['trips_updated']} updated trip(s)",
+        "success": True,
+        **counts
+    }
+
+# Declared before /trips/{trip_id} for the same reason as /trips/stream
+@trips_router.post("/trips/import", response={200: TripImportResultSchema, 400: BulkErrorResponseSchema}, auth=JWTAuth())
+def import_trips(request, payload: TripImportSchema):
+    """Import trips from an exported JSON document, or NDJSON/CSV text in data["content"]"""
+    return run_import(request.user, payload.source_format, payload.merge_with_existing, data=payload.data)
+
+@trips_router.post("/trips/import/upload", response={200: TripImportResultSchema, 400: BulkErrorResponseSchema}, auth=JWTAuth())
+def import_trips_file(request, file: UploadedFile = File(...), source_format: Optional[str] = Form(None), merge_with_existing: bool = Form(False)):
+    """Import trips from an uploaded export file, read line by line for NDJSON and CSV"""
+    source_format = source_format or file.name.rsplit('.', 1)[-1].lower()
+    lines = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+    return run_import(request.user, source_format, merge_with_existing, lines=lines)
 
 @trips_router.post("/trips", response=TripSchema, auth=JWTAuth())
 def create_trip(request, payload: TripCreateSchema):
@@ -69,21 +146,21 @@ def create_trip(request, payload: TripCreateSchema):
         **payload.dict()
     )
     
-    # Create default budget
-    Budget.objects.create(trip=trip, currency=trip.currency)
+    # Create default budget (normally already done by the post_save signal)
+    Budget.objects.get_or_create(trip=trip, defaults={'currency': trip.currency})
     
-    return get_trip_with_relations(trip)
+    return get_trip_with_relations(load_trip_graph(trip))
 
 @trips_router.get("/trips/{trip_id}", response=TripSchema, auth=JWTAuth())
 def get_trip(request, trip_id: str):
     """Get trip details with all related data"""
-    trip = get_object_or_404(Trip, id=trip_id, user=request.user)
-    return get_trip_with_relations(trip)
+    trip = get_object_or_404(Trip.objects.only('id'), id=trip_id, user=request.user)
+    return get_cached_trip_payload(trip.id)
 
 @trips_router.put("/trips/{trip_id}", response=TripSchema, auth=JWTAuth())
 def update_trip(request, trip_id: str, payload: TripUpdateSchema):
     """Update trip details"""
-    trip = get_object_or_404(Trip, id=trip_id, user=request.user)
+    trip = get_object_or_404(trip_graph_queryset(), id=trip_id, user=request.user)
     
     for attr, value in payload.dict(exclude_unset=True).items():
         setattr(trip, attr, value)
@@ -98,6 +175,17 @@ def delete_trip(request, trip_id: str):
     trip.delete()
     return {"message": "Trip deleted successfully", "success": True}
 
+@trips_router.post("/trips/{trip_id}/export", response={400: MessageResponseSchema}, auth=JWTAuth())
+def export_trip(request, trip_id: str, payload: TripExportSchema):
+    """Download a trip with its stops, activities and budget as JSON, NDJSON or CSV"""
+    error = export_error(payload)
+    if error:
+        return 400, error
+    
+    trip = get_object_or_404(Trip.objects.only('id'), id=trip_id, user=request.user)
+    export = TripExport(Trip.objects.filter(id=trip.id), payload.include_activities, payload.include_budget, payload.include_notes)
+    return export_response(export, payload.format, f'trip-{trip.id}', single=True)
+
 # Trip sharing endpoints
 @trips_router.post("/trips/{trip_id}/share", response=ShareResponseSchema, auth=JWTAuth())
 def share_trip(request, trip_id: str, payload: SharedItineraryCreateSchema):
@@ -120,59 +208,39 @@ def share_trip(request, trip_id: str, payload: SharedItineraryCreateSchema):
         "expires_at": shared.expires_at
     }
 
-@trips_router.get("/trips/{trip_id}/stats", response=TripStatsSchema, auth=JWTAuth())
+@trips_router.get("/trips/{trip_id}/stats", response={200: TripStatsSchema, 400: MessageResponseSchema}, auth=JWTAuth())
 def get_trip_stats(request, trip_id: str):
     """Get detailed statistics for a trip"""
-    trip = get_object_or_404(Trip, id=trip_id, user=request.user)
-    budget = getattr(trip, 'budget', None)
+    get_object_or_404(Trip.objects.only('id'), id=trip_id, user=request.user)
+    stats = cached_trip_stats(trip_id)
     
-    if not budget:
+    if stats is None:
         return 400, {"message": "Trip budget not found", "success": False}
     
-    # Calculate cost by category
-    cost_by_category = {
-        'transport': float(budget.transport_cost),
-        'stay': float(budget.stay_cost),
-        'activity': float(budget.activity_cost),
-        'meal': float(budget.meal_cost),
-        'shopping': float(budget.shopping_cost),
-        'miscellaneous': float(budget.miscellaneous_cost)
-    }
-    
-    # Calculate cost by stop
-    cost_by_stop = {}
-    for stop in trip.stops.all():
-        stop_cost = float(stop.accommodation_cost or 0)
-        for activity in stop.activities.all():
-            stop_cost += float(activity.cost or 0)
-        cost_by_stop[f"{stop.city_name}, {stop.country}"] = stop_cost
-    
-    # Calculate daily average
-    total_cost = float(budget.total_cost)
-    duration = (trip.end_date - trip.start_date).days + 1
-    daily_average = total_cost / duration if duration > 0 else 0
-    
-    # Find most expensive day (simplified - could be enhanced)
-    most_expensive_day = trip.start_date  # Placeholder
-    
-    # Calculate budget utilization
-    budget_utilization = 0.0
-    if budget.total_limit:
-        budget_utilization = (total_cost / float(budget.total_limit)) * 100
-    
-    return {
-        "total_cost": total_cost,
-        "cost_by_category": cost_by_category,
-        "cost_by_stop": cost_by_stop,
-        "daily_average": daily_average,
-        "most_expensive_day": most_expensive_day,
-        "budget_utilization": budget_utilization
-    }
+    return stats
+
+@trips_router.get("/trips/{trip_id}/conflicts", response=TripConflictsSchema, auth=JWTAuth())
+def get_trip_conflicts(request, trip_id: str):
+    """Find overlapping stops and overlapping activities in a trip"""
+    trip = get_object_or_404(Trip.objects.only('id'), id=trip_id, user=request.user)
+    return trip_conflicts(trip.id)
 
 # Helper function to get trip with all relations
+def get_cached_trip_payload(trip_id):
+    """Serialized trip graph, cached until the trip or anything in it changes"""
+    def build():
+        trip = trip_graph_queryset().get(id=trip_id)
+        return TripSchema.model_validate(get_trip_with_relations(trip)).model_dump()
+    
+    return trip_cache.get_or_set(trip_scope(trip_id), ('detail',), build)
+
 def get_trip_with_relations(trip):
-    """Helper function to serialize trip with all related data"""
-    stops = trip.stops.all().annotate(activities_count=Count('activities'))
+    """Helper function to serialize trip with all related data
+
+    Expects the trip to come from loaders.trip_graph_queryset() or
+    loaders.load_trip_graph() so no further queries are issued here.
+    """
+    stops = [get_stop_with_relations(stop) for stop in trip.stops.all()]
     budget = getattr(trip, 'budget', None)
     
     trip_data = {
@@ -191,7 +259,7 @@ def get_trip_with_relations(trip):
         'auto_calculate_budget': trip.auto_calculate_budget,
         'created_at': trip.created_at,
         'updated_at': trip.updated_at,
-        'stops': [get_stop_with_relations(stop) for stop in stops],
+        'stops': stops,
         'budget': {
             'id': budget.id,
             'transport_cost': budget.transport_cost,
@@ -213,8 +281,10 @@ def get_trip_with_relations(trip):
             'created_at': budget.created_at,
             'updated_at': budget.updated_at
         } if budget else None,
-        'stops_count': stops.count(),
-        'activities_count': sum(stop.activities.count() for stop in stops),
+        'stops_count': len(stops),
+        'activities_count': sum(stop['activities_count'] for stop in stops),
+        'activities_cost': trip.activities_cost,
+        'accommodation_cost': trip.accommodation_cost,
         'duration_days': (trip.end_date - trip.start_date).days + 1
     }
     
@@ -240,6 +310,7 @@ def get_stop_with_relations(stop):
         'accommodation_cost': stop.accommodation_cost,
         'activities': activities,
         'activities_count': len(activities),
+        'activities_cost': stop.activities_cost,
         'duration_days': (stop.end_date - stop.start_date).days + 1,
         'created_at': stop.created_at,
         'updated_at': stop.updated_at
@@ -3,6 +3,8 @@ from ninja_jwt.authentication import JWTAuth
 from django.shortcuts import get_object_or_404
 from typing import List
 from .models import Trip, Budget
+from .budgeting import recalculate_budgets
+from .cache import invalidate_trip
 from .schemas import BudgetSchema, BudgetCreateSchema, BudgetUpdateSchema
 from authentication.schemas import MessageResponseSchema
 
@@ -154,24 +156,10 @@ def recalculate_budget(request, trip_id: str):
     trip = get_object_or_404(Trip, id=trip_id, user=request.user)
     budget, created = Budget.objects.get_or_create(trip=trip, defaults={'currency': trip.currency})
     
-    # Calculate from actual trip data
-    total_activity_cost = 0
-    total_stay_cost = 0
-    
-    for stop in trip.stops.all():
-        # Add accommodation costs
-        if stop.accommodation_cost:
-            total_stay_cost += float(stop.accommodation_cost)
-        
-        # Add activity costs
-        for activity in stop.activities.all():
-            if activity.cost:
-                total_activity_cost += float(activity.cost)
-    
-    # Update budget with calculated values
-    budget.activity_cost = total_activity_cost
-    budget.stay_cost = total_stay_cost
-    budget.save()
+    # Calculate from actual trip data with DB-side aggregates
+    recalculate_budgets(Budget.objects.filter(pk=budget.pk))
+    invalidate_trip(trip.id)
+    budget.refresh_from_db()
     
     return {
         'id': budget.id,
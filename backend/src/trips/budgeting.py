@@ -0,0 +1,153 @@
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
+from .models import Trip, Budget, Stop, Activity
+from .cache import invalidate_trip
+from .totals import recalculate_totals, shift_activity_totals, shift_trip_totals
+
+ZERO = Decimal('0.00')
+
+_deferred = threading.local()
+
+# Sent with trip_ids once a deferred block has recomputed those trips' budgets
+# and totals, which bypasses the model signals other apps listen to
+trips_recalculated = Signal()
+
+
+def as_amount(value):
+    """Normalize an optional cost value to a Decimal"""
+    if value is None:
+        return ZERO
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def auto_budgets():
+    """Budgets whose costs are maintained from stops and activities"""
+    return Budget.objects.filter(trip__auto_calculate_budget=True)
+
+
+def apply_activity_cost_delta(stop_id, delta, count=0):
+    """Shift activity_cost of the budget owning a stop by delta in one UPDATE
+
+    The activity totals of the stop and its trip move by count and delta too.
+    """
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending.add_stop(stop_id)
+        return 0
+    shift_activity_totals(stop_id, count, delta)
+    if not delta:
+        return 0
+    return auto_budgets().filter(trip__stops__id=stop_id).update(
+        activity_cost=F('activity_cost') + delta,
+        updated_at=timezone.now()
+    )
+
+
+def apply_stay_cost_delta(trip_id, delta, **totals):
+    """Shift stay_cost of a trip's budget by delta in one UPDATE
+
+    The trip's accommodation_cost moves by delta, and its other totals by the
+    given amounts (see totals.TRIP_TOTAL_FIELDS).
+    """
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending.add_trip(trip_id)
+        return 0
+    shift_trip_totals(trip_id, accommodation_cost=delta, **totals)
+    if not delta:
+        return 0
+    return auto_budgets().filter(trip_id=trip_id).update(
+        stay_cost=F('stay_cost') + delta,
+        updated_at=timezone.now()
+    )
+
+
+def _cost_total(queryset, group_by, field):
+    total = queryset.order_by().values(group_by).annotate(total=Sum(field)).values('total')
+    return Coalesce(
+        Subquery(total), Value(ZERO),
+        output_field=DecimalField(max_digits=10, decimal_places=2)
+    )
+
+
+def activity_cost_total():
+    """DB-side sum of activity costs for the trip of the outer Budget row"""
+    return _cost_total(Activity.objects.filter(stop__trip_id=OuterRef('trip_id')), 'stop__trip', 'cost')
+
+
+def stay_cost_total():
+    """DB-side sum of accommodation costs for the trip of the outer Budget row"""
+    return _cost_total(Stop.objects.filter(trip_id=OuterRef('trip_id')), 'trip', 'accommodation_cost')
+
+
+def recalculate_budgets(budgets):
+    """Recompute activity and stay costs of the given budgets with a single UPDATE"""
+    return budgets.update(
+        activity_cost=activity_cost_total(),
+        stay_cost=stay_cost_total(),
+        updated_at=timezone.now()
+    )
+
+
+class PendingBudgets:
+    """Trips whose budgets must be recomputed when a deferred block exits"""
+
+    def __init__(self):
+        self.trip_ids = set()
+        self.stop_ids = set()
+
+    def add_trip(self, trip_id):
+        self.trip_ids.add(trip_id)
+
+    def add_stop(self, stop_id):
+        self.stop_ids.add(stop_id)
+
+    def flush(self):
+        trip_ids = set(self.trip_ids)
+        if self.stop_ids:
+            trip_ids.update(
+                Stop.objects.filter(id__in=self.stop_ids).values_list('trip_id', flat=True)
+            )
+        self.trip_ids.clear()
+        self.stop_ids.clear()
+        if not trip_ids:
+            return 0
+        recalculate_totals(trip_ids)
+        updated = recalculate_budgets(auto_budgets().filter(trip_id__in=trip_ids))
+        for trip_id in trip_ids:
+            invalidate_trip(trip_id)
+        trips_recalculated.send(sender=PendingBudgets, trip_ids=trip_ids)
+        return updated
+
+
+@contextmanager
+def deferred_budget_updates():
+    """Suppress per-row budget deltas and recompute each touched budget once on exit
+
+    Trip and stop totals (see totals.py) are deferred and recomputed the same way.
+
+    Works as a context manager or decorator. The yielded PendingBudgets can be
+    used to register trips changed by code that bypasses signals (bulk_create,
+    queryset.update). The block runs in its own transaction.atomic(), so rows
+    written by a block that raises are rolled back with the deltas they skipped.
+    Nested blocks join the outermost one.
+    """
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        yield pending
+        return
+
+    pending = PendingBudgets()
+    with transaction.atomic():
+        _deferred.pending = pending
+        try:
+            yield pending
+        finally:
+            _deferred.pending = None
+        pending.flush()
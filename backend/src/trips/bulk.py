@@ -0,0 +1,27 @@
+from django.core.exceptions import ValidationError
+
+# Rows per INSERT statement for bulk endpoints
+BULK_CREATE_BATCH_SIZE = 500
+
+
+def collect_row_errors(instances, exclude=None):
+    """Validate unsaved model instances without touching the database
+
+    Returns a list of {'index', 'errors'} entries, empty if every row is valid.
+    Uniqueness checks are skipped since they would cost a query per row.
+    """
+    row_errors = []
+    for index, instance in enumerate(instances):
+        try:
+            instance.full_clean(exclude=exclude, validate_unique=False, validate_constraints=False)
+        except ValidationError as exc:
+            row_errors.append({'index': index, 'errors': exc.message_dict})
+    return row_errors
+
+
+def bulk_error_response(row_errors):
+    return {
+        "message": f"{len(row_errors)} row(s) failed validation, nothing was created",
+        "success": False,
+        "errors": row_errors
+    }
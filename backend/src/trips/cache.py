@@ -0,0 +1,31 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from globetrotter.cache import CacheNamespace
+
+# Cached trip graphs and derived data, versioned per trip
+trip_cache = CacheNamespace('trips', timeout=settings.CACHE_TIMEOUT, shared_only=True)
+
+# City and activity catalog searches, versioned per catalog
+search_cache = CacheNamespace('search', timeout=settings.CACHE_TIMEOUT)
+
+# Anonymous /public endpoints
+public_cache = CacheNamespace('public', timeout=settings.CACHE_TIMEOUT, shared_only=True)
+
+CACHE_NAMESPACES = [trip_cache, search_cache, public_cache]
+
+
+def trip_scope(trip_id):
+    return f"trip-{trip_id}"
+
+
+def invalidate_trip(trip_id):
+    """Bump a trip's cache version after writes that bypass model signals
+
+    Bumped again on commit, like version_on_change(), so a graph cached from
+    pre-commit data by a concurrent read does not survive.
+    """
+    trip_cache.bump(trip_scope(trip_id))
+    transaction.on_commit(partial(trip_cache.bump, trip_scope(trip_id)))
+
@@ -0,0 +1,257 @@
+"""
+ActivityCatalog search.
+
+On PostgreSQL text queries match a weighted tsvector kept in search_vector
+(GIN indexed): name is weighted A, tags, location and city B, description C.
+Other backends emulate the same weights with icontains. Results are keyset
+paginated and come with facet counts for category, difficulty and cost.
+The city filter is a case-insensitive substring match, backed on PostgreSQL
+by a trigram index on UPPER(city_name). Radius queries go through the geohash column, see trips.geo.
+"""
+
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+import numpy as np
+
+from django.db import connection
+from django.db.models import Case, Count, DecimalField, F, FloatField, Q, TextField, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from globetrotter.pagination import keyset_paginate
+from .models import ActivityCatalog
+from .geo import bounding_boxes, covering_cells, encode_geohash, haversine_km
+
+SEARCH_CONFIG = 'english'
+
+# Field weights, matching ts_rank's defaults for weights A, B and C
+WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2}
+WEIGHTED_FIELDS = (
+    ('name', 'A'),
+    ('tags_text', 'B'),
+    ('location_name', 'B'),
+    ('city_name', 'B'),
+    ('description', 'C'),
+)
+
+COST_BUCKETS = (
+    ('free', Q(average_cost=0)),
+    ('under_25', Q(average_cost__gt=0, average_cost__lt=25)),
+    ('25_to_50', Q(average_cost__gte=25, average_cost__lt=50)),
+    ('50_to_100', Q(average_cost__gte=50, average_cost__lt=100)),
+    ('100_plus', Q(average_cost__gte=100)),
+)
+
+# Unrated activities sort as 0; the same expression backs activity_catalog_rank_idx
+RATING_SORT = Coalesce('rating', Value(Decimal('0')), output_field=DecimalField(max_digits=3, decimal_places=2))
+
+BROWSE_ORDERING = (('rating_sort', True), ('review_count', True), ('id', False))
+TEXT_ORDERING = (('rank', True), ('id', False))
+
+MAX_NEARBY_RADIUS_KM = 50
+MAX_NEARBY_RESULTS = 100
+
+RESULT_FIELDS = (
+    'id', 'name', 'category', 'description', 'city_name', 'country',
+    'average_cost', 'estimated_duration_minutes', 'rating', 'review_count', 'image_urls'
+)
+
+
+def activity_search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(Cast('tags', TextField()), 'location_name', 'city_name', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(queryset):
+    """Recompute search_vector for the given activities; a no-op off PostgreSQL"""
+    if connection.vendor != 'postgresql':
+        return 0
+    return queryset.update(search_vector=activity_search_vector())
+
+
+def _text_search(queryset, query):
+    """Activities matching query, annotated with a float rank"""
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+        # Cast to double precision so ranks survive the round trip through a cursor
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+        )
+
+    queryset = queryset.annotate(tags_text=Cast('tags', TextField()))
+    rank = Value(0.0)
+    for term in query.split():
+        matches = Q()
+        for field, weight in WEIGHTED_FIELDS:
+            lookup = {f"{field}__icontains": term}
+            matches |= Q(**lookup)
+            rank = rank + Case(When(**lookup, then=Value(WEIGHTS[weight])), default=Value(0.0))
+        queryset = queryset.filter(matches)
+    return queryset.annotate(rank=Cast(rank, FloatField()))
+
+
+def _matching(query, city):
+    activities = ActivityCatalog.objects.filter(is_verified=True)
+    if city:
+        activities = activities.filter(city_name__icontains=city)
+    if query:
+        activities = _text_search(activities, query)
+    return activities
+
+
+def _facet_filters(category, difficulty, min_cost, max_cost):
+    cost = Q()
+    if min_cost is not None:
+        cost &= Q(average_cost__gte=min_cost)
+    if max_cost is not None:
+        cost &= Q(average_cost__lte=max_cost)
+    return {
+        'category': Q(category=category) if category else Q(),
+        'difficulty': Q(difficulty_level=difficulty) if difficulty else Q(),
+        'cost': cost,
+    }
+
+
+def _others(filters, facet):
+    return [condition for name, condition in filters.items() if name != facet]
+
+
+def _facet_counts(activities, filters):
+    """Counts per category, difficulty and cost bucket in a single aggregate query
+
+    Each facet is counted with the other facets' filters applied but not its
+    own, so the counts show what selecting another value would return.
+    """
+    counts = {}
+    for value, _ in ActivityCatalog.CATEGORY_CHOICES:
+        counts[f"category:{value}"] = Q(*_others(filters, 'category'), category=value)
+    for value, _ in ActivityCatalog.DIFFICULTY_CHOICES:
+        counts[f"difficulty:{value}"] = Q(*_others(filters, 'difficulty'), difficulty_level=value)
+    for bucket, condition in COST_BUCKETS:
+        counts[f"cost:{bucket}"] = Q(condition, *_others(filters, 'cost'))
+
+    totals = activities.aggregate(**{
+        key: Count('pk', filter=condition) for key, condition in counts.items()
+    })
+
+    facets = {'category': {}, 'difficulty': {}, 'cost': {}}
+    for key, total in totals.items():
+        facet, value = key.split(':', 1)
+        if total:
+            facets[facet][value] = total
+    return facets
+
+
+def activity_facets(query='', city='', category='', difficulty='', min_cost=None, max_cost=None):
+    activities = _matching(query, city)
+    return _facet_counts(activities, _facet_filters(category, difficulty, min_cost, max_cost))
+
+
+def search_activity_catalog(query='', city='', category='', difficulty='', min_cost=None, max_cost=None,
+                            cursor=None, limit=20):
+    """One page of matching activities and the cursors of the pages around it
+
+    Text queries are ordered by relevance, browsing by rating and review count.
+    Raises InvalidCursor for malformed cursors.
+    """
+    activities = _matching(query, city)
+    filters = _facet_filters(category, difficulty, min_cost, max_cost)
+    activities = activities.filter(*filters.values()).only(*RESULT_FIELDS)
+
+    if query:
+        ordering = TEXT_ORDERING
+    else:
+        activities = activities.annotate(rating_sort=RATING_SORT)
+        ordering = BROWSE_ORDERING
+
+    page = keyset_paginate(activities, ordering, cursor, limit)
+    return {"items": [_as_result(activity) for activity in page.items], "next": page.next, "prev": page.prev}
+
+
+def nearby_params_error(latitude, longitude, radius_km):
+    """Message describing invalid nearby search parameters, or None"""
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        return "Latitude must be within [-90, 90] and longitude within [-180, 180]"
+    if not 0 < radius_km <= MAX_NEARBY_RADIUS_KM:
+        return f"radius_km must be greater than 0 and at most {MAX_NEARBY_RADIUS_KM}"
+    return None
+
+
+def nearby_activities(latitude, longitude, radius_km, category='', limit=20):
+    """Verified activities within radius_km of a point, nearest first
+
+    At most MAX_NEARBY_RESULTS are returned. Candidates come from indexed geohash prefix lookups over the cells covering
+    the bounding box; exact distances are then computed in one numpy pass.
+    """
+    boxes = bounding_boxes(latitude, longitude, radius_km)
+    in_cells = reduce(or_, (Q(geohash__startswith=cell) for cell in covering_cells(boxes)))
+    in_boxes = reduce(or_, (
+        Q(latitude__range=(min_lat, max_lat), longitude__range=(min_lng, max_lng))
+        for min_lat, max_lat, min_lng, max_lng in boxes
+    ))
+
+    candidates = ActivityCatalog.objects.filter(in_cells, in_boxes, is_verified=True)
+    if category:
+        candidates = candidates.filter(category=category)
+    rows = list(candidates.values_list('id', 'latitude', 'longitude'))
+    if not rows:
+        return []
+
+    ids, latitudes, longitudes = zip(*rows)
+    distances = haversine_km(latitude, longitude, latitudes, longitudes)
+    within = np.flatnonzero(distances <= radius_km)
+    limit = max(1, min(limit, MAX_NEARBY_RESULTS))
+    nearest = within[np.argsort(distances[within], kind='stable')][:limit]
+
+    activities = ActivityCatalog.objects.only(*RESULT_FIELDS, 'latitude', 'longitude').in_bulk([ids[i] for i in nearest])
+    return [
+        {
+            **_as_result(activities[ids[i]]),
+            "latitude": float(latitudes[i]),
+            "longitude": float(longitudes[i]),
+            "distance_km": round(float(distances[i]), 3)
+        }
+        for i in nearest
+    ]
+
+
+def refresh_geohashes(queryset, batch_size=2000):
+    """Recompute the geohash column, for rows written without save()"""
+    updated = 0
+    batch = []
+    for activity in queryset.only('id', 'latitude', 'longitude', 'geohash').iterator(chunk_size=batch_size):
+        geohash = ''
+        if activity.latitude is not None and activity.longitude is not None:
+            geohash = encode_geohash(float(activity.latitude), float(activity.longitude))
+        if geohash != activity.geohash:
+            activity.geohash = geohash
+            batch.append(activity)
+        if len(batch) >= batch_size:
+            updated += queryset.model.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        updated += queryset.model.objects.bulk_update(batch, ['geohash'])
+    return updated
+
+
+def _as_result(activity):
+    return {
+        "id": activity.id,
+        "name": activity.name,
+        "category": activity.category,
+        "description": activity.description,
+        "city_name": activity.city_name,
+        "country": activity.country,
+        "estimated_cost": float(activity.average_cost) if activity.average_cost else None,
+        "duration_minutes": activity.estimated_duration_minutes,
+        "rating": float(activity.rating) if activity.rating else None,
+        "image_url": activity.image_urls[0] if activity.image_urls else None
+    }
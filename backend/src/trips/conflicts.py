@@ -0,0 +1,186 @@
+"""
+Schedule conflicts: stops whose dates overlap within a trip, and activities
+of the same stop whose times overlap.
+
+Both checks sort the intervals and sweep them once, O(n log n) per trip.
+The sweep keeps the interval reaching furthest so far and reports every
+interval that starts before it ends, so each overlapping interval is
+reported once, against that interval, rather than against every interval
+it touches.
+
+Intervals are half-open. A stop's last day is its check-out day, so the
+next stop may start on it. An activity runs from start_time to end_time,
+or for duration_minutes when it has no end time. One ending at or before
+its start runs to midnight. Activities without a start time are not
+scheduled and never conflict. Activities have no date, so every activity of
+a stop is compared with every other one by time of day alone; the inferred
+days of trips.itinerary are deliberately not used.
+"""
+
+from datetime import time
+
+from .models import Stop, Activity
+
+STOP_FIELDS = ('id', 'city_name', 'country', 'start_date', 'end_date')
+ACTIVITY_FIELDS = ('id', 'stop_id', 'name', 'start_time', 'end_time', 'duration_minutes')
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+def sweep_overlaps(intervals):
+    """(earlier, later, overlap_start, overlap_end) for overlapping (group, start, end, item) intervals
+
+    Only intervals of the same group can overlap.
+    """
+    group = reach = None
+    for interval_group, start, end, item in sorted(intervals, key=lambda interval: interval[:3]):
+        if reach is None or interval_group != group:
+            group, reach = interval_group, (end, item)
+            continue
+        reach_end, reach_item = reach
+        if start < reach_end:
+            yield reach_item, item, start, min(end, reach_end)
+        if end > reach_end:
+            reach = (end, item)
+
+
+def _seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _time(seconds):
+    return time.max if seconds >= DAY_SECONDS else time(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def activity_span(activity):
+    """(start, end) of an activity in seconds since midnight, or None if it is not scheduled"""
+    if activity['start_time'] is None:
+        return None
+    start = _seconds(activity['start_time'])
+    if activity['end_time'] is not None:
+        end = _seconds(activity['end_time'])
+        if end <= start:
+            end = DAY_SECONDS
+    elif activity['duration_minutes']:
+        end = min(start + activity['duration_minutes'] * 60, DAY_SECONDS)
+    else:
+        end = start
+    return start, end
+
+
+def _location(stop):
+    return f"{stop['city_name']}, {stop['country']}"
+
+
+def stop_conflicts(stops):
+    """Overlapping stops of one trip, given as dicts with STOP_FIELDS"""
+    intervals = ((None, stop['start_date'], stop['end_date'], stop) for stop in stops)
+    return [
+        {
+            "first_stop_id": first['id'],
+            "first_location": _location(first),
+            "second_stop_id": second['id'],
+            "second_location": _location(second),
+            "overlap_start": start,
+            "overlap_end": end,
+        }
+        for first, second, start, end in sweep_overlaps(intervals)
+    ]
+
+
+def _activity_intervals(stop, activities):
+    for activity in activities:
+        span = activity_span(activity)
+        if span is not None:
+            yield stop['id'], span[0], span[1], activity
+
+
+def activity_conflicts(stops, activities_by_stop):
+    """Overlapping activities of the same stop
+
+    activities_by_stop maps stop ids to dicts with ACTIVITY_FIELDS.
+    """
+    intervals = [
+        interval for stop in stops
+        for interval in _activity_intervals(stop, activities_by_stop.get(stop['id'], []))
+    ]
+    return [
+        {
+            "stop_id": first['stop_id'],
+            "first_activity_id": first['id'],
+            "first_name": first['name'],
+            "second_activity_id": second['id'],
+            "second_name": second['name'],
+            "overlap_start": _time(start),
+            "overlap_end": _time(end),
+        }
+        for first, second, start, end in sweep_overlaps(intervals)
+    ]
+
+
+def load_schedule(trip_id):
+    """The trip's stops and its activities by stop, with one query each"""
+    stops = list(Stop.objects.filter(trip_id=trip_id).values(*STOP_FIELDS))
+    activities_by_stop = {stop['id']: [] for stop in stops}
+    activities = Activity.objects.filter(stop__trip_id=trip_id).order_by('stop_id', 'start_time', 'id').values(
+        *ACTIVITY_FIELDS
+    )
+    for activity in activities:
+        activities_by_stop[activity['stop_id']].append(activity)
+    return stops, activities_by_stop
+
+
+def trip_conflicts(trip_id):
+    """TripConflictsSchema payload of a trip"""
+    stops, activities_by_stop = load_schedule(trip_id)
+    stop_overlaps = stop_conflicts(stops)
+    activity_overlaps = activity_conflicts(stops, activities_by_stop)
+    return {
+        "trip_id": trip_id,
+        "has_conflicts": bool(stop_overlaps or activity_overlaps),
+        "stop_conflicts": stop_overlaps,
+        "activity_conflicts": activity_overlaps,
+    }
+
+
+def _row_errors(new_rows, conflicts, field, describe):
+    """Bulk row errors for the conflicts involving rows of the request"""
+    index_of = {row['id']: index for index, row in enumerate(new_rows)}
+    errors = {}
+    for first, second, message in conflicts:
+        for row, other in ((second, first), (first, second)):
+            if row in index_of:
+                errors.setdefault(index_of[row], []).append(describe(other, message))
+                break
+    return [{'index': index, 'errors': {field: messages}} for index, messages in sorted(errors.items())]
+
+
+def new_stop_conflicts(trip_id, new_stops):
+    """Bulk row errors for new stops (dicts with STOP_FIELDS) overlapping the trip's stops or each other"""
+    existing = list(Stop.objects.filter(trip_id=trip_id).values(*STOP_FIELDS))
+    locations = {stop['id']: _location(stop) for stop in existing + new_stops}
+    conflicts = [
+        (conflict['first_stop_id'], conflict['second_stop_id'], f"{conflict['overlap_start']} to {conflict['overlap_end']}")
+        for conflict in stop_conflicts(existing + new_stops)
+    ]
+    return _row_errors(
+        new_stops, conflicts, 'start_date', lambda other, dates: f"Overlaps {locations[other]} from {dates}"
+    )
+
+
+def new_activity_conflicts(stop, new_activities):
+    """Bulk row errors for new activities (dicts with ACTIVITY_FIELDS) overlapping the stop's activities or each other"""
+    stop_row = {field: getattr(stop, field) for field in STOP_FIELDS}
+    existing = list(Activity.objects.filter(stop=stop).order_by('start_time', 'id').values(*ACTIVITY_FIELDS))
+    activities = existing + new_activities
+    names = {activity['id']: activity['name'] for activity in activities}
+    conflicts = [
+        (
+            conflict['first_activity_id'], conflict['second_activity_id'],
+            f"{conflict['overlap_start']:%H:%M} to {conflict['overlap_end']:%H:%M}"
+        )
+        for conflict in activity_conflicts([stop_row], {stop.id: activities})
+    ]
+    return _row_errors(
+        new_activities, conflicts, 'start_time', lambda other, span: f"Overlaps '{names[other]}' from {span}"
+    )
@@ -0,0 +1,250 @@
+"""
+View/copy counters of shared itineraries, kept out of the request path.
+
+Increments are buffered and written later, so a public read never needs a
+write transaction. With SHARED_COUNTERS_BUFFERED they go to the shared cache
+and flush_shared_counters writes them; otherwise each process keeps them in
+memory and a background thread writes them every
+SHARED_COUNTERS_FLUSH_INTERVAL seconds, and at exit.
+
+The in-memory buffer is best effort: a worker that is killed or recycled
+without running its exit handlers (SIGKILL, OOM, some max_requests restarts)
+loses up to SHARED_COUNTERS_FLUSH_INTERVAL seconds of its views and copies.
+Use a shared cache where exact counts matter.
+"""
+
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import SharedItinerary
+from .cache import public_cache
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('view_count', 'copy_count')
+
+# Per-process increments {(shared_id, field): amount}, used without a shared cache
+_local_counts = Counter()
+_local_lock = threading.Lock()
+_flusher = None
+
+# Buffered increments are flushed only for shared itineraries in the dirty
+# list: a cache counter 'seq' hands out positions, each holding one id, and
+# 'flushed' is the last position written. A per-id marker keeps an id from
+# being appended twice; it expires so an id whose position was evicted, or
+# read before it was written, is appended again by its next increment.
+DIRTY_TIMEOUT = 60 * 60
+
+# Flushes of the shared buffer hold a cache lock, since reading an amount and
+# decrementing it by that much is not atomic; a crashed flush frees it after this
+FLUSH_LOCK_TIMEOUT = 10 * 60
+
+
+def _counter_key(shared_id, field):
+    return public_cache.key('counter', shared_id, field)
+
+
+def _dirty_key(shared_id):
+    return public_cache.key('counter-dirty', shared_id)
+
+
+def _log_key(part):
+    """Keys of the dirty list: 'seq' (last position), 'flushed' (last flushed position) or a position"""
+    return public_cache.key('counter-log', part)
+
+
+def _add(cache, key, amount):
+    """Add amount to a counter key, creating it if missing; returns the new value"""
+    while True:
+        if cache.add(key, amount, timeout=None):
+            return amount
+        try:
+            return cache.incr(key, amount)
+        except ValueError:
+            # Evicted between add() and incr()
+            continue
+
+
+def _mark_dirty(shared_id):
+    """Append shared_id to the dirty list unless it is already waiting there"""
+    cache = public_cache.cache
+    if cache.add(_dirty_key(shared_id), 1, timeout=DIRTY_TIMEOUT):
+        cache.set(_log_key(_add(cache, _log_key('seq'), 1)), shared_id, timeout=None)
+
+
+def _buffer(shared_id, field, amount):
+    _add(public_cache.cache, _counter_key(shared_id, field), amount)
+    _mark_dirty(shared_id)
+
+
+def _flush_periodically(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush_local_counters()
+        except Exception:
+            logger.exception("Failed to flush shared itinerary counters")
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None and settings.SHARED_COUNTERS_FLUSH_INTERVAL > 0:
+        _flusher = threading.Thread(
+            target=_flush_periodically, args=(settings.SHARED_COUNTERS_FLUSH_INTERVAL,),
+            name='shared-counter-flush', daemon=True
+        )
+        _flusher.start()
+
+
+def _buffer_locally(shared_id, field, amount):
+    with _local_lock:
+        _local_counts[shared_id, field] += amount
+        _start_flusher()
+
+
+def _increment(shared_id, field):
+    if settings.SHARED_COUNTERS_BUFFERED:
+        _buffer(shared_id, field, 1)
+    else:
+        _buffer_locally(shared_id, field, 1)
+
+
+def record_shared_view(shared_id):
+    """Count a view of a shared itinerary without a database write"""
+    _increment(shared_id, 'view_count')
+
+
+def record_shared_copy(shared_id):
+    """Count a copy of a shared itinerary without a database write"""
+    _increment(shared_id, 'copy_count')
+
+
+def _apply_increments(increments):
+    """Add {(shared_id, field): amount} to the counters with a single UPDATE"""
+    updates = {}
+    for field in COUNTER_FIELDS:
+        whens = [
+            When(pk=shared_id, then=Value(amount))
+            for (shared_id, counter), amount in increments.items() if counter == field
+        ]
+        if whens:
+            updates[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+    shared_ids = {shared_id for shared_id, _ in increments}
+    SharedItinerary.objects.filter(pk__in=shared_ids).update(**updates)
+
+
+def flush_local_counters():
+    """Write this process's buffered increments with one UPDATE; returns how many
+
+    If the UPDATE fails the amounts are put back for the next flush.
+    """
+    with _local_lock:
+        increments = dict(_local_counts)
+        _local_counts.clear()
+    if not increments:
+        return 0
+    try:
+        with transaction.atomic():
+            _apply_increments(increments)
+    except Exception:
+        with _local_lock:
+            _local_counts.update(increments)
+        raise
+    return sum(increments.values())
+
+
+def _flush_at_exit():
+    try:
+        flush_local_counters()
+    except Exception:
+        logger.exception("Failed to flush shared itinerary counters at exit")
+
+
+atexit.register(_flush_at_exit)
+
+
+@contextmanager
+def _flush_lock():
+    """Hold the shared flush lock; yields False if another flush holds it"""
+    cache = public_cache.cache
+    key, token = public_cache.key('counter-flush-lock'), uuid.uuid4().hex
+    acquired = cache.add(key, token, timeout=FLUSH_LOCK_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def _flush_buffered(batch_size):
+    cache = public_cache.cache
+    written = 0
+
+    last = cache.get(_log_key('seq')) or 0
+    flushed = cache.get(_log_key('flushed')) or 0
+    if flushed > last:
+        # The position counter was evicted and restarted
+        flushed = 0
+
+    while flushed < last:
+        end = min(flushed + batch_size, last)
+        positions = [_log_key(position) for position in range(flushed + 1, end + 1)]
+        batch = list(dict.fromkeys(cache.get_many(positions).values()))
+        cache.delete_many([_dirty_key(shared_id) for shared_id in batch])
+
+        keys = {
+            _counter_key(shared_id, field): (shared_id, field)
+            for shared_id in batch for field in COUNTER_FIELDS
+        }
+        increments = {}
+        for key, amount in cache.get_many(list(keys)).items():
+            if not amount:
+                continue
+            try:
+                cache.decr(key, amount)
+            except ValueError:
+                continue
+            increments[keys[key]] = amount
+
+        if increments:
+            try:
+                with transaction.atomic():
+                    _apply_increments(increments)
+            except Exception:
+                for (shared_id, field), amount in increments.items():
+                    _buffer(shared_id, field, amount)
+                raise
+            written += sum(increments.values())
+
+        cache.set(_log_key('flushed'), end, timeout=None)
+        cache.delete_many(positions)
+        flushed = end
+
+    return written
+
+
+def flush_shared_counters(batch_size=500):
+    """Move buffered view/copy increments into the database
+
+    Only shared itineraries in the dirty list are read. Each id's marker is
+    cleared before its amounts are taken out with decr(), so increments
+    recorded while the flush runs stay buffered and mark the id again. Each
+    batch of ids is written with one UPDATE; if it fails the amounts are put
+    back. Only one flush reads the shared buffer at a time; an overlapping one
+    leaves it alone. Increments buffered in this process are written too.
+    Returns the number of increments written.
+    """
+    written = flush_local_counters()
+    with _flush_lock() as acquired:
+        if acquired:
+            written += _flush_buffered(batch_size)
+    return written
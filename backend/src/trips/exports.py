@@ -0,0 +1,236 @@
+"""
+Trip export writers.
+
+Trips, stops and activities are read with three QuerySet.iterator() cursors
+sorted in the same trip -> stop -> activity order and merged as they stream,
+so a trip's document is written piece by piece and never held in memory as a
+whole. The cursors run in one read-only transaction so they see the same
+snapshot of the data.
+"""
+
+import csv
+import json
+
+from django.db import connection, transaction
+from django.db.models import TimeField, Value
+from django.db.models.functions import Coalesce
+from ninja.responses import NinjaJSONEncoder
+
+from globetrotter.streaming import STREAM_CHUNK_SIZE, buffered_chunks, stream_chunks
+from .activities_api import UNSCHEDULED_START
+from .models import Stop, Activity
+
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+TRIP_FIELDS = (
+    'id', 'name', 'description', 'start_date', 'end_date', 'status', 'currency',
+    'estimated_budget', 'cover_image', 'is_public'
+)
+BUDGET_FIELDS = (
+    'currency', 'transport_cost', 'stay_cost', 'activity_cost', 'meal_cost', 'shopping_cost',
+    'miscellaneous_cost', 'transport_limit', 'stay_limit', 'activity_limit', 'meal_limit',
+    'shopping_limit', 'miscellaneous_limit'
+)
+STOP_FIELDS = (
+    'id', 'city_name', 'country', 'start_date', 'end_date', 'order_index', 'latitude', 'longitude',
+    'timezone', 'accommodation_name', 'accommodation_address', 'accommodation_cost', 'notes'
+)
+ACTIVITY_FIELDS = (
+    'id', 'name', 'category', 'description', 'location_name', 'address', 'start_time', 'end_time',
+    'duration_minutes', 'cost', 'currency', 'is_paid', 'priority', 'is_booked', 'booking_reference',
+    'website_url', 'phone_number', 'image_url', 'weather_dependent', 'indoor_activity', 'notes'
+)
+
+# Trip order shared by the three cursors: newest trip first, like list_trips
+TRIP_ORDER = ('-created_at', '-id')
+STOP_ORDER = ('order_index', 'start_date', 'id')
+ACTIVITY_ORDER = ('start_sort', 'id')
+
+
+class TripExport:
+    """The rows of one export: which trips, and which parts of them"""
+
+    def __init__(self, trips, include_activities=True, include_budget=True, include_notes=True):
+        self.trips = trips
+        self.include_activities = include_activities
+        self.include_budget = include_budget
+        self.include_notes = include_notes
+
+    @property
+    def stop_fields(self):
+        return tuple(f for f in STOP_FIELDS if self.include_notes or f != 'notes')
+
+    @property
+    def activity_fields(self):
+        return tuple(f for f in ACTIVITY_FIELDS if self.include_notes or f != 'notes')
+
+    def _trip_rows(self):
+        fields = TRIP_FIELDS + tuple(f'budget__{f}' for f in BUDGET_FIELDS if self.include_budget)
+        return self.trips.order_by(*TRIP_ORDER).values(*fields)
+
+    def _stop_rows(self):
+        trip_order = tuple(f'{"-" if f.startswith("-") else ""}trip__{f.lstrip("-")}' for f in TRIP_ORDER)
+        return Stop.objects.filter(trip__in=self.trips.values('id')).order_by(
+            *trip_order, *STOP_ORDER
+        ).values('trip_id', *self.stop_fields)
+
+    def _activity_rows(self):
+        trip_order = tuple(f'{"-" if f.startswith("-") else ""}stop__trip__{f.lstrip("-")}' for f in TRIP_ORDER)
+        stop_order = tuple(f'stop__{f}' for f in STOP_ORDER)
+        return Activity.objects.filter(stop__trip__in=self.trips.values('id')).annotate(
+            start_sort=Coalesce('start_time', Value(UNSCHEDULED_START), output_field=TimeField())
+        ).order_by(*trip_order, *stop_order, *ACTIVITY_ORDER).values('stop_id', *self.activity_fields)
+
+    def __iter__(self):
+        """(trip, budget, [(stop, [activity, ...]), ...]) per trip, with lazy inner iterators
+
+        Each inner iterator must be consumed before moving on to the next item.
+        """
+        # A snapshot can only be requested as the first statement of a transaction
+        snapshot = connection.vendor == 'postgresql' and not connection.in_atomic_block
+        with transaction.atomic():
+            if snapshot:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+
+            stops = _Children(self._stop_rows().iterator(chunk_size=STREAM_CHUNK_SIZE), 'trip_id')
+            activities = None
+            if self.include_activities:
+                activities = _Children(self._activity_rows().iterator(chunk_size=STREAM_CHUNK_SIZE), 'stop_id')
+
+            for row in self._trip_rows().iterator(chunk_size=STREAM_CHUNK_SIZE):
+                trip = {f: row[f] for f in TRIP_FIELDS}
+                budget = {f: row[f'budget__{f}'] for f in BUDGET_FIELDS} if self.include_budget else None
+                yield trip, budget, self._stops(stops.take(trip['id']), activities)
+
+    @staticmethod
+    def _stops(stops, activities):
+        for stop in stops:
+            yield stop, activities.take(stop['id']) if activities else iter(())
+
+
+class _Children:
+    """Consume a sorted row iterator one parent at a time"""
+
+    def __init__(self, rows, parent_key):
+        self._rows = rows
+        self._parent_key = parent_key
+        self._head = next(rows, None)
+
+    def take(self, parent_id):
+        """Rows of parent_id, with the parent key removed"""
+        while self._head is not None and self._head[self._parent_key] == parent_id:
+            row, self._head = self._head, next(self._rows, None)
+            del row[self._parent_key]
+            yield row
+
+
+def _dumps(value):
+    return json.dumps(value, cls=NinjaJSONEncoder)
+
+
+def _open_object(document):
+    """JSON of a dict with its closing brace left off, so more members can follow"""
+    return _dumps(document)[:-1]
+
+
+def json_chunks(export, single=False):
+    """One nested document per trip, as a single object or wrapped in {"trips": [...]}"""
+    if not single:
+        yield '{"trips":['
+    separator = ''
+    for trip, budget, stops in export:
+        yield separator + _open_object(trip)
+        separator = ','
+        if budget is not None:
+            yield ',"budget":' + _dumps(budget)
+        yield ',"stops":['
+        stop_separator = ''
+        for stop, activities in stops:
+            yield stop_separator + _open_object(stop)
+            stop_separator = ','
+            if export.include_activities:
+                yield ',"activities":['
+                activity_separator = ''
+                for activity in activities:
+                    yield activity_separator + _dumps(activity)
+                    activity_separator = ','
+                yield ']'
+            yield '}'
+        yield ']}'
+    if not single:
+        yield ']}'
+
+
+def ndjson_chunks(export):
+    """One line per trip, budget, stop and activity, each tagged with its type and parent id"""
+    for trip, budget, stops in export:
+        yield _dumps({'type': 'trip', **trip}) + '\n'
+        if budget is not None:
+            yield _dumps({'type': 'budget', 'trip_id': trip['id'], **budget}) + '\n'
+        for stop, activities in stops:
+            yield _dumps({'type': 'stop', 'trip_id': trip['id'], **stop}) + '\n'
+            for activity in activities:
+                yield _dumps({'type': 'activity', 'stop_id': stop['id'], **activity}) + '\n'
+
+
+class _LineBuffer:
+    """File-like target for csv.writer that hands back each written line"""
+
+    def write(self, line):
+        return line
+
+
+def csv_columns(export):
+    columns = [f'trip_{f}' for f in TRIP_FIELDS]
+    if export.include_budget:
+        columns += [f'budget_{f}' for f in BUDGET_FIELDS]
+    columns += [f'stop_{f}' for f in export.stop_fields]
+    if export.include_activities:
+        columns += [f'activity_{f}' for f in export.activity_fields]
+    return columns
+
+
+def csv_chunks(export):
+    """One row per activity, repeating its trip and stop columns
+
+    Stops without activities, and trips without stops, get a single row with
+    the missing columns left empty.
+    """
+    writer = csv.writer(_LineBuffer())
+    columns = csv_columns(export)
+    yield writer.writerow(columns)
+
+    def row(*parts):
+        values = [value for part in parts for value in part]
+        values += [None] * (len(columns) - len(values))
+        return writer.writerow(['' if value is None else value for value in values])
+
+    for trip, budget, stops in export:
+        head = list(trip.values()) + (list(budget.values()) if budget is not None else [])
+        wrote_stop = False
+        for stop, activities in stops:
+            wrote_stop = True
+            wrote_activity = False
+            for activity in activities:
+                wrote_activity = True
+                yield row(head, stop.values(), activity.values())
+            if not wrote_activity:
+                yield row(head, stop.values())
+        if not wrote_stop:
+            yield row(head)
+
+
+def export_response(export, format, filename, single=False):
+    """StreamingHttpResponse writing the export in one of EXPORT_FORMATS"""
+    if format == 'json':
+        chunks = json_chunks(export, single=single)
+    elif format == 'ndjson':
+        chunks = ndjson_chunks(export)
+    else:
+        chunks = csv_chunks(export)
+    return stream_chunks(buffered_chunks(chunks), EXPORT_FORMATS[format], filename=f'{filename}.{format}')
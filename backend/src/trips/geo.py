@@ -0,0 +1,110 @@
+"""
+Geohash helpers for radius queries without PostGIS.
+
+Catalog activities store the geohash of their coordinates in an indexed
+column. A radius query covers its bounding box with a handful of geohash
+cells, selects candidates with indexed prefix lookups plus a lat/lng range
+check, and then computes exact haversine distances in numpy.
+"""
+
+import math
+
+import numpy as np
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # roughly 5m x 5m cells
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+# Upper bound on cells (prefix lookups) used to cover a query's bounding box
+MAX_COVER_CELLS = 16
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, value, even = [], 0, 0, True
+
+    while len(geohash) < precision:
+        interval, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def bounding_boxes(latitude, longitude, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) boxes containing the circle
+
+    The box is split in two where it crosses the antimeridian and spans all
+    longitudes when the circle reaches a pole.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+
+    widest = max(abs(min_lat), abs(max_lat))
+    if widest >= 90.0 or radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(widest))) >= 180.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+
+    lng_delta = radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(widest)))
+    min_lng, max_lng = longitude - lng_delta, longitude + lng_delta
+    if min_lng < -180.0:
+        return [(min_lat, max_lat, min_lng + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lng)]
+    if max_lng > 180.0:
+        return [(min_lat, max_lat, min_lng, 180.0), (min_lat, max_lat, -180.0, max_lng - 360.0)]
+    return [(min_lat, max_lat, min_lng, max_lng)]
+
+
+def _cell_ranges(box, precision):
+    """Row and column ranges of the geohash cells overlapping a box"""
+    min_lat, max_lat, min_lng, max_lng = box
+    height, width = cell_size(precision)
+    rows, cols = 2 ** (5 * precision // 2), 2 ** ((5 * precision + 1) // 2)
+    return (
+        range(math.floor((min_lat + 90) / height), min(math.floor((max_lat + 90) / height), rows - 1) + 1),
+        range(math.floor((min_lng + 180) / width), min(math.floor((max_lng + 180) / width), cols - 1) + 1),
+    )
+
+
+def covering_cells(boxes, max_cells=MAX_COVER_CELLS):
+    """The finest geohash cells, at most max_cells of them where possible, that cover the boxes"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        ranges = [_cell_ranges(box, precision) for box in boxes]
+        if sum(len(rows) * len(cols) for rows, cols in ranges) <= max_cells:
+            break
+
+    height, width = cell_size(precision)
+    return sorted({
+        encode_geohash(-90 + (row + 0.5) * height, -180 + (col + 0.5) * width, precision)
+        for rows, cols in ranges for row in rows for col in cols
+    })
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Great-circle distances from one point to arrays of points, in km"""
+    lat1, lng1 = np.radians(latitude), np.radians(longitude)
+    lat2, lng2 = np.radians(np.asarray(latitudes, dtype=float)), np.radians(np.asarray(longitudes, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distance_matrix_km(latitudes, longitudes):
+    """Great-circle distances between every pair of points, in km"""
+    latitudes, longitudes = np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+    return haversine_km(latitudes[:, None], longitudes[:, None], latitudes, longitudes)
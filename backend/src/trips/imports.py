@@ -0,0 +1,399 @@
+"""
+Trip import pipeline.
+
+Sources are read one trip at a time: JSON documents shaped like the export
+(a single trip or {"trips": [...]}), NDJSON records and CSV rows as written
+by trips.exports. Trips are validated with the create schemas and the models'
+field validation in batches, then written with bulk_create/bulk_update. The
+whole import runs in one transaction, so a batch that fails validation
+rolls back everything imported before it.
+
+With merge_with_existing, rows are matched on natural keys instead of always
+being added: trips on (name, start_date) among the user's trips, stops on
+(city_name, country, start_date) within a trip and activities on
+(name, start_time) within a stop. Matched rows get the fields given in the
+source; nothing is deleted.
+"""
+
+import csv
+import json
+from collections import Counter
+
+from django.utils import timezone
+from pydantic import ValidationError
+
+from .budgeting import deferred_budget_updates
+from .bulk import BULK_CREATE_BATCH_SIZE, collect_row_errors
+from .models import Trip, Stop, Activity, Budget
+from .schemas import TripCreateSchema, StopCreateSchema, ActivityCreateSchema, BudgetCreateSchema
+
+IMPORT_FORMATS = ('json', 'ndjson', 'csv')
+
+# Trip fields accepted besides TripCreateSchema, checked by the model's choices
+EXTRA_TRIP_FIELDS = ('status',)
+
+
+class TripImportError(ValueError):
+    """The source could not be parsed"""
+
+
+class ImportRejected(Exception):
+    """Rows of a batch failed validation; carries bulk row errors"""
+
+    def __init__(self, row_errors):
+        super().__init__(f"{len(row_errors)} trip(s) failed validation")
+        self.row_errors = row_errors
+
+
+# Parsers: each yields trip documents shaped like the JSON export
+
+def json_documents(data):
+    trips = data['trips'] if 'trips' in data else [data]
+    if not isinstance(trips, list):
+        raise TripImportError('"trips" must be a list of trip documents')
+    for number, document in enumerate(trips, 1):
+        if not isinstance(document, dict):
+            raise TripImportError(f"trip {number} is not an object")
+        yield document
+
+
+def ndjson_documents(lines):
+    """Group typed NDJSON records into trips; records follow the trip they belong to"""
+    trip, stops = None, {}
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise TripImportError(f"line {number} is not valid JSON")
+        kind = record.pop('type', None) if isinstance(record, dict) else None
+
+        if kind == 'trip':
+            if trip is not None:
+                yield trip
+            trip, stops = {**record, 'stops': []}, {}
+        elif trip is None:
+            raise TripImportError(f"line {number}: expected a trip record first")
+        elif kind == 'budget':
+            record.pop('trip_id', None)
+            trip['budget'] = record
+        elif kind == 'stop':
+            record.pop('trip_id', None)
+            stop = stops[record.get('id')] = {**record, 'activities': []}
+            trip['stops'].append(stop)
+        elif kind == 'activity':
+            stop = stops.get(record.pop('stop_id', None))
+            if stop is None:
+                raise TripImportError(f"line {number}: activity refers to an unknown stop")
+            stop['activities'].append(record)
+        else:
+            raise TripImportError(f"line {number}: unknown record type {kind!r}")
+
+    if trip is not None:
+        yield trip
+
+
+def _csv_parts(row):
+    """Split a CSV row into trip/budget/stop/activity values, leaving out empty cells"""
+    parts = {'trip': {}, 'budget': {}, 'stop': {}, 'activity': {}}
+    for column, value in row.items():
+        prefix, _, field = (column or '').partition('_')
+        if prefix in parts and field and value not in (None, ''):
+            parts[prefix][field] = value
+    return parts
+
+
+def csv_documents(lines):
+    """Group CSV rows into trips; a trip's rows must be consecutive, as exported"""
+    trip, trip_ref, stops = None, None, {}
+    for number, row in enumerate(csv.DictReader(lines), 2):
+        parts = _csv_parts(row)
+        ref = parts['trip'].get('id') or (parts['trip'].get('name'), parts['trip'].get('start_date'))
+        if trip is None or ref != trip_ref:
+            if trip is not None:
+                yield trip
+            trip, trip_ref, stops = {**parts['trip'], 'stops': []}, ref, {}
+            if parts['budget']:
+                trip['budget'] = parts['budget']
+
+        stop_values = parts['stop']
+        if stop_values:
+            stop_ref = stop_values.get('id') or (
+                stop_values.get('city_name'), stop_values.get('country'), stop_values.get('start_date')
+            )
+            stop = stops.get(stop_ref)
+            if stop is None:
+                stop = stops[stop_ref] = {**stop_values, 'activities': []}
+                trip['stops'].append(stop)
+            if parts['activity']:
+                stop['activities'].append(parts['activity'])
+        elif parts['activity']:
+            raise TripImportError(f"row {number}: activity without a stop")
+
+    if trip is not None:
+        yield trip
+
+
+def parse_documents(source_format, data=None, lines=None):
+    """Trip documents from a TripImportSchema payload or from the lines of an uploaded file
+
+    NDJSON and CSV payloads carry their text in data["content"].
+    """
+    if source_format not in IMPORT_FORMATS:
+        raise TripImportError(f"Unsupported source format '{source_format}', use one of: {', '.join(IMPORT_FORMATS)}")
+
+    if lines is None and source_format != 'json':
+        content = (data or {}).get('content')
+        if not isinstance(content, str):
+            raise TripImportError(f'{source_format} imports need the file contents in data["content"]')
+        lines = content.splitlines(keepends=True)
+
+    if source_format == 'json':
+        if lines is not None:
+            try:
+                data = json.loads(''.join(lines))
+            except ValueError:
+                raise TripImportError("The file is not valid JSON")
+        if not isinstance(data, dict):
+            raise TripImportError("Expected a trip document or {\"trips\": [...]}")
+        return json_documents(data)
+    if source_format == 'ndjson':
+        return ndjson_documents(lines)
+    return csv_documents(lines)
+
+
+# Validation
+
+def _add_schema_errors(errors, exc, path):
+    for error in exc.errors():
+        key = '.'.join(str(part) for part in (*path, *error['loc']))
+        errors.setdefault(key, []).append(error['msg'])
+
+
+def _validated(schema, values, path, errors):
+    """Schema instance for values, or None after recording its errors under path"""
+    if not isinstance(values, dict):
+        errors.setdefault('.'.join(path) or '__all__', []).append("Expected an object")
+        return None
+    try:
+        return schema.model_validate(values)
+    except ValidationError as exc:
+        _add_schema_errors(errors, exc, path)
+        return None
+
+
+class ParsedTrip:
+    """A validated trip document, still unsaved"""
+
+    def __init__(self, index, document):
+        self.index = index
+        self.errors = {}
+        self.trip = _validated(TripCreateSchema, document, (), self.errors)
+        self.extra = {field: document[field] for field in EXTRA_TRIP_FIELDS if field in document}
+        self.budget = None
+        if document.get('budget') is not None:
+            self.budget = _validated(BudgetCreateSchema, document['budget'], ('budget',), self.errors)
+        self.stops = []
+
+        stops = document.get('stops') or []
+        if not isinstance(stops, list):
+            self.errors['stops'] = ["Expected a list"]
+            stops = []
+        for i, stop_document in enumerate(stops):
+            stop = _validated(StopCreateSchema, stop_document, ('stops', str(i)), self.errors)
+            activities = []
+            activity_documents = stop_document.get('activities') or [] if isinstance(stop_document, dict) else []
+            for j, activity_document in enumerate(activity_documents):
+                activities.append(_validated(
+                    ActivityCreateSchema, activity_document, ('stops', str(i), 'activities', str(j)), self.errors
+                ))
+            self.stops.append((stop, activities))
+
+    @property
+    def row_count(self):
+        return 1 + sum(1 + len(activities) for _, activities in self.stops)
+
+
+def _values(schema, merge):
+    """Fields to write: everything for new rows, only the given ones when merging"""
+    return schema.model_dump(exclude_unset=merge)
+
+
+def _apply(instance, values):
+    """Set values on an existing instance, returning the names of fields that changed"""
+    changed = [field for field, value in values.items() if getattr(instance, field) != value]
+    for field in changed:
+        setattr(instance, field, values[field])
+    if changed:
+        # bulk_update() does not apply auto_now
+        instance.updated_at = timezone.now()
+        changed.append('updated_at')
+    return changed
+
+
+class TripImporter:
+    """Write parsed trip documents for one user in batches of about batch_size rows"""
+
+    def __init__(self, user, merge_with_existing=False, batch_size=BULK_CREATE_BATCH_SIZE):
+        self.user = user
+        self.merge = merge_with_existing
+        self.batch_size = batch_size
+        self.counts = Counter()
+
+    def run(self, documents):
+        """Import every document in one transaction; raises ImportRejected on invalid rows"""
+        with deferred_budget_updates() as pending:
+            batch, rows = [], 0
+            for index, document in enumerate(documents):
+                parsed = ParsedTrip(index, document)
+                batch.append(parsed)
+                rows += parsed.row_count
+                if rows >= self.batch_size:
+                    self._import_batch(batch, pending)
+                    batch, rows = [], 0
+            if batch:
+                self._import_batch(batch, pending)
+        return self.counts
+
+    def _import_batch(self, batch, pending):
+        row_errors = [{'index': parsed.index, 'errors': parsed.errors} for parsed in batch if parsed.errors]
+        if row_errors:
+            raise ImportRejected(row_errors)
+
+        existing = _ExistingRows(self.user, batch) if self.merge else None
+        writes = _BatchWrites()
+
+        for parsed in batch:
+            trip = self._trip(parsed, existing, writes)
+            pending.add_trip(trip.id)
+            for i, (stop_schema, activities) in enumerate(parsed.stops):
+                source = (parsed.index, f'stops.{i}.')
+                stop = self._stop(trip, stop_schema, existing, writes, source)
+                for j, activity_schema in enumerate(activities):
+                    source = (parsed.index, f'stops.{i}.activities.{j}.')
+                    self._activity(stop, activity_schema, existing, writes, source)
+
+        row_errors = writes.validate()
+        if row_errors:
+            raise ImportRejected(row_errors)
+
+        self.counts.update(writes.save())
+        # Recompute this batch's budgets now rather than holding every trip id until the end
+        pending.flush()
+
+    def _trip(self, parsed, existing, writes):
+        values = {**_values(parsed.trip, self.merge), **parsed.extra}
+        key = (parsed.trip.name, parsed.trip.start_date)
+        trip = existing.trips.get(key) if existing else None
+        budget_values = _values(parsed.budget, True) if parsed.budget else {}
+
+        if trip is None:
+            # bulk_create() skips the post_save signal that adds the budget
+            trip = Trip(user=self.user, **values)
+            budget = Budget(trip=trip, **{'currency': trip.currency, **budget_values})
+            writes.create('trip', trip, (parsed.index, ''))
+            writes.create('budget', budget, (parsed.index, 'budget.'))
+            if existing:
+                existing.trips[key] = trip
+                existing.budgets[trip.id] = budget
+        else:
+            writes.update('trip', trip, _apply(trip, values), (parsed.index, ''))
+            budget = existing.budgets.get(trip.id)
+            if budget is not None:
+                writes.update('budget', budget, _apply(budget, budget_values), (parsed.index, 'budget.'))
+        return trip
+
+    def _stop(self, trip, schema, existing, writes, source):
+        key = (trip.id, schema.city_name, schema.country, schema.start_date)
+        stop = existing.stops.get(key) if existing else None
+        if stop is None:
+            stop = Stop(trip=trip, **_values(schema, False))
+            writes.create('stop', stop, source)
+            if existing:
+                existing.stops[key] = stop
+        else:
+            writes.update('stop', stop, _apply(stop, _values(schema, True)), source)
+        return stop
+
+    def _activity(self, stop, schema, existing, writes, source):
+        key = (stop.id, schema.name, schema.start_time)
+        activity = existing.activities.get(key) if existing else None
+        if activity is None:
+            activity = Activity(stop=stop, **_values(schema, False))
+            writes.create('activity', activity, source)
+            if existing:
+                existing.activities[key] = activity
+        else:
+            writes.update('activity', activity, _apply(activity, _values(schema, True)), source)
+
+
+class _ExistingRows:
+    """The user's rows a batch can merge into, loaded with one query per table"""
+
+    def __init__(self, user, batch):
+        names = {parsed.trip.name for parsed in batch}
+        trips = Trip.objects.filter(user=user, name__in=names).order_by('created_at', 'id')
+        self.trips = {}
+        for trip in trips:
+            self.trips.setdefault((trip.name, trip.start_date), trip)
+
+        trip_ids = [trip.id for trip in self.trips.values()]
+        self.budgets = {budget.trip_id: budget for budget in Budget.objects.filter(trip_id__in=trip_ids)}
+        self.stops = {}
+        for stop in Stop.objects.filter(trip_id__in=trip_ids).order_by('order_index', 'start_date', 'id'):
+            self.stops.setdefault((stop.trip_id, stop.city_name, stop.country, stop.start_date), stop)
+        self.activities = {}
+        for activity in Activity.objects.filter(stop__trip_id__in=trip_ids).order_by('id'):
+            self.activities.setdefault((activity.stop_id, activity.name, activity.start_time), activity)
+
+
+class _BatchWrites:
+    """New and changed rows of a batch, validated and saved together"""
+
+    MODELS = {'trip': Trip, 'budget': Budget, 'stop': Stop, 'activity': Activity}
+    PARENTS = {'trip': ['user'], 'budget': ['trip'], 'stop': ['trip'], 'activity': ['stop']}
+    COUNTED = {'trip': 'trips', 'stop': 'stops', 'activity': 'activities'}
+
+    def __init__(self):
+        self.created = {kind: [] for kind in self.MODELS}
+        self.updated = {kind: {} for kind in self.MODELS}
+        self.changed_fields = {kind: set() for kind in self.MODELS}
+        self.sources = {kind: [] for kind in self.MODELS}
+
+    def create(self, kind, instance, source):
+        """source is (index of the trip document, error path prefix)"""
+        self.created[kind].append(instance)
+        self.sources[kind].append(source)
+
+    def update(self, kind, instance, fields, source):
+        if fields and instance.pk not in self.updated[kind]:
+            self.updated[kind][instance.pk] = (instance, source)
+        self.changed_fields[kind].update(fields)
+
+    def validate(self):
+        """Field validation of every new and changed row, merged per source trip"""
+        errors = {}
+        for kind in self.MODELS:
+            updated = list(self.updated[kind].values())
+            instances = self.created[kind] + [instance for instance, _ in updated]
+            sources = self.sources[kind] + [source for _, source in updated]
+            for row_error in collect_row_errors(instances, exclude=self.PARENTS[kind]):
+                index, path = sources[row_error['index']]
+                trip_errors = errors.setdefault(index, {})
+                for field, messages in row_error['errors'].items():
+                    trip_errors.setdefault(f'{path}{field}', []).extend(messages)
+        return [{'index': index, 'errors': errors[index]} for index in sorted(errors)]
+
+    def save(self):
+        counts = Counter()
+        for kind, model in self.MODELS.items():
+            if self.created[kind]:
+                model.objects.bulk_create(self.created[kind], batch_size=BULK_CREATE_BATCH_SIZE)
+            updated = [instance for instance, _ in self.updated[kind].values()]
+            if updated:
+                model.objects.bulk_update(updated, sorted(self.changed_fields[kind]), batch_size=BULK_CREATE_BATCH_SIZE)
+            if kind in self.COUNTED:
+                counts[f'{self.COUNTED[kind]}_created'] += len(self.created[kind])
+                counts[f'{self.COUNTED[kind]}_updated'] += len(updated)
+        return counts
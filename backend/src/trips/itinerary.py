@@ -0,0 +1,114 @@
+"""
+Day-by-day itinerary of a trip, for /trips/{trip_id}/activities/by-date.
+
+Activities have a start time but no date, so each stop's activities are laid
+out over the stop's days in the order they were planned (created): an
+activity stays on the current day unless it starts no later than the
+previous timed activity of that day, in which case it moves to the next day
+of the stop. Untimed activities stay on the current day, and the last day of
+a stop takes whatever is left. The days are a display guess: editing or
+deleting an earlier activity can move later ones, so nothing else (conflict
+detection included) should build on them, and responses say days_inferred.
+
+A timeline covers a date window, the whole trip by default. Only stops
+overlapping the window and their activities are loaded, with one query
+each, and every day of the window is present, in date order.
+"""
+
+from datetime import time, timedelta
+
+from .models import Stop, Activity
+
+# Longest window returned at once; longer trips are read in from/to slices
+MAX_TIMELINE_DAYS = 366
+
+ACTIVITY_FIELDS = (
+    'id', 'stop_id', 'name', 'category', 'start_time', 'end_time', 'cost', 'is_booked', 'is_paid',
+)
+
+
+def stop_day_offsets(activities, stop_days):
+    """Inferred day offset within the stop of each activity, given in planning order
+
+    Only meant for laying out the itinerary, see the module docstring.
+    """
+    offsets = []
+    day, previous_start = 0, None
+    for activity in activities:
+        start = activity['start_time']
+        if start is not None:
+            if previous_start is not None and start <= previous_start and day < stop_days - 1:
+                day += 1
+            previous_start = start
+        offsets.append(day)
+    return offsets
+
+
+def _sort_key(activity):
+    # Scheduled activities first, by start time
+    return (activity['start_time'] is None, activity['start_time'] or time.min, activity['name'])
+
+
+class ItineraryTimeline:
+    """Dense, date-ordered itinerary of a trip between first_day and last_day"""
+
+    def __init__(self, trip, first_day=None, last_day=None):
+        self.trip = trip
+        self.first_day = first_day or trip.start_date
+        self.last_day = last_day or trip.end_date
+
+    @property
+    def day_count(self):
+        return max((self.last_day - self.first_day).days + 1, 0)
+
+    def _stops(self):
+        return list(Stop.objects.filter(
+            trip=self.trip, start_date__lte=self.last_day, end_date__gte=self.first_day
+        ).order_by('order_index', 'start_date').values('id', 'city_name', 'country', 'start_date', 'end_date'))
+
+    def _activities_by_stop(self, stop_ids):
+        activities = {stop_id: [] for stop_id in stop_ids}
+        rows = Activity.objects.filter(stop_id__in=stop_ids).order_by('stop_id', 'created_at', 'id').values(
+            *ACTIVITY_FIELDS
+        )
+        for activity in rows:
+            activities[activity['stop_id']].append(activity)
+        return activities
+
+    def days(self):
+        """One entry per date of the window, with the stops and activities of that date"""
+        days = [
+            {"date": self.first_day + timedelta(days=offset), "locations": [], "activities": []}
+            for offset in range(self.day_count)
+        ]
+        if not days:
+            return days
+
+        stops = self._stops()
+        activities = self._activities_by_stop([stop['id'] for stop in stops])
+        for stop in stops:
+            location = f"{stop['city_name']}, {stop['country']}"
+            stop_days = max((stop['end_date'] - stop['start_date']).days + 1, 1)
+            # Offset of the stop's first day in the window
+            base = (stop['start_date'] - self.first_day).days
+
+            for offset in range(max(base, 0), min(base + stop_days, len(days))):
+                days[offset]["locations"].append(location)
+
+            stop_activities = activities[stop['id']]
+            for activity, day in zip(stop_activities, stop_day_offsets(stop_activities, stop_days)):
+                if 0 <= base + day < len(days):
+                    days[base + day]["activities"].append({**activity, "location": location})
+
+        for day in days:
+            day["activities"].sort(key=_sort_key)
+        return days
+
+    def as_dict(self):
+        return {
+            "trip_id": self.trip.id,
+            "start_date": self.first_day,
+            "end_date": self.last_day,
+            "days_inferred": True,
+            "days": self.days(),
+        }
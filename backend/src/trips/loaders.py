@@ -0,0 +1,20 @@
+from django.db.models import prefetch_related_objects
+from .models import Trip
+
+# Relations needed to serialize a complete trip (see api.get_trip_with_relations)
+TRIP_GRAPH_PREFETCH = ('stops', 'stops__activities')
+
+
+def trip_graph_queryset():
+    """Trips with budget, stops and activities loaded in a fixed number of queries
+
+    One query for the trip and its budget, one for the stops and one for all
+    of their activities, regardless of how many stops the trip has.
+    """
+    return Trip.objects.select_related('budget').prefetch_related(*TRIP_GRAPH_PREFETCH)
+
+
+def load_trip_graph(trip):
+    """Attach budget, stops and activities to an already loaded trip"""
+    prefetch_related_objects([trip], 'budget', *TRIP_GRAPH_PREFETCH)
+    return trip
@@ -0,0 +1,116 @@
+import random
+import statistics
+import string
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from trips.models import City
+from trips.search import CityEntry, CityIndex, autocomplete_cities, search_cities
+
+SYLLABLES = ['ba', 'ca', 'da', 'el', 'fo', 'ga', 'ha', 'in', 'jo', 'ka', 'lo', 'ma', 'ne', 'or',
+             'pa', 'qui', 'ra', 'san', 'to', 'ur', 'va', 'wen', 'xi', 'yo', 'zu', 'berg', 'ton', 'ville']
+
+
+def synthetic_name(rng):
+    name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+    if rng.random() < 0.2:
+        name = f"{rng.choice(['New', 'Port', 'San', 'Saint', 'Lake'])} {name}"
+    return name
+
+
+def synthetic_cities(count, seed):
+    rng = random.Random(seed)
+    countries = [synthetic_name(rng) + 'ia' for _ in range(200)]
+    return [
+        CityEntry(
+            id=uuid.UUID(int=rng.getrandbits(128)), name=synthetic_name(rng), country=rng.choice(countries),
+            latitude=rng.uniform(-90, 90), longitude=rng.uniform(-180, 180), timezone='UTC',
+            popular_attractions=[], population=rng.randint(1_000, 10_000_000)
+        )
+        for _ in range(count)
+    ]
+
+
+def with_typo(rng, word):
+    if len(word) < 4:
+        return word
+    position = rng.randrange(1, len(word))
+    if rng.random() < 0.5:
+        return word[:position] + word[position + 1:]
+    return word[:position] + rng.choice(string.ascii_lowercase) + word[position + 1:]
+
+
+def sample_queries(names, count, seed):
+    """Equal mix of prefixes, full names and names with a typo"""
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        name = rng.choice(names)
+        if i % 3 == 0:
+            queries.append(name[:rng.randint(2, min(5, len(name)))])
+        elif i % 3 == 1:
+            queries.append(name)
+        else:
+            queries.append(with_typo(rng, name))
+    return queries
+
+
+class Command(BaseCommand):
+    help = "Measure /search/cities latency over a synthetic city set or the cities table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cities', type=int, default=100_000, help='Number of synthetic cities to index')
+        parser.add_argument('--queries', type=int, default=1_000, help='Number of queries to time')
+        parser.add_argument('--limit', type=int, default=10, help='Results per query')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--autocomplete', action='store_true',
+            help='Time autocomplete, one request per keystroke of each query, instead of search'
+        )
+        parser.add_argument(
+            '--database', action='store_true',
+            help='Search the cities table through the configured backend instead of a synthetic index'
+        )
+        parser.add_argument(
+            '--budget-ms', type=float, default=None,
+            help='Fail when p95 latency exceeds this many milliseconds'
+        )
+
+    def handle(self, *args, **options):
+        if options['database']:
+            names = list(City.objects.values_list('name', flat=True))
+            if not names:
+                raise CommandError("The cities table is empty")
+            run = autocomplete_cities if options['autocomplete'] else search_cities
+        else:
+            started = time.perf_counter()
+            entries = synthetic_cities(options['cities'], options['seed'])
+            index = CityIndex()
+            index.load(entries)
+            names = [entry.name for entry in entries]
+            self.stdout.write(f"Indexed {len(index)} cities in {time.perf_counter() - started:.2f}s")
+            run = index.autocomplete if options['autocomplete'] else index.search
+
+        queries = sample_queries(names, options['queries'], options['seed'])
+        if options['autocomplete']:
+            queries = [query[:length] for query in queries for length in range(1, len(query) + 1)]
+        run(queries[0], options['limit'])  # warm up
+
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            run(query, options['limit'])
+            timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        p50 = statistics.median(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f"{len(timings)} queries: p50 {p50:.2f} ms, p95 {p95:.2f} ms, max {timings[-1]:.2f} ms"
+        )
+
+        budget = options['budget_ms']
+        if budget is not None and p95 > budget:
+            raise CommandError(f"p95 latency {p95:.2f} ms is over the {budget:g} ms budget")
+        self.stdout.write(self.style.SUCCESS("Done"))
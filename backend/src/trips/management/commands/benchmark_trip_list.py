@@ -0,0 +1,134 @@
+import statistics
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from trips.api import TRIP_LIST_ORDERING, user_trips
+from trips.models import Trip, Stop, Activity
+from trips.totals import recalculate_totals, trip_total_expressions
+from globetrotter.pagination import order_by_fields
+
+
+def joined_counts(trips):
+    """The former list_trips aggregation: one join fanning out to stops x activities"""
+    return trips.annotate(
+        n_stops=Count('stops', distinct=True), n_activities=Count('stops__activities')
+    ).values_list('id', 'n_stops', 'n_activities')
+
+
+def subquery_counts(trips):
+    """Correlated subqueries, one aggregate per trip row"""
+    totals = trip_total_expressions()
+    return trips.annotate(
+        n_stops=totals['stops_count'], n_activities=totals['activities_count']
+    ).values_list('id', 'n_stops', 'n_activities')
+
+
+def stored_counts(trips):
+    """The denormalized columns list_trips reads"""
+    return trips.values_list('id', 'stops_count', 'activities_count')
+
+
+STRATEGIES = {'join': joined_counts, 'subquery': subquery_counts, 'stored': stored_counts}
+
+
+def seed_trips(user, trips, stops, activities):
+    start = date(2025, 1, 1)
+    trip_rows = [
+        Trip(user=user, name=f'Benchmark trip {i}', start_date=start, end_date=start + timedelta(days=stops))
+        for i in range(trips)
+    ]
+    Trip.objects.bulk_create(trip_rows, batch_size=500)
+
+    stop_rows = [
+        Stop(
+            trip=trip, city_name=f'City {j}', country='Benchmark', order_index=j,
+            start_date=start + timedelta(days=j), end_date=start + timedelta(days=j),
+            accommodation_cost=Decimal('80.00')
+        )
+        for trip in trip_rows for j in range(stops)
+    ]
+    Stop.objects.bulk_create(stop_rows, batch_size=500)
+
+    Activity.objects.bulk_create(
+        (Activity(stop=stop, name=f'Activity {k}', cost=Decimal('12.50')) for stop in stop_rows for k in range(activities)),
+        batch_size=500
+    )
+    recalculate_totals([trip.id for trip in trip_rows])
+
+
+class Command(BaseCommand):
+    help = "Compare trip list aggregation strategies for a user owning many trips"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=500, help='Trips owned by the benchmark user')
+        parser.add_argument('--stops', type=int, default=20, help='Stops per trip')
+        parser.add_argument('--activities', type=int, default=3, help='Activities per stop')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed runs per strategy')
+        parser.add_argument('--page-size', type=int, default=20, help='Rows per list page; 0 lists every trip')
+        parser.add_argument(
+            '--strategy', action='append', dest='strategies', choices=sorted(STRATEGIES),
+            help='Strategy to time (can be repeated, default all)'
+        )
+        parser.add_argument(
+            '--budget-ms', type=float, default=None,
+            help='Fail when p95 latency of the list_trips strategy exceeds this many milliseconds'
+        )
+
+    def handle(self, *args, **options):
+        # Seeded rows are rolled back when the benchmark is done
+        with transaction.atomic():
+            try:
+                self.run(options)
+            finally:
+                transaction.set_rollback(True)
+
+    def run(self, options):
+        started = time.perf_counter()
+        user = get_user_model().objects.create_user(
+            email=f'benchmark-{uuid.uuid4().hex}@example.com', first_name='Benchmark', last_name='User',
+            password=uuid.uuid4().hex
+        )
+        seed_trips(user, options['trips'], options['stops'], options['activities'])
+        self.stdout.write(
+            f"Seeded {options['trips']} trips x {options['stops']} stops x {options['activities']} activities "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+        trips = user_trips(user).order_by(*order_by_fields(TRIP_LIST_ORDERING))
+        page_size = options['page_size']
+        results = {}
+        p95s = {}
+        for name in options['strategies'] or list(STRATEGIES):
+            query = STRATEGIES[name](trips)
+            if page_size:
+                query = query[:page_size]
+            results[name] = list(query.all())  # warm up
+
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(query.all())
+                timings.append((time.perf_counter() - started) * 1000)
+
+            timings.sort()
+            p95s[name] = timings[max(int(len(timings) * 0.95) - 1, 0)]
+            self.stdout.write(
+                f"{name:>8}: p50 {statistics.median(timings):.2f} ms, p95 {p95s[name]:.2f} ms, max {timings[-1]:.2f} ms"
+            )
+
+        expected = (options['stops'], options['stops'] * options['activities'])
+        for name, rows in results.items():
+            wrong = [row for row in rows if tuple(row[1:]) != expected]
+            if wrong:
+                raise CommandError(f"{name} returned wrong counts for {len(wrong)} trip(s), e.g. {wrong[0][1:]}")
+
+        budget = options['budget_ms']
+        if budget is not None and p95s.get('stored', 0) > budget:
+            raise CommandError(f"p95 latency {p95s['stored']:.2f} ms is over the {budget:g} ms budget")
+        self.stdout.write(self.style.SUCCESS("All strategies returned the same counts"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from trips.cache import CACHE_NAMESPACES
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters of the API cache namespaces (kept when CACHE_TRACK_STATS is set)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        for namespace in CACHE_NAMESPACES:
+            stats = namespace.stats()
+            self.stdout.write(
+                f"{stats['namespace']:<10} hits={stats['hits']:<8} misses={stats['misses']:<8} "
+                f"hit_rate={stats['hit_rate']:.1%}"
+            )
+            if options['reset']:
+                namespace.reset_stats()
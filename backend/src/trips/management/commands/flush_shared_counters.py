@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from trips.counters import flush_shared_counters
+
+
+class Command(BaseCommand):
+    help = "Write buffered SharedItinerary view/copy counters to the database (run periodically)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Changed shared itineraries read and updated per UPDATE statement'
+        )
+
+    def handle(self, *args, **options):
+        written = flush_shared_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Flushed {written} counter increment(s)"))
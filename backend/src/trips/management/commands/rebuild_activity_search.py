@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from trips.models import ActivityCatalog
+from trips.catalog_search import refresh_geohashes, update_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Recompute ActivityCatalog search vectors and geohashes, e.g. after bulk imports that bypass save()"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of activities updated per UPDATE statement'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        fixed = refresh_geohashes(ActivityCatalog.objects.all(), batch_size=batch_size)
+        self.stdout.write(f"Updated geohashes of {fixed} activities")
+
+        if connection.vendor != 'postgresql':
+            self.stdout.write("Search vectors are only stored on PostgreSQL, skipping them")
+            return
+
+        updated = 0
+        last_id = None
+        while True:
+            ids = ActivityCatalog.objects.order_by('id').values_list('id', flat=True)
+            if last_id is not None:
+                ids = ids.filter(id__gt=last_id)
+            batch = list(ids[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+            updated += update_search_vectors(ActivityCatalog.objects.filter(id__in=batch))
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search vectors of {updated} activities"))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from trips.cache import invalidate_trip
+from trips.budgeting import as_amount, auto_budgets, activity_cost_total, stay_cost_total, recalculate_budgets
+
+
+class Command(BaseCommand):
+    help = "Recompute auto-calculated budget costs from stops and activities and fix any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--trip', action='append', dest='trips', default=[],
+            help='Only reconcile the budget of this trip id (can be repeated)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of drifted budgets fixed per UPDATE statement'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drifted budgets without changing them'
+        )
+
+    def handle(self, *args, **options):
+        budgets = auto_budgets()
+        if options['trips']:
+            budgets = budgets.filter(trip_id__in=options['trips'])
+
+        rows = budgets.annotate(
+            expected_activity_cost=activity_cost_total(),
+            expected_stay_cost=stay_cost_total()
+        ).values_list('id', 'trip_id', 'activity_cost', 'stay_cost', 'expected_activity_cost', 'expected_stay_cost')
+
+        drifted = []
+        drifted_trips = []
+        for budget_id, trip_id, activity_cost, stay_cost, expected_activity, expected_stay in rows.iterator(chunk_size=2000):
+            if as_amount(activity_cost) != as_amount(expected_activity) or as_amount(stay_cost) != as_amount(expected_stay):
+                drifted.append(budget_id)
+                drifted_trips.append(trip_id)
+                self.stdout.write(
+                    f"Trip {trip_id}: activity {activity_cost} -> {expected_activity}, stay {stay_cost} -> {expected_stay}"
+                )
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(drifted)} budget(s) out of sync")
+            return
+
+        batch_size = options['batch_size']
+        for start in range(0, len(drifted), batch_size):
+            recalculate_budgets(auto_budgets().filter(id__in=drifted[start:start + batch_size]))
+        for trip_id in drifted_trips:
+            invalidate_trip(trip_id)
+
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(drifted)} budget(s)"))
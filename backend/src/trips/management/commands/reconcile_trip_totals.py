@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from trips.models import Trip
+from trips.totals import TRIP_TOTAL_FIELDS, recalculate_totals, trip_total_expressions
+
+
+class Command(BaseCommand):
+    help = "Recompute stored trip and stop totals from stops and activities and fix any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--trip', action='append', dest='trips', default=[],
+            help='Only reconcile this trip id (can be repeated)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of drifted trips fixed per UPDATE statement'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drifted trips without changing them'
+        )
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.all()
+        if options['trips']:
+            trips = trips.filter(id__in=options['trips'])
+
+        expected = {f'expected_{field}': expression for field, expression in trip_total_expressions().items()}
+        rows = trips.annotate(**expected).values('id', *TRIP_TOTAL_FIELDS, *expected)
+
+        drifted = []
+        for row in rows.iterator(chunk_size=2000):
+            changes = [
+                f"{field} {row[field]} -> {row[f'expected_{field}']}"
+                for field in TRIP_TOTAL_FIELDS if row[field] != row[f'expected_{field}']
+            ]
+            if changes:
+                drifted.append(row['id'])
+                self.stdout.write(f"Trip {row['id']}: {', '.join(changes)}")
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(drifted)} trip(s) out of sync")
+            return
+
+        batch_size = options['batch_size']
+        for start in range(0, len(drifted), batch_size):
+            recalculate_totals(drifted[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(drifted)} trip(s)"))
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:01
+
+import django.contrib.postgres.search
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+
+# The GIN index and the initial search vectors only exist on PostgreSQL.
+# The vector is a copy of trips.catalog_search.activity_search_vector() as of
+# this migration, so later changes there do not alter it.
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.search import SearchVector
+
+    ActivityCatalog = apps.get_model('trips', 'ActivityCatalog')
+    ActivityCatalog.objects.update(search_vector=(
+        SearchVector('name', weight='A', config='english')
+        + SearchVector(
+            Cast('tags', models.TextField()), 'location_name', 'city_name', weight='B', config='english'
+        )
+        + SearchVector('description', weight='C', config='english')
+    ))
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS activity_catalog_search_idx ON activity_catalog USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS activity_catalog_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0002_city_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitycatalog',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='activitycatalog',
+            index=models.Index(django.db.models.functions.text.Upper('city_name'), name='activity_catalog_city_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitycatalog',
+            index=models.Index(models.OrderBy(django.db.models.functions.comparison.Coalesce('rating', models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=2, max_digits=3)), descending=True), models.OrderBy(models.F('review_count'), descending=True), models.F('id'), condition=models.Q(('is_verified', True)), name='activity_catalog_rank_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
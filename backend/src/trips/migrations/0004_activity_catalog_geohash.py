@@ -0,0 +1,62 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:03
+
+from django.db import migrations, models
+
+
+# Copies of trips.geo.encode_geohash() and trips.catalog_search.refresh_geohashes()
+# as of this migration, so later changes there do not alter it
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+BATCH_SIZE = 2000
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, value, even = [], 0, 0, True
+
+    while len(geohash) < precision:
+        interval, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+
+    return ''.join(geohash)
+
+
+def backfill_geohashes(apps, schema_editor):
+    ActivityCatalog = apps.get_model('trips', 'ActivityCatalog')
+    activities = ActivityCatalog.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    batch = []
+    for activity in activities.only('id', 'latitude', 'longitude').iterator(chunk_size=BATCH_SIZE):
+        activity.geohash = encode_geohash(float(activity.latitude), float(activity.longitude))
+        batch.append(activity)
+        if len(batch) >= BATCH_SIZE:
+            ActivityCatalog.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        ActivityCatalog.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0003_activity_catalog_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitycatalog',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(backfill_geohashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0004_activity_catalog_geohash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='trips_user_created_idx'),
+        ),
+    ]
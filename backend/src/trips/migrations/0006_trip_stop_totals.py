@@ -0,0 +1,76 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:18
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def _total(queryset, group_by, aggregate, default, output_field):
+    total = queryset.order_by().values(group_by).annotate(total=aggregate).values('total')
+    return Coalesce(Subquery(total), Value(default), output_field=output_field)
+
+
+def backfill_totals(apps, schema_editor):
+    Trip = apps.get_model('trips', 'Trip')
+    Stop = apps.get_model('trips', 'Stop')
+    Activity = apps.get_model('trips', 'Activity')
+    count = lambda qs, group_by: _total(qs, group_by, Count('pk'), 0, models.IntegerField())
+    cost = lambda qs, group_by, field: _total(
+        qs, group_by, Sum(field), Decimal('0.00'), models.DecimalField(max_digits=12, decimal_places=2)
+    )
+
+    stop_activities = Activity.objects.filter(stop_id=OuterRef('pk'))
+    Stop.objects.update(
+        activities_count=count(stop_activities, 'stop'),
+        activities_cost=cost(stop_activities, 'stop', 'cost'),
+    )
+    trip_stops = Stop.objects.filter(trip_id=OuterRef('pk'))
+    trip_activities = Activity.objects.filter(stop__trip_id=OuterRef('pk'))
+    Trip.objects.update(
+        stops_count=count(trip_stops, 'trip'),
+        accommodation_cost=cost(trip_stops, 'trip', 'accommodation_cost'),
+        activities_count=count(trip_activities, 'stop__trip'),
+        activities_cost=cost(trip_activities, 'stop__trip', 'cost'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0005_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stop',
+            name='activities_cost',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='stop',
+            name='activities_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='accommodation_cost',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='activities_cost',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='activities_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='stops_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:59
+
+from django.db import migrations
+
+# The city filter of /search/activities is an icontains match, which PostgreSQL
+# runs as UPPER(city_name) LIKE '%...%'. A GIN trigram index on that expression
+# serves it; pg_trgm is installed by 0002. Other backends scan.
+
+
+def create_city_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS activity_catalog_city_trgm_idx '
+        'ON activity_catalog USING gin (UPPER(city_name) gin_trgm_ops)'
+    )
+
+
+def drop_city_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS activity_catalog_city_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0006_trip_stop_totals'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='activitycatalog',
+            name='activity_catalog_city_idx',
+        ),
+        migrations.RunPython(create_city_trigram_index, drop_city_trigram_index),
+    ]
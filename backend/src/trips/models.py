@@ -2,9 +2,22 @@ import uuid
 import secrets
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Coalesce
 from django.utils.text import slugify
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
+from .geo import encode_geohash
+
+def exclude_total_fields(instance, save_kwargs):
+    """Leave denormalized totals out of updates so stale in-memory values never overwrite them"""
+    if instance._state.adding or save_kwargs.get('force_insert') or save_kwargs.get('update_fields') is not None:
+        return
+    save_kwargs['update_fields'] = [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in instance.TOTAL_FIELDS
+    ]
 
 class Trip(models.Model):
     """Main trip model"""
@@ -36,29 +49,37 @@ class Trip(models.Model):
     collaborators_can_edit = models.BooleanField(default=False)
     auto_calculate_budget = models.BooleanField(default=True)
     
+    # Totals of the trip's stops and activities, maintained by trips.totals
+    stops_count = models.PositiveIntegerField(default=0, editable=False)
+    activities_count = models.PositiveIntegerField(default=0, editable=False)
+    activities_cost = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    accommodation_cost = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    TOTAL_FIELDS = ('stops_count', 'activities_count', 'activities_cost', 'accommodation_cost')
+    
     class Meta:
         db_table = 'trips'
         ordering = ['-created_at']
+        indexes = [
+            # Keyset order of list_trips
+            models.Index(fields=['user', '-created_at', '-id'], name='trips_user_created_idx'),
+        ]
         verbose_name = 'Trip'
         verbose_name_plural = 'Trips'
     
     def __str__(self):
         return f"{self.name} by {self.user.email}"
     
+    def save(self, *args, **kwargs):
+        exclude_total_fields(self, kwargs)
+        super().save(*args, **kwargs)
+    
     @property
     def duration_days(self):
         return (self.end_date - self.start_date).days + 1
-    
-    @property
-    def stops_count(self):
-        return self.stops.count()
-    
-    @property
-    def activities_count(self):
-        return sum(stop.activities.count() for stop in self.stops.all())
 
 class Stop(models.Model):
     """Trip stops/destinations"""
@@ -81,9 +102,15 @@ class Stop(models.Model):
     accommodation_address = models.TextField(blank=True)
     accommodation_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     
+    # Totals of the stop's activities, maintained by trips.totals
+    activities_count = models.PositiveIntegerField(default=0, editable=False)
+    activities_cost = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    TOTAL_FIELDS = ('activities_count', 'activities_cost')
+    
     class Meta:
         db_table = 'stops'
         ordering = ['order_index', 'start_date']
@@ -93,13 +120,17 @@ class Stop(models.Model):
     def __str__(self):
         return f"{self.city_name}, {self.country}"
     
+    def clean(self):
+        if self.start_date and self.end_date and self.end_date < self.start_date:
+            raise ValidationError({'end_date': 'End date cannot be before start date.'})
+    
+    def save(self, *args, **kwargs):
+        exclude_total_fields(self, kwargs)
+        super().save(*args, **kwargs)
+    
     @property
     def duration_days(self):
         return (self.end_date - self.start_date).days + 1
-    
-    @property
-    def activities_count(self):
-        return self.activities.count()
 
 class Activity(models.Model):
     """Activities within each stop"""
@@ -484,6 +515,11 @@ class ActivityCatalog(models.Model):
     tags = models.JSONField(default=list, blank=True)
     is_verified = models.BooleanField(default=False)
     
+    # Weighted full-text document, maintained on PostgreSQL (see catalog_search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Geohash of latitude/longitude, for radius queries (see geo)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
+    
     last_updated = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -497,8 +533,28 @@ class ActivityCatalog(models.Model):
             models.Index(fields=['category']),
             models.Index(fields=['rating']),
             models.Index(fields=['is_verified']),
+            # Browse order of verified activities, used for keyset pagination
+            models.Index(
+                Coalesce('rating', models.Value(Decimal('0')), output_field=models.DecimalField(max_digits=3, decimal_places=2)).desc(),
+                models.F('review_count').desc(),
+                'id',
+                name='activity_catalog_rank_idx',
+                condition=models.Q(is_verified=True),
+            ),
         ]
     
+    def save(self, *args, **kwargs):
+        self.geohash = self.compute_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+    
+    def compute_geohash(self):
+        if self.latitude is None or self.longitude is None:
+            return ''
+        return encode_geohash(float(self.latitude), float(self.longitude))
+    
     def __str__(self):
         return f"{self.name} in {self.city_name}, {self.country}"
     
@@ -0,0 +1,120 @@
+"""
+Visiting order of a trip's stops, for /trips/{trip_id}/stops/optimize.
+
+The order is an open path (no return to the first stop) that keeps the
+stops' dates consistent. A stop must come before another when it starts
+earlier and ends no later than the other starts. Only stops whose dates
+leave them free relative to each other can trade places.
+
+The distance matrix comes from a vectorized haversine. A nearest-neighbour
+pass builds a first path, always moving to the closest stop whose date
+predecessors are all visited. 2-opt then reverses the segment with the
+largest saving, as long as the segment holds no pair of date-ordered stops.
+Each round scores every (i, k) segment at once with NumPy. A stop without
+coordinates is treated as zero km from every other stop.
+"""
+
+import numpy as np
+
+from .geo import distance_matrix_km
+
+# Upper bound on 2-opt rounds, each applying the best reversal found
+MAX_TWO_OPT_ROUNDS = 2000
+MIN_SAVING_KM = 1e-9
+
+
+def stop_distances(stops):
+    """Distance matrix in km between stops given as dicts with latitude/longitude"""
+    located = np.array([stop['latitude'] is not None and stop['longitude'] is not None for stop in stops])
+    latitudes = np.array([float(stop['latitude']) if ok else 0.0 for stop, ok in zip(stops, located)])
+    longitudes = np.array([float(stop['longitude']) if ok else 0.0 for stop, ok in zip(stops, located)])
+    distances = distance_matrix_km(latitudes, longitudes)
+    distances[~located, :] = 0.0
+    distances[:, ~located] = 0.0
+    return distances
+
+
+def date_precedence(stops):
+    """must_precede[i, j]: stop i has to be visited before stop j"""
+    starts = np.array([stop['start_date'].toordinal() for stop in stops])
+    ends = np.array([stop['end_date'].toordinal() for stop in stops])
+    return (starts[:, None] < starts[None, :]) & (ends[:, None] <= starts[None, :])
+
+
+def path_length(distances, route):
+    route = np.asarray(route)
+    return float(distances[route[:-1], route[1:]].sum()) if len(route) > 1 else 0.0
+
+
+def nearest_neighbour_route(distances, must_precede, first):
+    """Greedy path from first, only moving to stops whose predecessors are visited"""
+    count = len(distances)
+    waiting_on = must_precede.sum(axis=0)
+    unvisited = np.ones(count, dtype=bool)
+    route, current = [], first
+    while True:
+        route.append(current)
+        unvisited[current] = False
+        waiting_on -= must_precede[current]
+        candidates = np.flatnonzero(unvisited & (waiting_on == 0))
+        if not len(candidates):
+            return route
+        current = candidates[np.argmin(distances[current, candidates])]
+
+
+def _reversible(must_precede, route):
+    """reversible[i, k]: route[i..k] holds no pair of date-ordered stops"""
+    count = len(route)
+    ordered = must_precede[np.ix_(route, route)]
+    positions = np.arange(count)
+    # First later position each stop has to precede, or count if none
+    first_successor = np.where(ordered.any(axis=1), ordered.argmax(axis=1), count)
+    successors = np.where(positions[None, :] >= positions[:, None], first_successor[None, :], count)
+    return np.minimum.accumulate(successors, axis=1) > positions[None, :]
+
+
+def two_opt(distances, must_precede, route, max_rounds=MAX_TWO_OPT_ROUNDS):
+    """Improve an open path by reversing segments while that shortens it"""
+    route = np.array(route)
+    count = len(route)
+    if count < 3:
+        return route.tolist()
+
+    # Pad the path with a free endpoint on both sides so its ends can move too
+    padded = np.zeros((count + 1, count + 1))
+    padded[:count, :count] = distances
+    end = count
+    upper = np.triu(np.ones((count, count), dtype=bool), k=1)
+
+    for _ in range(max_rounds):
+        path = np.concatenate(([end], route, [end]))
+        before, first, after = path[:-2], path[1:-1], path[2:]
+        incoming = padded[before, first]
+        outgoing = padded[first, after]
+        # Reversing route[i..k] swaps edges (before i, i) and (k, after k) for (before i, k) and (i, after k)
+        saving = incoming[:, None] + outgoing[None, :] - padded[np.ix_(before, first)] - padded[np.ix_(first, after)]
+        saving[~(upper & _reversible(must_precede, route))] = 0.0
+
+        i, k = np.unravel_index(np.argmax(saving), saving.shape)
+        if saving[i, k] <= MIN_SAVING_KM:
+            break
+        route[i:k + 1] = route[i:k + 1][::-1]
+    return route.tolist()
+
+
+def optimize_route(stops):
+    """Indices of stops in a short visiting order that respects their dates
+
+    stops are dicts with latitude, longitude, start_date and end_date, given
+    in their current order. Returns (route, distance_km).
+    """
+    if not stops:
+        return [], 0.0
+    distances = stop_distances(stops)
+    must_precede = date_precedence(stops)
+
+    # Start from the earliest stop, breaking ties by the current order
+    first = min(range(len(stops)), key=lambda index: (stops[index]['start_date'], index))
+    route = nearest_neighbour_route(distances, must_precede, first)
+    route = two_opt(distances, must_precede, route)
+    return route, path_length(distances, route)
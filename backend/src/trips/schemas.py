@@ -96,6 +96,7 @@ class StopSchema(Schema):
     accommodation_cost: Optional[Decimal] = None
     activities: List[ActivitySchema] = []
     activities_count: int = 0
+    activities_cost: Decimal = Decimal('0.00')
     duration_days: int = 0
     created_at: datetime
     updated_at: datetime
@@ -130,6 +131,18 @@ class StopUpdateSchema(Schema):
     accommodation_address: Optional[str] = None
     accommodation_cost: Optional[Decimal] = None
 
+class StopOrderSchema(Schema):
+    """Schema for one entry of a stop reorder request"""
+    stop_id: uuid.UUID
+    order_index: int
+
+class StopRouteSchema(Schema):
+    """Schema for an optimized stop order"""
+    order: List[StopOrderSchema]
+    distance_km: float
+    original_distance_km: float
+    applied: bool = False
+
 # Budget Schemas
 class BudgetSchema(Schema):
     """Schema for budget response"""
@@ -207,6 +220,8 @@ class TripSchema(Schema):
     budget: Optional[BudgetSchema] = None
     stops_count: int = 0
     activities_count: int = 0
+    activities_cost: Decimal = Decimal('0.00')
+    accommodation_cost: Decimal = Decimal('0.00')
     duration_days: int = 0
 
 class TripListSchema(Schema):
@@ -222,6 +237,8 @@ class TripListSchema(Schema):
     currency: str = "USD"
     stops_count: int = 0
     activities_count: int = 0
+    activities_cost: Decimal = Decimal('0.00')
+    accommodation_cost: Decimal = Decimal('0.00')
     duration_days: int = 0
     created_at: datetime
 
@@ -587,10 +604,83 @@ class TripStatsSchema(Schema):
     total_cost: Decimal
     cost_by_category: Dict[str, Decimal]
     cost_by_stop: Dict[str, Decimal]
+    cost_by_day: Dict[str, Decimal] = {}
     daily_average: Decimal
     most_expensive_day: Optional[date] = None
     budget_utilization: float = 0.0
 
+class ItineraryActivitySchema(Schema):
+    """Schema for an activity placed on an itinerary day"""
+    id: uuid.UUID
+    stop_id: uuid.UUID
+    name: str
+    category: str
+    start_time: Optional[time] = None
+    end_time: Optional[time] = None
+    cost: Optional[Decimal] = None
+    location: str
+    is_booked: bool = False
+    is_paid: bool = False
+
+class ItineraryDaySchema(Schema):
+    """Schema for one day of a trip itinerary"""
+    date: date
+    locations: List[str] = []
+    activities: List[ItineraryActivitySchema] = []
+
+class TripItinerarySchema(Schema):
+    """Schema for a trip itinerary, one entry per day
+
+    Activities have no date; the day each one is listed on is inferred from
+    planning order and start times (see trips.itinerary), so days_inferred is
+    always true and an activity can move when an earlier one changes.
+    """
+    trip_id: uuid.UUID
+    start_date: date
+    end_date: date
+    days_inferred: bool = True
+    days: List[ItineraryDaySchema]
+
+class StopConflictSchema(Schema):
+    """Schema for two stops whose dates overlap"""
+    first_stop_id: uuid.UUID
+    first_location: str
+    second_stop_id: uuid.UUID
+    second_location: str
+    overlap_start: date
+    overlap_end: date
+
+class ActivityConflictSchema(Schema):
+    """Schema for two activities of the same stop whose times overlap"""
+    stop_id: uuid.UUID
+    first_activity_id: uuid.UUID
+    first_name: str
+    second_activity_id: uuid.UUID
+    second_name: str
+    overlap_start: time
+    overlap_end: time
+
+class TripConflictsSchema(Schema):
+    """Schema for the schedule conflicts of a trip"""
+    trip_id: uuid.UUID
+    has_conflicts: bool
+    stop_conflicts: List[StopConflictSchema] = []
+    activity_conflicts: List[ActivityConflictSchema] = []
+
+class TripAnalyticsSchema(Schema):
+    """Schema for a multi-trip analytics request"""
+    trip_ids: List[uuid.UUID] = []
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+class TripAnalyticsResultSchema(Schema):
+    """Schema for daily spend per category across trips"""
+    trip_count: int
+    dates: List[date]
+    cost_by_category: Dict[str, List[float]]
+    daily_totals: List[float]
+    category_totals: Dict[str, float]
+
 class UserTripStatsSchema(Schema):
     """Schema for user's trip statistics"""
     total_trips: int
@@ -607,10 +697,23 @@ class UserTripStatsSchema(Schema):
 class BulkActivityCreateSchema(Schema):
     """Schema for creating multiple activities"""
     activities: List[ActivityCreateSchema]
+    check_conflicts: bool = False  # reject activities overlapping others on the same day
 
 class BulkStopCreateSchema(Schema):
     """Schema for creating multiple stops"""
     stops: List[StopCreateSchema]
+    check_conflicts: bool = False  # reject stops overlapping the trip's other stops
+
+class BulkRowErrorSchema(Schema):
+    """Validation errors of a single row in a bulk request"""
+    index: int
+    errors: Dict[str, List[str]]
+
+class BulkErrorResponseSchema(Schema):
+    """Schema for a rejected bulk request"""
+    message: str
+    success: bool = False
+    errors: List[BulkRowErrorSchema] = []
 
 # Import/Export Schemas
 class TripExportSchema(Schema):
@@ -625,3 +728,14 @@ class TripImportSchema(Schema):
     data: Dict[str, Any]
     source_format: str = "json"
     merge_with_existing: bool = False
+
+class TripImportResultSchema(Schema):
+    """Schema for a completed trip import"""
+    message: str
+    success: bool = True
+    trips_created: int = 0
+    trips_updated: int = 0
+    stops_created: int = 0
+    stops_updated: int = 0
+    activities_created: int = 0
+    activities_updated: int = 0
@@ -0,0 +1,494 @@
+"""
+City search.
+
+On PostgreSQL the ranking runs in the database against pg_trgm GIN indexes
+(see migration 0002). Other backends, SQLite in development and tests, use
+CityIndex: an in-process index that mimics pg_trgm similarity over trigram
+posting lists and answers prefix queries from a sorted term array.
+"""
+
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .models import City
+from .cache import search_cache
+
+logger = logging.getLogger(__name__)
+
+# pg_trgm's default similarity threshold
+SIMILARITY_THRESHOLD = 0.3
+
+# Candidates taken from the trigram postings before exact scoring
+MAX_CANDIDATES = 200
+
+# Score boosts so exact and prefix matches outrank fuzzy ones
+EXACT_MATCH_SCORE = 3.0
+NAME_PREFIX_SCORE = 2.0
+WORD_PREFIX_SCORE = 1.5
+COUNTRY_MATCH_WEIGHT = 0.9
+
+# Autocomplete keeps the largest cities of every 1-3 character prefix ready,
+# longer prefixes scan their (short) range of the term array
+HOT_PREFIX_LENGTH = 3
+AUTOCOMPLETE_MAX_RESULTS = 20
+MAX_PREFIX_SCAN = 5000
+
+
+def normalize(text):
+    """Lowercase and strip accents so 'São Paulo' matches 'sao paulo'"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold().strip()
+
+
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
+
+def words(text):
+    return WORD_PATTERN.findall(text)
+
+
+def trigrams(text):
+    """Trigram set of already normalized text, padded per word like pg_trgm"""
+    result = set()
+    for word in words(text):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(left, right):
+    """pg_trgm similarity() of two trigram sets"""
+    if not left or not right:
+        return 0.0
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+
+class CityEntry(NamedTuple):
+    id: object
+    name: str
+    country: str
+    latitude: Optional[float]
+    longitude: Optional[float]
+    timezone: str
+    popular_attractions: List[str]
+    population: int
+
+    @classmethod
+    def from_city(cls, city):
+        return cls(
+            id=city.id,
+            name=city.name,
+            country=city.country,
+            latitude=float(city.latitude) if city.latitude else None,
+            longitude=float(city.longitude) if city.longitude else None,
+            timezone=city.timezone,
+            popular_attractions=list(city.popular_attractions or [])[:3],
+            population=city.population or 0
+        )
+
+    def as_suggestion(self):
+        return {"id": self.id, "name": self.name, "country": self.country}
+
+    def as_result(self):
+        return {
+            "name": self.name,
+            "country": self.country,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "timezone": self.timezone,
+            "popular_attractions": self.popular_attractions
+        }
+
+
+CITY_ENTRY_FIELDS = ('id', 'name', 'country', 'latitude', 'longitude', 'timezone', 'popular_attractions', 'population')
+
+
+class CityIndex:
+    """In-process city index with trigram postings and a sorted prefix array
+
+    Entries are addressed by small integer slots so posting lists stay compact.
+    sequence is the last change journal entry applied, see current_city_index().
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}                    # slot -> CityEntry
+            self._names = {}                      # slot -> normalized name
+            self._slots = {}                      # city id -> slot
+            self._next_slot = 0
+            self._postings = defaultdict(list)    # name trigram -> [slot]
+            self._countries = defaultdict(list)   # normalized country -> [slot]
+            self._country_trigrams = {}           # normalized country -> trigram set
+            self._terms = []                      # sorted [(normalized name or word, slot)]
+            self._hot_prefixes = {}               # short prefix -> [slot] by population
+            self.loaded = False
+            self.sequence = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _terms_for(name):
+        return {name, *words(name)}
+
+    def _population(self, slot):
+        return self._entries[slot].population
+
+    def _largest(self, slots, limit):
+        return heapq.nlargest(limit, set(slots), key=lambda slot: (self._population(slot), -slot))
+
+    @staticmethod
+    def _hot_prefixes_of(name):
+        return {
+            term[:length]
+            for term in CityIndex._terms_for(name)
+            for length in range(1, HOT_PREFIX_LENGTH + 1) if len(term) >= length
+        }
+
+    def _refresh_hot_prefix(self, prefix):
+        slots = self.prefix_slots(prefix, len(self._terms))
+        if slots:
+            self._hot_prefixes[prefix] = self._largest(slots, AUTOCOMPLETE_MAX_RESULTS)
+        else:
+            self._hot_prefixes.pop(prefix, None)
+
+    def _add_country(self, country, slot):
+        if country not in self._country_trigrams:
+            self._country_trigrams[country] = trigrams(country)
+        self._countries[country].append(slot)
+
+    def add(self, entry):
+        """Insert or replace an entry"""
+        with self._lock:
+            self.remove(entry.id)
+            slot = self._next_slot
+            self._next_slot += 1
+            name = normalize(entry.name)
+            self._entries[slot] = entry
+            self._names[slot] = name
+            self._slots[entry.id] = slot
+            for trigram in trigrams(name):
+                self._postings[trigram].append(slot)
+            self._add_country(normalize(entry.country), slot)
+            for term in self._terms_for(name):
+                index = bisect_left(self._terms, (term, slot))
+                self._terms.insert(index, (term, slot))
+            for prefix in self._hot_prefixes_of(name):
+                hot = self._hot_prefixes.get(prefix, []) + [slot]
+                self._hot_prefixes[prefix] = self._largest(hot, AUTOCOMPLETE_MAX_RESULTS)
+
+    def remove(self, city_id):
+        with self._lock:
+            slot = self._slots.pop(city_id, None)
+            if slot is None:
+                return
+            entry = self._entries.pop(slot)
+            name = self._names.pop(slot)
+            for trigram in trigrams(name):
+                self._postings[trigram].remove(slot)
+            self._countries[normalize(entry.country)].remove(slot)
+            for term in self._terms_for(name):
+                index = bisect_left(self._terms, (term, slot))
+                del self._terms[index]
+            for prefix in self._hot_prefixes_of(name):
+                if slot in self._hot_prefixes.get(prefix, ()):
+                    self._refresh_hot_prefix(prefix)
+
+    def load(self, entries):
+        """Replace the index contents with the given entries"""
+        with self._lock:
+            self.clear()
+            entries = list(entries)
+            terms = []
+            for slot, entry in enumerate(entries):
+                name = normalize(entry.name)
+                self._entries[slot] = entry
+                self._names[slot] = name
+                self._slots[entry.id] = slot
+                for trigram in trigrams(name):
+                    self._postings[trigram].append(slot)
+                self._add_country(normalize(entry.country), slot)
+                terms.extend((term, slot) for term in self._terms_for(name))
+            terms.sort()
+            self._terms = terms
+
+            by_prefix = defaultdict(set)
+            for term, slot in terms:
+                for length in range(1, min(HOT_PREFIX_LENGTH, len(term)) + 1):
+                    by_prefix[term[:length]].add(slot)
+            self._hot_prefixes = {
+                prefix: self._largest(slots, AUTOCOMPLETE_MAX_RESULTS) for prefix, slots in by_prefix.items()
+            }
+            self._next_slot = len(entries)
+            self.loaded = True
+
+    def prefix_slots(self, prefix, limit):
+        """Slots whose name, or a word of it, starts with prefix"""
+        terms = self._terms
+        slots = []
+        for index in range(bisect_left(terms, (prefix,)), len(terms)):
+            term, slot = terms[index]
+            if not term.startswith(prefix) or len(slots) >= limit:
+                break
+            slots.append(slot)
+        return slots
+
+    def _score(self, query, query_trigrams, slot):
+        name = self._names[slot]
+        if name == query:
+            return EXACT_MATCH_SCORE
+        if name.startswith(query):
+            return NAME_PREFIX_SCORE
+        name_words = words(name)
+        if any(word.startswith(query) for word in name_words):
+            return WORD_PREFIX_SCORE
+        return max(
+            similarity(query_trigrams, trigrams(name)),
+            max((similarity(query_trigrams, trigrams(word)) for word in name_words), default=0.0)
+        )
+
+    def autocomplete(self, prefix, limit=8):
+        """Largest cities whose name, a word of it, or country starts with prefix"""
+        prefix = normalize(prefix)
+        limit = min(limit, AUTOCOMPLETE_MAX_RESULTS)
+        if not prefix or limit < 1:
+            return []
+
+        with self._lock:
+            if len(prefix) <= HOT_PREFIX_LENGTH:
+                slots = self._hot_prefixes.get(prefix, [])[:limit]
+            else:
+                slots = self._largest(self.prefix_slots(prefix, MAX_PREFIX_SCAN), limit)
+
+            if len(slots) < limit:
+                seen = set(slots)
+                matched = [
+                    slot
+                    for country, country_slots in self._countries.items() if country.startswith(prefix)
+                    for slot in country_slots if slot not in seen
+                ]
+                slots = slots + self._largest(matched, limit - len(slots))
+
+            return [self._entries[slot] for slot in slots]
+
+    def search(self, query, limit=10):
+        """Ranked, typo tolerant matches on city name or country"""
+        query = normalize(query)
+        if not query:
+            return []
+
+        with self._lock:
+            query_trigrams = trigrams(query)
+            counts = Counter()
+            for trigram in query_trigrams:
+                counts.update(self._postings.get(trigram, ()))
+
+            candidates = {slot for slot, _ in counts.most_common(MAX_CANDIDATES)}
+            candidates.update(self.prefix_slots(query, MAX_CANDIDATES))
+
+            scored = {}
+            for slot in candidates:
+                score = self._score(query, query_trigrams, slot)
+                if score >= SIMILARITY_THRESHOLD:
+                    scored[slot] = score
+
+            # Country matches bring in that country's largest cities
+            for country, slots in self._countries.items():
+                if not slots:
+                    continue
+                country_score = similarity(query_trigrams, self._country_trigrams[country])
+                if country.startswith(query):
+                    country_score = 1.0
+                if country_score < SIMILARITY_THRESHOLD:
+                    continue
+                largest = sorted(slots, key=lambda slot: -self._entries[slot].population)[:limit]
+                for slot in largest:
+                    scored[slot] = max(scored.get(slot, 0.0), country_score * COUNTRY_MATCH_WEIGHT)
+
+            ranked = sorted(
+                scored.items(),
+                key=lambda item: (-item[1], -self._entries[item[0]].population, self._entries[item[0]].name)
+            )
+            return [self._entries[slot] for slot, _ in ranked[:limit]]
+
+
+city_index = CityIndex()
+_sync_lock = threading.Lock()
+_last_sync_check = 0.0
+_last_rebuild = 0.0
+
+# With a cache shared by all workers (settings.CACHE_SHARED), City writes are
+# journaled there on commit so every process can replay them into its own
+# index. A per-process cache would hide other processes' writes, so without
+# one each index is rebuilt every CITY_INDEX_REBUILD_INTERVAL seconds instead.
+JOURNAL_SCOPE = 'city-index'
+JOURNAL_TIMEOUT = 24 * 60 * 60
+MAX_REPLAY = 1000
+
+
+def _journal_key(*parts):
+    return search_cache.key(JOURNAL_SCOPE, *parts)
+
+
+def _entry_from_row(row):
+    city_id, name, country, latitude, longitude, timezone, attractions, population = row
+    return CityEntry(
+        id=city_id, name=name, country=country,
+        latitude=float(latitude) if latitude else None,
+        longitude=float(longitude) if longitude else None,
+        timezone=timezone, popular_attractions=list(attractions or [])[:3],
+        population=population or 0
+    )
+
+
+def load_city_index(index=None):
+    """(Re)build the in-process index from the City table"""
+    index = index or city_index
+    rows = City.objects.order_by().values_list(*CITY_ENTRY_FIELDS).iterator(chunk_size=5000)
+    index.load(_entry_from_row(row) for row in rows)
+    return index
+
+
+def _replay(city_ids):
+    rows = City.objects.filter(id__in=city_ids).values_list(*CITY_ENTRY_FIELDS)
+    entries = {row[0]: _entry_from_row(row) for row in rows}
+    for city_id in city_ids:
+        if city_id in entries:
+            city_index.add(entries[city_id])
+        else:
+            city_index.remove(city_id)
+
+
+def _rebuild(sequence):
+    global _last_rebuild
+    load_city_index()
+    city_index.sequence = sequence
+    _last_rebuild = time.monotonic()
+
+
+def record_city_change(city_id):
+    """Journal a committed City write and apply it to this process's index"""
+    if not settings.CACHE_SHARED:
+        with _sync_lock:
+            if city_index.loaded:
+                _replay([city_id])
+        return
+
+    cache = search_cache.cache
+    sequence_key = _journal_key('sequence')
+    cache.add(sequence_key, 0, timeout=None)
+    try:
+        sequence = cache.incr(sequence_key)
+    except ValueError:
+        # Journal evicted; processes rebuild once they see it restart
+        return
+    cache.set(_journal_key(sequence), city_id, JOURNAL_TIMEOUT)
+
+    with _sync_lock:
+        if city_index.loaded and city_index.sequence == sequence - 1:
+            _replay([city_id])
+            city_index.sequence = sequence
+
+
+def current_city_index():
+    """The in-process index, brought up to date with the change journal
+
+    The journal is checked at most once per CITY_INDEX_SYNC_INTERVAL seconds.
+    Missed changes are replayed; a journal that restarted, has gaps or is too
+    far ahead triggers a full rebuild. Without a shared cache there is no
+    journal and the index is rebuilt once CITY_INDEX_REBUILD_INTERVAL has passed.
+    """
+    global _last_sync_check
+    now = time.monotonic()
+    if city_index.loaded and now - _last_sync_check < settings.CITY_INDEX_SYNC_INTERVAL:
+        return city_index
+
+    with _sync_lock:
+        if not settings.CACHE_SHARED:
+            if not city_index.loaded or now - _last_rebuild >= settings.CITY_INDEX_REBUILD_INTERVAL:
+                _rebuild(None)
+            _last_sync_check = now
+            return city_index
+
+        cache = search_cache.cache
+        sequence = cache.get(_journal_key('sequence'), 0)
+        behind = sequence - (city_index.sequence or 0)
+
+        if not city_index.loaded or behind < 0 or behind > MAX_REPLAY:
+            _rebuild(sequence)
+        elif behind:
+            keys = [_journal_key(number) for number in range(city_index.sequence + 1, sequence + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) == len(keys):
+                _replay(list(dict.fromkeys(changes[key] for key in keys)))
+                city_index.sequence = sequence
+            else:
+                _rebuild(sequence)
+
+        _last_sync_check = now
+    return city_index
+
+
+def warm_city_index():
+    """Build the index at startup so the first autocomplete request is fast"""
+    try:
+        current_city_index()
+    except Exception:
+        logger.exception("Could not build the city search index at startup")
+
+
+def _search_cities_in_database(query, limit):
+    from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
+
+    prefix_boost = Case(
+        When(name__iexact=query, then=Value(EXACT_MATCH_SCORE)),
+        When(name__istartswith=query, then=Value(NAME_PREFIX_SCORE)),
+        default=Value(0.0),
+        output_field=FloatField()
+    )
+    cities = City.objects.annotate(
+        rank=Greatest(
+            prefix_boost,
+            TrigramWordSimilarity(query, 'name'),
+            TrigramSimilarity('name', query),
+            TrigramWordSimilarity(query, 'country') * COUNTRY_MATCH_WEIGHT
+        )
+    ).filter(
+        Q(name__trigram_word_similar=query) |
+        Q(name__trigram_similar=query) |
+        Q(country__trigram_word_similar=query)
+    ).order_by('-rank', F('population').desc(nulls_last=True), 'name')[:limit]
+    return [CityEntry.from_city(city).as_result() for city in cities]
+
+
+def autocomplete_cities(prefix, limit=8):
+    """Keystroke autocomplete, answered from memory without touching the database"""
+    return [entry.as_suggestion() for entry in current_city_index().autocomplete(prefix, limit)]
+
+
+def search_cities(query, limit=10):
+    """Ranked, typo tolerant city search used by /search/cities"""
+    query = (query or '').strip()
+    if not query:
+        return [CityEntry.from_city(city).as_result() for city in City.objects.all()[:limit]]
+
+    if connection.vendor == 'postgresql':
+        return _search_cities_in_database(query, limit)
+    return [entry.as_result() for entry in current_city_index().search(query, limit)]
@@ -1,6 +1,14 @@
-from django.db.models.signals import post_save, post_delete
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import Trip, Budget, Activity, Stop
+from globetrotter.cache import version_on_change
+from .models import Trip, Budget, Activity, Stop, SharedItinerary, City, ActivityCatalog
+from .budgeting import as_amount, apply_activity_cost_delta, apply_stay_cost_delta
+from .cache import trip_cache, search_cache, trip_scope
+from .search import record_city_change
+from .catalog_search import update_search_vectors
 
 @receiver(post_save, sender=Trip)
 def create_trip_budget(sender, instance, created, **kwargs):
@@ -8,60 +16,104 @@ def create_trip_budget(sender, instance, created, **kwargs):
     if created:
         Budget.objects.create(trip=instance, currency=instance.currency)
 
+def _stored_values(instance, *fields):
+    """Values currently stored for an instance, or None if it is being added"""
+    if instance._state.adding:
+        return None
+    return type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+
+def _deleted_with_trip(kwargs):
+    """Whole-trip deletes drop the budget too, so there is nothing to adjust"""
+    return isinstance(kwargs.get('origin'), Trip)
+
+@receiver(pre_save, sender=Activity)
+def remember_activity_cost(sender, instance, **kwargs):
+    """Remember the stored cost so post_save only applies the difference"""
+    instance._budget_previous = _stored_values(instance, 'cost', 'stop_id')
+
 @receiver(post_save, sender=Activity)
 def update_trip_budget_on_activity_save(sender, instance, **kwargs):
-    """Update trip budget when activity cost changes"""
-    if instance.cost and instance.stop.trip.auto_calculate_budget:
-        budget = instance.stop.trip.budget
-        # Recalculate activity costs for the trip
-        total_activity_cost = sum(
-            activity.cost or 0 
-            for stop in instance.stop.trip.stops.all() 
-            for activity in stop.activities.all()
-            if activity.cost
-        )
-        budget.activity_cost = total_activity_cost
-        budget.save()
+    """Update trip budget and totals when activity cost changes"""
+    previous = getattr(instance, '_budget_previous', None)
+    old_cost = as_amount(previous['cost']) if previous else as_amount(None)
+    added = 0 if previous else 1
+
+    if previous and previous['stop_id'] != instance.stop_id:
+        # Activity moved to another stop, possibly of another trip
+        apply_activity_cost_delta(previous['stop_id'], -old_cost, count=-1)
+        old_cost = as_amount(None)
+        added = 1
+
+    apply_activity_cost_delta(instance.stop_id, as_amount(instance.cost) - old_cost, count=added)
 
 @receiver(post_delete, sender=Activity)
 def update_trip_budget_on_activity_delete(sender, instance, **kwargs):
-    """Update trip budget when activity is deleted"""
-    if instance.cost and instance.stop.trip.auto_calculate_budget:
-        budget = instance.stop.trip.budget
-        # Recalculate activity costs for the trip
-        total_activity_cost = sum(
-            activity.cost or 0 
-            for stop in instance.stop.trip.stops.all() 
-            for activity in stop.activities.all()
-            if activity.cost and activity.id != instance.id
-        )
-        budget.activity_cost = total_activity_cost
-        budget.save()
+    """Update trip budget and totals when activity is deleted"""
+    if not _deleted_with_trip(kwargs):
+        apply_activity_cost_delta(instance.stop_id, -as_amount(instance.cost), count=-1)
+
+@receiver(pre_save, sender=Stop)
+def remember_accommodation_cost(sender, instance, **kwargs):
+    """Remember the stored accommodation cost so post_save only applies the difference"""
+    instance._budget_previous = _stored_values(
+        instance, 'accommodation_cost', 'trip_id', 'activities_count', 'activities_cost'
+    )
 
 @receiver(post_save, sender=Stop)
 def update_trip_budget_on_stop_save(sender, instance, **kwargs):
-    """Update trip budget when accommodation cost changes"""
-    if instance.accommodation_cost and instance.trip.auto_calculate_budget:
-        budget = instance.trip.budget
-        # Recalculate accommodation costs for the trip
-        total_stay_cost = sum(
-            stop.accommodation_cost or 0 
-            for stop in instance.trip.stops.all()
-            if stop.accommodation_cost
-        )
-        budget.stay_cost = total_stay_cost
-        budget.save()
+    """Update trip budget and totals when accommodation cost changes"""
+    previous = getattr(instance, '_budget_previous', None)
+    old_cost = as_amount(previous['accommodation_cost']) if previous else as_amount(None)
+    moved = {}
+
+    if not previous:
+        moved = {'stops_count': 1}
+    elif previous['trip_id'] != instance.trip_id:
+        # The stop takes its activities along to the other trip
+        moved = {
+            'stops_count': 1,
+            'activities_count': previous['activities_count'],
+            'activities_cost': previous['activities_cost'],
+        }
+        apply_stay_cost_delta(previous['trip_id'], -old_cost, **{field: -amount for field, amount in moved.items()})
+        old_cost = as_amount(None)
+
+    apply_stay_cost_delta(instance.trip_id, as_amount(instance.accommodation_cost) - old_cost, **moved)
 
 @receiver(post_delete, sender=Stop)
 def update_trip_budget_on_stop_delete(sender, instance, **kwargs):
-    """Update trip budget when stop is deleted"""
-    if instance.accommodation_cost and instance.trip.auto_calculate_budget:
-        budget = instance.trip.budget
-        # Recalculate accommodation costs for the trip
-        total_stay_cost = sum(
-            stop.accommodation_cost or 0 
-            for stop in instance.trip.stops.all()
-            if stop.accommodation_cost and stop.id != instance.id
-        )
-        budget.stay_cost = total_stay_cost
-        budget.save()
+    """Update trip budget and totals when stop is deleted
+
+    Its activities were deleted first and already taken off the trip's totals.
+    """
+    if not _deleted_with_trip(kwargs):
+        apply_stay_cost_delta(instance.trip_id, -as_amount(instance.accommodation_cost), stops_count=-1)
+
+# Cache invalidation: anything that is part of a trip graph bumps the trip's version
+def _trip_scopes(trip_id):
+    return [trip_scope(trip_id)] if trip_id else []
+
+def _activity_trip_scopes(activity):
+    if Activity.stop.is_cached(activity):
+        return _trip_scopes(activity.stop.trip_id)
+    return _trip_scopes(Stop.objects.filter(pk=activity.stop_id).values_list('trip_id', flat=True).first())
+
+version_on_change(trip_cache, Trip, lambda trip: _trip_scopes(trip.pk))
+version_on_change(trip_cache, Stop, lambda stop: _trip_scopes(stop.trip_id), cascade_from=(Trip,))
+version_on_change(trip_cache, Activity, _activity_trip_scopes, cascade_from=(Trip, Stop))
+version_on_change(trip_cache, Budget, lambda budget: _trip_scopes(budget.trip_id), cascade_from=(Trip,))
+version_on_change(trip_cache, SharedItinerary, lambda shared: _trip_scopes(shared.trip_id), cascade_from=(Trip,))
+
+version_on_change(search_cache, City, lambda city: ['cities'])
+version_on_change(search_cache, ActivityCatalog, lambda activity: ['activities'])
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def journal_city_change(sender, instance, **kwargs):
+    """Feed committed City writes to the in-memory city indexes"""
+    transaction.on_commit(partial(record_city_change, instance.pk))
+
+@receiver(post_save, sender=ActivityCatalog)
+def refresh_activity_search_vector(sender, instance, **kwargs):
+    """Keep the weighted full-text document of a catalog activity current"""
+    update_search_vectors(ActivityCatalog.objects.filter(pk=instance.pk))
@@ -0,0 +1,65 @@
+import hashlib
+import json
+from functools import partial
+
+from ninja.responses import NinjaJSONEncoder
+
+from .models import SharedItinerary
+from .loaders import load_trip_graph
+from .schemas import TripSchema
+from .cache import trip_cache, public_cache, trip_scope
+
+
+def _last_modified(trip):
+    """Latest update time across the trip graph"""
+    timestamps = [trip.updated_at]
+    budget = getattr(trip, 'budget', None)
+    if budget:
+        timestamps.append(budget.updated_at)
+    for stop in trip.stops.all():
+        timestamps.append(stop.updated_at)
+        timestamps.extend(activity.updated_at for activity in stop.activities.all())
+    return max(timestamps)
+
+
+def build_public_snapshot(slug):
+    """Serialize a shared trip once into the JSON body served by /public/{slug}"""
+    from .api import get_trip_with_relations
+
+    shared = SharedItinerary.objects.select_related('trip').filter(public_slug=slug).first()
+    if shared is None or not shared.trip.is_public:
+        return {'available': False}
+
+    trip = load_trip_graph(shared.trip)
+    body = json.dumps(
+        TripSchema.model_validate(get_trip_with_relations(trip)).model_dump(),
+        cls=NinjaJSONEncoder
+    )
+    return {
+        'available': True,
+        'shared_id': shared.id,
+        'expires_at': shared.expires_at,
+        'body': body,
+        'etag': f'"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"',
+        'last_modified': int(_last_modified(trip).timestamp())
+    }
+
+
+def get_public_snapshot(slug):
+    """Snapshot for a public slug, rebuilt only after the trip graph changes
+
+    The slug to trip mapping and the snapshot itself both live in the cache, so
+    a warm hit runs no queries. Snapshots are stored under the trip's cache
+    version, which every write to the trip, its stops or activities bumps.
+    Returns None for unknown slugs.
+    """
+    mapping_key = public_cache.key('slug', slug)
+    trip_id = public_cache.cache.get(mapping_key) if public_cache.enabled else None
+    if trip_id is None:
+        trip_id = SharedItinerary.objects.filter(public_slug=slug).values_list('trip_id', flat=True).first()
+        if trip_id is None:
+            return None
+        if public_cache.enabled:
+            public_cache.cache.set(mapping_key, trip_id, public_cache.timeout)
+
+    return trip_cache.get_or_set(trip_scope(trip_id), ('public', slug), partial(build_public_snapshot, slug))
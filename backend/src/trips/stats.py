@@ -0,0 +1,89 @@
+"""
+Cost statistics for /trips/{trip_id}/stats.
+
+A trip's costs are broken down by budget category, by stop and by day from
+the budget row and one query over the trip's stops, which carry their
+accommodation and activity totals (see trips.totals). Activities have no
+date of their own, so a stop's costs are spread evenly over its days; the
+trip-wide categories (transport, meals, shopping, miscellaneous) are spread
+over the whole trip. Reports are cached per trip version.
+"""
+
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from .cache import trip_cache, trip_scope
+from .models import Trip, Stop
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+# Budget categories not tied to a stop
+TRIP_WIDE_CATEGORIES = ('transport', 'meal', 'shopping', 'miscellaneous')
+
+
+def _days(start, end):
+    """Every date from start to end inclusive; a single day if end precedes start"""
+    return [start + timedelta(days=offset) for offset in range(max((end - start).days, 0) + 1)]
+
+
+def _spread(cost_by_day, days, amount):
+    share = amount / len(days)
+    for day in days:
+        cost_by_day[day] = cost_by_day.get(day, ZERO) + share
+
+
+def compute_trip_stats(trip):
+    """TripStatsSchema payload of a trip with its budget, or None if it has no budget"""
+    budget = getattr(trip, 'budget', None)
+    if budget is None:
+        return None
+
+    cost_by_category = {
+        'transport': budget.transport_cost,
+        'stay': budget.stay_cost,
+        'activity': budget.activity_cost,
+        'meal': budget.meal_cost,
+        'shopping': budget.shopping_cost,
+        'miscellaneous': budget.miscellaneous_cost,
+    }
+
+    trip_days = _days(trip.start_date, trip.end_date)
+    cost_by_day = dict.fromkeys(trip_days, ZERO)
+    _spread(cost_by_day, trip_days, sum(cost_by_category[category] for category in TRIP_WIDE_CATEGORIES))
+
+    cost_by_stop = {}
+    stops = Stop.objects.filter(trip=trip).values_list(
+        'city_name', 'country', 'start_date', 'end_date', 'accommodation_cost', 'activities_cost'
+    )
+    for city_name, country, start_date, end_date, accommodation_cost, activities_cost in stops:
+        stop_cost = (accommodation_cost or ZERO) + activities_cost
+        label = f"{city_name}, {country}"
+        cost_by_stop[label] = cost_by_stop.get(label, ZERO) + stop_cost
+        if stop_cost:
+            _spread(cost_by_day, _days(start_date, end_date), stop_cost)
+
+    cost_by_day = {day: cost.quantize(CENT, rounding=ROUND_HALF_UP) for day, cost in cost_by_day.items()}
+    # Earliest of the most expensive days
+    most_expensive_day = max(sorted(cost_by_day), key=cost_by_day.get) if any(cost_by_day.values()) else None
+
+    total_cost = budget.total_cost
+    total_limit = budget.total_limit
+    return {
+        "total_cost": total_cost,
+        "cost_by_category": cost_by_category,
+        "cost_by_stop": cost_by_stop,
+        "cost_by_day": {day.isoformat(): cost for day, cost in sorted(cost_by_day.items())},
+        "daily_average": (total_cost / len(trip_days)).quantize(CENT, rounding=ROUND_HALF_UP),
+        "most_expensive_day": most_expensive_day,
+        "budget_utilization": float(total_cost / total_limit * 100) if total_limit else 0.0,
+    }
+
+
+def cached_trip_stats(trip_id):
+    """compute_trip_stats() of a trip, cached until the trip or anything in it changes"""
+    def build():
+        trip = Trip.objects.select_related('budget').get(pk=trip_id)
+        return compute_trip_stats(trip)
+
+    return trip_cache.get_or_set(trip_scope(trip_id), ('stats',), build)
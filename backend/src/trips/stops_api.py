@@ -1,13 +1,20 @@
 from ninja import Router
 from ninja_jwt.authentication import JWTAuth
 from django.shortcuts import get_object_or_404
-from django.db.models import Count
+from django.db import transaction
+from django.utils import timezone
 from typing import List
-from .models import Trip, Stop, Activity
+from .models import Trip, Stop, Activity, City
+from .budgeting import deferred_budget_updates
+from .cache import invalidate_trip
+from .conflicts import STOP_FIELDS as CONFLICT_STOP_FIELDS, new_stop_conflicts
+from .bulk import BULK_CREATE_BATCH_SIZE, collect_row_errors, bulk_error_response
+from .routing import optimize_route, path_length, stop_distances
+from .catalog_search import nearby_activities, nearby_params_error
 from .schemas import (
     StopSchema, StopCreateSchema, StopUpdateSchema,
     ActivitySchema, ActivityCreateSchema, ActivityUpdateSchema,
-    BulkStopCreateSchema
+    BulkStopCreateSchema, BulkErrorResponseSchema, StopOrderSchema, StopRouteSchema
 )
 from authentication.schemas import MessageResponseSchema
 
@@ -18,7 +25,7 @@ stops_router = Router(tags=["Trip Stops"])
 def list_stops(request, trip_id: str):
     """List all stops in a trip"""
     trip = get_object_or_404(Trip, id=trip_id, user=request.user)
-    stops = trip.stops.all().annotate(activities_count=Count('activities'))
+    stops = trip.stops.all()
     
     result = []
     for stop in stops:
@@ -38,6 +45,7 @@ def list_stops(request, trip_id: str):
             'accommodation_cost': stop.accommodation_cost,
             'activities': list(stop.activities.all()),
             'activities_count': stop.activities_count,
+            'activities_cost': stop.activities_cost,
             'duration_days': (stop.end_date - stop.start_date).days + 1,
             'created_at': stop.created_at,
             'updated_at': stop.updated_at
@@ -47,6 +55,7 @@ def list_stops(request, trip_id: str):
     return result
 
 @stops_router.post("/trips/{trip_id}/stops", response=StopSchema, auth=JWTAuth())
+@transaction.atomic
 def create_stop(request, trip_id: str, payload: StopCreateSchema):
     """Create a new stop in a trip"""
     trip = get_object_or_404(Trip, id=trip_id, user=request.user)
@@ -65,6 +74,7 @@ def get_stop(request, stop_id: str):
     return get_stop_with_activities(stop)
 
 @stops_router.put("/stops/{stop_id}", response=StopSchema, auth=JWTAuth())
+@transaction.atomic
 def update_stop(request, stop_id: str, payload: StopUpdateSchema):
     """Update stop details"""
     stop = get_object_or_404(Stop, id=stop_id, trip__user=request.user)
@@ -82,46 +92,131 @@ def delete_stop(request, stop_id: str):
     stop.delete()
     return {"message": "Stop deleted successfully", "success": True}
 
+@stops_router.get("/stops/{stop_id}/nearby-activities", response={200: list, 400: MessageResponseSchema}, auth=JWTAuth())
+def get_nearby_activities(request, stop_id: str, radius_km: float = 5, category: str = "", limit: int = 20):
+    """Catalog activities near a stop, e.g. things to do near the hotel"""
+    stop = get_object_or_404(Stop, id=stop_id, trip__user=request.user)
+    
+    location = (stop.latitude, stop.longitude)
+    if None in location:
+        # Fall back to the coordinates of the stop's city
+        location = City.objects.filter(
+            name__iexact=stop.city_name, country__iexact=stop.country
+        ).values_list('latitude', 'longitude').first() or (None, None)
+    if None in location:
+        return 400, {"message": "Stop has no coordinates", "success": False}
+    
+    latitude, longitude = map(float, location)
+    error = nearby_params_error(latitude, longitude, radius_km)
+    if error:
+        return 400, {"message": error, "success": False}
+    
+    return nearby_activities(latitude, longitude, radius_km, category=category, limit=limit)
+
 # Bulk operations for stops
-@stops_router.post("/trips/{trip_id}/stops/bulk", response=List[StopSchema], auth=JWTAuth())
+@stops_router.post("/trips/{trip_id}/stops/bulk", response={200: List[StopSchema], 400: BulkErrorResponseSchema}, auth=JWTAuth())
 def bulk_create_stops(request, trip_id: str, payload: BulkStopCreateSchema):
-    """Create multiple stops at once"""
+    """Create multiple stops at once (all or nothing)"""
     trip = get_object_or_404(Trip, id=trip_id, user=request.user)
     
-    created_stops = []
-    for stop_data in payload.stops:
-        stop = Stop.objects.create(
-            trip=trip,
-            **stop_data.dict()
-        )
-        created_stops.append(get_stop_with_activities(stop))
+    stops = [Stop(trip=trip, **stop_data.dict()) for stop_data in payload.stops]
+    row_errors = collect_row_errors(stops, exclude=['trip'])
+    if not row_errors and payload.check_conflicts:
+        row_errors = new_stop_conflicts(trip.id, [
+            {field: getattr(stop, field) for field in CONFLICT_STOP_FIELDS} for stop in stops
+        ])
+    if row_errors:
+        return 400, bulk_error_response(row_errors)
     
-    return created_stops
+    # bulk_create skips signals, so the budget is recomputed once on exit
+    with deferred_budget_updates() as pending:
+        Stop.objects.bulk_create(stops, batch_size=BULK_CREATE_BATCH_SIZE)
+        pending.add_trip(trip.id)
+    
+    # New stops have no activities yet
+    return [get_stop_with_activities(stop, activities=[]) for stop in stops]
 
 # Reorder stops
-@stops_router.post("/trips/{trip_id}/stops/reorder", response=List[StopSchema], auth=JWTAuth())
-def reorder_stops(request, trip_id: str, stop_orders: List[dict]):
-    """Reorder stops in a trip"""
+@stops_router.post("/trips/{trip_id}/stops/reorder", response={200: List[StopSchema], 400: MessageResponseSchema}, auth=JWTAuth())
+def reorder_stops(request, trip_id: str, stop_orders: List[StopOrderSchema]):
+    """Reorder stops in a trip with a single UPDATE"""
     trip = get_object_or_404(Trip, id=trip_id, user=request.user)
     
-    # Update order_index for each stop
-    for order_data in stop_orders:
-        stop_id = order_data.get('stop_id')
-        new_order = order_data.get('order_index')
+    requested_ids = [order.stop_id for order in stop_orders]
+    if len(set(requested_ids)) != len(requested_ids):
+        return 400, {"message": "Each stop can only appear once", "success": False}
+    
+    with transaction.atomic():
+        # Lock the trip's full stop set; activities come from one prefetch
+        stops = {
+            stop.id: stop
+            for stop in trip.stops.select_for_update().prefetch_related('activities')
+        }
+        
+        unknown_ids = set(requested_ids) - stops.keys()
+        if unknown_ids:
+            return 400, {"message": f"Stops not found in this trip: {', '.join(sorted(map(str, unknown_ids)))}", "success": False}
+        
+        now = timezone.now()
+        changed = []
+        for order in stop_orders:
+            stop = stops[order.stop_id]
+            if stop.order_index != order.order_index:
+                stop.order_index = order.order_index
+                stop.updated_at = now
+                changed.append(stop)
+        
+        if changed:
+            Stop.objects.bulk_update(changed, ['order_index', 'updated_at'])
+            invalidate_trip(trip.id)
+    
+    # Return updated stops list in the model's ordering
+    ordered = sorted(stops.values(), key=lambda stop: (stop.order_index, stop.start_date))
+    return [get_stop_with_activities(stop) for stop in ordered]
+
+# Route optimization
+@stops_router.post("/trips/{trip_id}/stops/optimize", response=StopRouteSchema, auth=JWTAuth())
+def optimize_stops(request, trip_id: str, apply: bool = False):
+    """Suggest a shorter visiting order for the trip's stops, saving it with a single UPDATE when apply is set"""
+    trip = get_object_or_404(Trip.objects.only('id'), id=trip_id, user=request.user)
+    
+    with transaction.atomic():
+        stops = trip.stops.order_by('order_index', 'start_date', 'id')
+        if apply:
+            stops = stops.select_for_update()
+        stops = list(stops.only('id', 'order_index', 'start_date', 'end_date', 'latitude', 'longitude'))
         
-        if stop_id and new_order is not None:
-            Stop.objects.filter(
-                id=stop_id, 
-                trip=trip
-            ).update(order_index=new_order)
-    
-    # Return updated stops list
-    stops = trip.stops.all().order_by('order_index')
-    return [get_stop_with_activities(stop) for stop in stops]
+        rows = [
+            {'latitude': stop.latitude, 'longitude': stop.longitude, 'start_date': stop.start_date, 'end_date': stop.end_date}
+            for stop in stops
+        ]
+        route, distance_km = optimize_route(rows)
+        original_distance_km = path_length(stop_distances(rows), list(range(len(rows)))) if rows else 0.0
+        
+        if apply:
+            now = timezone.now()
+            changed = []
+            for order_index, position in enumerate(route):
+                stop = stops[position]
+                if stop.order_index != order_index:
+                    stop.order_index = order_index
+                    stop.updated_at = now
+                    changed.append(stop)
+            if changed:
+                Stop.objects.bulk_update(changed, ['order_index', 'updated_at'])
+                invalidate_trip(trip.id)
+    
+    return {
+        "order": [{"stop_id": stops[position].id, "order_index": order_index} for order_index, position in enumerate(route)],
+        "distance_km": round(distance_km, 3),
+        "original_distance_km": round(original_distance_km, 3),
+        "applied": apply
+    }
 
-def get_stop_with_activities(stop):
+def get_stop_with_activities(stop, activities=None):
     """Helper function to serialize stop with activities"""
-    activities = list(stop.activities.all())
+    if activities is None:
+        activities = list(stop.activities.all())
     
     return {
         'id': stop.id,
@@ -139,6 +234,7 @@ def get_stop_with_activities(stop):
         'accommodation_cost': stop.accommodation_cost,
         'activities': activities,
         'activities_count': len(activities),
+        'activities_cost': stop.activities_cost,
         'duration_days': (stop.end_date - stop.start_date).days + 1,
         'created_at': stop.created_at,
         'updated_at': stop.updated_at
@@ -1,3 +1,1428 @@
-from django.test import TestCase
+import json
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from ninja_jwt.tokens import AccessToken
+
+from .models import Trip, Stop, Activity, Budget, SharedItinerary, City, ActivityCatalog
+from .loaders import trip_graph_queryset
+from .budgeting import deferred_budget_updates
+from .counters import (
+    record_shared_view, flush_shared_counters, flush_local_counters, _local_counts, _add, _counter_key, _flush_lock
+)
+from .geo import encode_geohash, haversine_km
+from .routing import optimize_route, path_length, stop_distances
+from .search import CityEntry, CityIndex, city_index, _journal_key
+from .cache import trip_cache, search_cache, trip_scope, invalidate_trip
+from globetrotter.cache import CacheNamespace
+from .api import get_trip_with_relations
+
+User = get_user_model()
+
+
+class TripTestMixin:
+    """Shared fixtures for trip endpoint tests"""
+
+    def setUp(self):
+        cache.clear()
+        _local_counts.clear()
+        self.user = User.objects.create_user(
+            email='traveler@example.com', first_name='Test', last_name='Traveler', password='secret123'
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.trip = Trip.objects.create(
+            user=self.user, name='Grand Tour',
+            start_date=date(2025, 6, 1), end_date=date(2025, 6, 30)
+        )
+
+    def add_stops(self, count, activities_per_stop=2, trip=None):
+        trip = trip or self.trip
+        stops = []
+        for i in range(count):
+            stop = Stop.objects.create(
+                trip=trip, city_name=f'City {i}', country='Italy',
+                start_date=trip.start_date + timedelta(days=i),
+                end_date=trip.start_date + timedelta(days=i),
+                order_index=i, accommodation_cost=Decimal('100.00')
+            )
+            for j in range(activities_per_stop):
+                Activity.objects.create(stop=stop, name=f'Activity {i}-{j}', cost=Decimal('10.00'))
+            stops.append(stop)
+        return stops
+
+
+class TripGraphLoaderTests(TripTestMixin, TestCase):
+
+    def test_loader_uses_fixed_number_of_queries(self):
+        self.add_stops(5)
+
+        with self.assertNumQueries(3):
+            trip = trip_graph_queryset().get(id=self.trip.id)
+            data = get_trip_with_relations(trip)
+
+        self.assertEqual(data['stops_count'], 5)
+        self.assertEqual(data['activities_count'], 10)
+        self.assertEqual(len(data['stops'][0]['activities']), 2)
+
+    def test_trip_detail_query_count_does_not_grow_with_stops(self):
+        self.add_stops(1)
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(f'/api/trips/{self.trip.id}', **self.auth)
+        self.assertEqual(response.status_code, 200)
+
+        self.add_stops(30)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(f'/api/trips/{self.trip.id}', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stops_count'], 31)
+        self.assertEqual(len(large), len(small))
+
+    def test_public_trip_query_count_does_not_grow_with_stops(self):
+        self.trip.is_public = True
+        self.trip.save()
+        shared = SharedItinerary.objects.create(trip=self.trip)
+        url = f'/api/public/{shared.public_slug}'
+        self.client.get(url)
+
+        # Each write invalidates the cached snapshot, so both requests rebuild it
+        self.add_stops(1)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.add_stops(20)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['activities_count'], 42)
+        self.assertEqual(len(large), len(small))
+
+    def test_create_trip_returns_full_graph(self):
+        response = self.client.post(
+            '/api/trips',
+            data={'name': 'Weekend', 'start_date': '2025-07-01', 'end_date': '2025-07-03'},
+            content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['stops'], [])
+        self.assertIsNotNone(body['budget'])
+        self.assertEqual(body['duration_days'], 3)
+
+
+class BudgetLedgerTests(TripTestMixin, TestCase):
+
+    def budget(self):
+        return Budget.objects.get(trip=self.trip)
+
+    def test_activity_writes_apply_cost_deltas(self):
+        stop = self.add_stops(1, activities_per_stop=0)[0]
+        activity = Activity.objects.create(stop=stop, name='Museum', cost=Decimal('25.50'))
+        self.assertEqual(self.budget().activity_cost, Decimal('25.50'))
+
+        activity.cost = Decimal('10.00')
+        activity.save()
+        self.assertEqual(self.budget().activity_cost, Decimal('10.00'))
+
+        activity.cost = None
+        activity.save()
+        self.assertEqual(self.budget().activity_cost, Decimal('0.00'))
+
+        activity.cost = Decimal('40.00')
+        activity.save()
+        activity.delete()
+        self.assertEqual(self.budget().activity_cost, Decimal('0.00'))
+
+    def test_activity_save_cost_is_independent_of_trip_size(self):
+        stop = self.add_stops(1, activities_per_stop=0)[0]
+        with CaptureQueriesContext(connection) as small:
+            Activity.objects.create(stop=stop, name='First', cost=Decimal('5.00'))
+
+        self.add_stops(10)
+        with CaptureQueriesContext(connection) as large:
+            Activity.objects.create(stop=stop, name='Second', cost=Decimal('5.00'))
+        self.assertEqual(len(large), len(small))
+
+    def test_stop_writes_apply_stay_cost_deltas(self):
+        stops = self.add_stops(2, activities_per_stop=1)
+        self.assertEqual(self.budget().stay_cost, Decimal('200.00'))
+        self.assertEqual(self.budget().activity_cost, Decimal('20.00'))
+
+        stops[0].accommodation_cost = Decimal('150.00')
+        stops[0].save()
+        self.assertEqual(self.budget().stay_cost, Decimal('250.00'))
+
+        stops[1].delete()
+        budget = self.budget()
+        self.assertEqual(budget.stay_cost, Decimal('150.00'))
+        self.assertEqual(budget.activity_cost, Decimal('10.00'))
+
+    def test_manual_budgets_are_left_alone(self):
+        self.trip.auto_calculate_budget = False
+        self.trip.save()
+        self.add_stops(1)
+        self.assertEqual(self.budget().activity_cost, Decimal('0.00'))
+        self.assertEqual(self.budget().stay_cost, Decimal('0.00'))
+
+    def test_reconcile_command_fixes_drift(self):
+        self.add_stops(3)
+        Budget.objects.filter(trip=self.trip).update(activity_cost=Decimal('1.00'), stay_cost=Decimal('2.00'))
+
+        out = StringIO()
+        call_command('reconcile_budgets', '--dry-run', stdout=out)
+        self.assertIn('1 budget(s) out of sync', out.getvalue())
+        self.assertEqual(self.budget().activity_cost, Decimal('1.00'))
+
+        call_command('reconcile_budgets', stdout=StringIO())
+        budget = self.budget()
+        self.assertEqual(budget.activity_cost, Decimal('60.00'))
+        self.assertEqual(budget.stay_cost, Decimal('300.00'))
+
+
+class DeferredBudgetTests(TripTestMixin, TestCase):
+
+    def budget_updates(self, queries):
+        return [q for q in queries if q['sql'].startswith('UPDATE "budgets"')]
+
+    def test_block_recomputes_budget_once_on_exit(self):
+        with CaptureQueriesContext(connection) as ctx:
+            with deferred_budget_updates():
+                self.add_stops(5, activities_per_stop=3)
+                self.assertEqual(Budget.objects.get(trip=self.trip).activity_cost, Decimal('0.00'))
+
+        self.assertEqual(len(self.budget_updates(ctx.captured_queries)), 1)
+        budget = Budget.objects.get(trip=self.trip)
+        self.assertEqual(budget.activity_cost, Decimal('150.00'))
+        self.assertEqual(budget.stay_cost, Decimal('500.00'))
+
+    def test_block_that_raises_is_rolled_back(self):
+        with self.assertRaises(RuntimeError):
+            with deferred_budget_updates() as pending:
+                self.add_stops(2)
+                pending.add_trip(self.trip.id)
+                raise RuntimeError('import failed')
+        # The stops went away with the deltas they skipped
+        self.assertEqual(self.trip.stops.count(), 0)
+        self.assertEqual(Budget.objects.get(trip=self.trip).stay_cost, Decimal('0.00'))
+        with CaptureQueriesContext(connection) as ctx:
+            with deferred_budget_updates():
+                pass
+        self.assertEqual(self.budget_updates(ctx.captured_queries), [])
+
+    def test_bulk_activity_endpoint_updates_budget_once(self):
+        stop = self.add_stops(1, activities_per_stop=0)[0]
+        payload = {'activities': [{'name': f'Tour {i}', 'cost': '12.00'} for i in range(20)]}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                f'/api/stops/{stop.id}/activities/bulk', data=payload,
+                content_type='application/json', **self.auth
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.budget_updates(ctx.captured_queries)), 1)
+        self.assertEqual(Budget.objects.get(trip=self.trip).activity_cost, Decimal('240.00'))
+
+
+class BulkCreateTests(TripTestMixin, TestCase):
+
+    def stop_payload(self, count):
+        return {'stops': [
+            {'city_name': f'City {i}', 'country': 'Spain', 'start_date': '2025-06-01',
+             'end_date': '2025-06-02', 'order_index': i, 'accommodation_cost': '50.00'}
+            for i in range(count)
+        ]}
+
+    def test_bulk_stops_use_batched_inserts(self):
+        url = f'/api/trips/{self.trip.id}/stops/bulk'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, data=self.stop_payload(1200), content_type='application/json', **self.auth)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1200)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "stops"')]
+        # SQLite caps rows per INSERT by its variable limit, PostgreSQL uses the batch size
+        self.assertLess(len(inserts), 50)
+        # Fixed overhead, including the two UPDATEs recomputing stop and trip totals
+        self.assertLessEqual(len(ctx.captured_queries) - len(inserts), 8)
+        self.assertEqual(Budget.objects.get(trip=self.trip).stay_cost, Decimal('60000.00'))
+        self.trip.refresh_from_db()
+        self.assertEqual((self.trip.stops_count, self.trip.accommodation_cost), (1200, Decimal('60000.00')))
+
+    def test_bulk_stops_are_all_or_nothing(self):
+        payload = self.stop_payload(3)
+        payload['stops'][1]['end_date'] = '2025-05-01'
+        response = self.client.post(
+            f'/api/trips/{self.trip.id}/stops/bulk', data=payload, content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['index'], 1)
+        self.assertFalse(self.trip.stops.exists())
+
+    def test_bulk_activities_reject_invalid_rows(self):
+        stop = self.add_stops(1, activities_per_stop=0)[0]
+        payload = {'activities': [{'name': 'Ok'}, {'name': 'Bad', 'category': 'unknown'}]}
+        response = self.client.post(
+            f'/api/stops/{stop.id}/activities/bulk', data=payload, content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('category', response.json()['errors'][0]['errors'])
+        self.assertFalse(stop.activities.exists())
+
+
+class ReorderStopsTests(TripTestMixin, TestCase):
+
+    def reorder(self, orders):
+        return self.client.post(
+            f'/api/trips/{self.trip.id}/stops/reorder', data=orders,
+            content_type='application/json', **self.auth
+        )
+
+    def test_reorder_uses_single_update(self):
+        stops = self.add_stops(12)
+        orders = [{'stop_id': str(stop.id), 'order_index': 11 - i} for i, stop in enumerate(stops)]
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.reorder(orders)
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([stop['id'] for stop in body], [str(stop.id) for stop in reversed(stops)])
+        self.assertEqual(len(body[0]['activities']), 2)
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "stops"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(self.trip.stops.values_list('id', flat=True)), [stop.id for stop in reversed(stops)]
+        )
+
+    def test_reorder_rejects_foreign_and_duplicate_stops(self):
+        stop = self.add_stops(1)[0]
+        other_trip = Trip.objects.create(
+            user=self.user, name='Other', start_date=date(2025, 1, 1), end_date=date(2025, 1, 2)
+        )
+        foreign = self.add_stops(1, trip=other_trip)[0]
+
+        response = self.reorder([{'stop_id': str(foreign.id), 'order_index': 3}])
+        self.assertEqual(response.status_code, 400)
+        response = self.reorder([{'stop_id': str(stop.id), 'order_index': 1}] * 2)
+        self.assertEqual(response.status_code, 400)
+
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.order_index, 0)
+
+
+@override_settings(CACHE_SHARED=True, CACHE_TRACK_STATS=True)
+class CacheNamespaceTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.namespace = CacheNamespace('test')
+
+    def test_bump_invalidates_scope_only(self):
+        calls = []
+        build = lambda: calls.append(1) or len(calls)
+
+        self.assertEqual(self.namespace.get_or_set('a', ('x',), build), 1)
+        self.assertEqual(self.namespace.get_or_set('a', ('x',), build), 1)
+        self.assertEqual(self.namespace.get_or_set('b', ('x',), build), 2)
+
+        self.namespace.bump('a')
+        self.assertEqual(self.namespace.get_or_set('a', ('x',), build), 3)
+        self.assertEqual(self.namespace.get_or_set('b', ('x',), build), 2)
+
+        stats = self.namespace.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+
+    def test_long_key_parts_are_hashed(self):
+        key = self.namespace.key('scope', 'a query with spaces' * 10)
+        self.assertLess(len(key), 80)
+        self.assertNotIn(' ', key)
+
+    @override_settings(CACHE_SHARED=False, CACHE_TRACK_STATS=False)
+    def test_shared_only_namespace_is_bypassed_without_a_shared_cache(self):
+        namespace = CacheNamespace('local', shared_only=True)
+        calls = []
+        build = lambda: calls.append(1) or len(calls)
+
+        self.assertEqual(namespace.get_or_set('a', ('x',), build), 1)
+        self.assertEqual(namespace.get_or_set('a', ('x',), build), 2)
+        self.assertIsNone(namespace.get('a', ('x',)))
+        self.assertEqual(self.namespace.get_or_set('a', ('x',), build), 3)
+        self.assertEqual(self.namespace.get_or_set('a', ('x',), build), 3)
+        self.assertEqual(self.namespace.stats()['hits'] + self.namespace.stats()['misses'], 0)
+
+
+@override_settings(CACHE_SHARED=True, CACHE_TRACK_STATS=True)
+class TripCacheTests(TripTestMixin, TestCase):
+
+    def test_trip_detail_is_served_from_cache_until_it_changes(self):
+        stop = self.add_stops(3)[0]
+        url = f'/api/trips/{self.trip.id}'
+        self.assertEqual(self.client.get(url, **self.auth).status_code, 200)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, **self.auth)
+        self.assertEqual(response.json()['activities_count'], 6)
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "activities"' in q['sql']])
+
+        Activity.objects.create(stop=stop, name='Late addition', cost=Decimal('5.00'))
+        body = self.client.get(url, **self.auth).json()
+        self.assertEqual(body['activities_count'], 7)
+        self.assertEqual(Decimal(body['budget']['activity_cost']), Decimal('65.00'))
+
+    def test_reorder_invalidates_cached_trip(self):
+        stops = self.add_stops(2)
+        url = f'/api/trips/{self.trip.id}'
+        self.client.get(url, **self.auth)
+        before = trip_cache.stats()['misses']
+
+        self.client.post(
+            f'{url}/stops/reorder', content_type='application/json', **self.auth,
+            data=[{'stop_id': str(stops[0].id), 'order_index': 5}]
+        )
+        body = self.client.get(url, **self.auth).json()
+        self.assertEqual(trip_cache.stats()['misses'], before + 1)
+        self.assertEqual(body['stops'][-1]['id'], str(stops[0].id))
+
+    def test_invalidation_is_repeated_on_commit(self):
+        scope = trip_scope(self.trip.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_trip(self.trip.id)
+            # A read racing the transaction caches pre-commit data under the new version
+            trip_cache.set(scope, ('detail',), 'stale')
+            self.assertEqual(trip_cache.get(scope, 'detail'), 'stale')
+        self.assertIsNone(trip_cache.get(scope, 'detail'))
+
+
+@override_settings(CACHE_SHARED=True, CACHE_TRACK_STATS=True)
+class PublicSnapshotTests(TripTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.trip.is_public = True
+        self.trip.save()
+        self.shared = SharedItinerary.objects.create(trip=self.trip)
+        self.url = f'/api/public/{self.shared.public_slug}'
+        self.stops = self.add_stops(3)
+
+    def test_warm_hits_run_no_queries(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(ctx.captured_queries, [])
+
+        flush_shared_counters()
+        self.shared.refresh_from_db()
+        self.assertEqual(self.shared.view_count, 2)
+
+    def test_conditional_requests_return_not_modified(self):
+        first = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_snapshot_is_rebuilt_after_trip_changes(self):
+        first = self.client.get(self.url)
+        Activity.objects.create(stop=self.stops[0], name='Gondola ride')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['activities_count'], 7)
+
+        self.trip.is_public = False
+        self.trip.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_unknown_slug_returns_404(self):
+        self.assertEqual(self.client.get('/api/public/missing-slug').status_code, 404)
+
+
+@override_settings(SHARED_COUNTERS_BUFFERED=True, CACHE_SHARED=True)
+class BufferedCounterTests(TripTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.trip.is_public = True
+        self.trip.save()
+        self.shared = SharedItinerary.objects.create(trip=self.trip)
+        self.url = f'/api/public/{self.shared.public_slug}'
+
+    def test_public_reads_do_not_write(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(ctx.captured_queries, [])
+
+        self.shared.refresh_from_db()
+        self.assertEqual(self.shared.view_count, 0)
+
+    def test_flush_writes_buffered_increments_once(self):
+        other = SharedItinerary.objects.create(
+            trip=Trip.objects.create(user=self.user, name='Other', start_date=date(2025, 1, 1), end_date=date(2025, 1, 2))
+        )
+        for _ in range(3):
+            self.client.get(self.url)
+        self.client.post(f'{self.url}/copy')
+        record_shared_view(other.id)
+
+        out = StringIO()
+        call_command('flush_shared_counters', '--batch-size', '1', stdout=out)
+        self.assertIn('Flushed 5', out.getvalue())
+        self.assertEqual(flush_shared_counters(), 0)
+
+        self.shared.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.shared.view_count, self.shared.copy_count), (3, 1))
+        self.assertEqual(other.view_count, 1)
+
+        record_shared_view(self.shared.id)
+        flush_shared_counters()
+        self.shared.refresh_from_db()
+        self.assertEqual(self.shared.view_count, 4)
+
+    def test_overlapping_flushes_write_each_increment_once(self):
+        for _ in range(3):
+            record_shared_view(self.shared.id)
+
+        # A second flush starting while the first one holds the buffer leaves it alone
+        with _flush_lock() as acquired:
+            self.assertTrue(acquired)
+            self.assertEqual(flush_shared_counters(), 0)
+            self.assertEqual(cache.get(_counter_key(self.shared.id, 'view_count')), 3)
+        self.assertEqual(flush_shared_counters(), 3)
+        self.assertEqual(flush_shared_counters(), 0)
+
+        self.assertEqual(cache.get(_counter_key(self.shared.id, 'view_count')), 0)
+        self.shared.refresh_from_db()
+        self.assertEqual(self.shared.view_count, 3)
+
+    def test_flush_only_reads_itineraries_with_increments(self):
+        for index in range(5):
+            SharedItinerary.objects.create(trip=Trip.objects.create(
+                user=self.user, name=f'Idle {index}', start_date=date(2025, 1, 1), end_date=date(2025, 1, 2)
+            ))
+        with self.assertNumQueries(0):
+            self.assertEqual(flush_shared_counters(), 0)
+
+        record_shared_view(self.shared.id)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(flush_shared_counters(), 1)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')])
+
+    def test_increment_survives_eviction_between_add_and_incr(self):
+        class EvictingCache:
+            """add() finds the key, then incr() misses it once"""
+            def __init__(self):
+                self.values, self.evicted = {'key': 5}, False
+
+            def add(self, key, value, timeout=None):
+                if key in self.values:
+                    return False
+                self.values[key] = value
+                return True
+
+            def incr(self, key, delta):
+                if not self.evicted:
+                    self.evicted = True
+                    self.values = {'key': 2}
+                    raise ValueError(key)
+                self.values[key] += delta
+                return self.values[key]
+
+        evicting = EvictingCache()
+        self.assertEqual(_add(evicting, 'key', 1), 3)
+
+
+@override_settings(SHARED_COUNTERS_BUFFERED=False, SHARED_COUNTERS_FLUSH_INTERVAL=0, CACHE_SHARED=True)
+class LocalCounterTests(TripTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.trip.is_public = True
+        self.trip.save()
+        self.shared = SharedItinerary.objects.create(trip=self.trip)
+        self.url = f'/api/public/{self.shared.public_slug}'
+
+    def test_cached_public_read_runs_no_queries(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(ctx.captured_queries, [])
+
+        self.shared.refresh_from_db()
+        self.assertEqual(self.shared.view_count, 0)
+
+    def test_flush_writes_process_buffer(self):
+        for _ in range(2):
+            self.client.get(self.url)
+        self.client.post(f'{self.url}/copy')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(flush_local_counters(), 3)
+        self.assertEqual(sum(q['sql'].startswith('UPDATE') for q in ctx.captured_queries), 1)
+        self.assertEqual(flush_shared_counters(), 0)
+
+        self.shared.refresh_from_db()
+        self.assertEqual((self.shared.view_count, self.shared.copy_count), (2, 1))
+
+
+@override_settings(CITY_INDEX_SYNC_INTERVAL=0)
+class CitySearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        city_index.clear()
+        for name, country, population in [
+            ('Barcelona', 'Spain', 1_600_000), ('Paris', 'France', 2_100_000), ('Parma', 'Italy', 200_000),
+            ('New York', 'United States', 8_300_000), ('Rome', 'Italy', 2_800_000), ('São Paulo', 'Brazil', 12_000_000),
+        ]:
+            City.objects.create(name=name, country=country, country_code='XX', population=population)
+
+    def search(self, query):
+        response = self.client.get('/api/search/cities', {'query': query})
+        self.assertEqual(response.status_code, 200)
+        return [city['name'] for city in response.json()]
+
+    def test_prefix_matches_rank_by_population(self):
+        self.assertEqual(self.search('par')[:2], ['Paris', 'Parma'])
+        self.assertEqual(self.search('york')[0], 'New York')
+
+    def test_typos_and_accents_are_tolerated(self):
+        self.assertEqual(self.search('Barcelna')[0], 'Barcelona')
+        self.assertEqual(self.search('sao paulo')[0], 'São Paulo')
+
+    def test_country_query_returns_its_cities(self):
+        self.assertEqual(self.search('italy'), ['Rome', 'Parma'])
+
+    def test_new_cities_are_found_after_the_index_was_built(self):
+        self.assertEqual(self.search('lisbon'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            City.objects.create(name='Lisbon', country='Portugal', country_code='PT')
+        self.assertEqual(self.search('lisbon'), ['Lisbon'])
+
+    def autocomplete(self, query):
+        response = self.client.get('/api/search/cities/autocomplete', {'query': query})
+        self.assertEqual(response.status_code, 200)
+        return [city['name'] for city in response.json()]
+
+    def test_autocomplete_matches_name_words_and_countries(self):
+        self.assertEqual(self.autocomplete('pa'), ['São Paulo', 'Paris', 'Parma'])
+        self.assertEqual(self.autocomplete('new y'), ['New York'])
+        self.assertEqual(self.autocomplete('ita'), ['Rome', 'Parma'])
+
+    def test_autocomplete_does_not_query_the_database_once_warm(self):
+        self.autocomplete('r')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.autocomplete('ro'), ['Rome'])
+
+    def test_autocomplete_follows_local_writes(self):
+        self.autocomplete('r')
+        with self.captureOnCommitCallbacks(execute=True):
+            City.objects.filter(name='Rome').first().delete()
+            City.objects.create(name='Rotterdam', country='Netherlands', country_code='NL', population=650_000)
+        self.assertEqual(self.autocomplete('ro'), ['Rotterdam'])
+
+    @override_settings(CACHE_SHARED=True)
+    def test_autocomplete_replays_changes_journaled_by_other_processes(self):
+        self.autocomplete('l')
+        with self.captureOnCommitCallbacks(execute=False):
+            lisbon = City.objects.create(name='Lisbon', country='Portugal', country_code='PT')
+        # Another worker journaled the write
+        search_cache.cache.set(_journal_key('sequence'), 1, timeout=None)
+        search_cache.cache.set(_journal_key(1), lisbon.id)
+        self.assertEqual(self.autocomplete('lis'), ['Lisbon'])
+        self.assertEqual(city_index.sequence, 1)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_without_a_shared_cache_other_writes_appear_after_a_rebuild(self):
+        self.autocomplete('l')
+        with self.captureOnCommitCallbacks(execute=False):
+            City.objects.create(name='Lisbon', country='Portugal', country_code='PT')
+        # Written by another process: nothing journals it
+        with override_settings(CITY_INDEX_REBUILD_INTERVAL=3600):
+            self.assertEqual(self.autocomplete('lis'), [])
+        with override_settings(CITY_INDEX_REBUILD_INTERVAL=0):
+            self.assertEqual(self.autocomplete('lis'), ['Lisbon'])
+        self.assertIsNone(search_cache.cache.get(_journal_key('sequence')))
+
+    def test_index_updates_incrementally(self):
+        index = CityIndex()
+        index.load([CityEntry(1, 'Berlin', 'Germany', None, None, '', [], 3_600_000)])
+        index.add(CityEntry(2, 'Bern', 'Switzerland', None, None, '', [], 130_000))
+        self.assertEqual([entry.id for entry in index.search('ber')], [1, 2])
+        self.assertEqual([entry.id for entry in index.autocomplete('b')], [1, 2])
+        index.remove(1)
+        self.assertEqual([entry.id for entry in index.search('ber')], [2])
+        self.assertEqual([entry.id for entry in index.autocomplete('b')], [2])
+
+    def test_benchmark_command_reports_latency(self):
+        out = StringIO()
+        call_command('benchmark_city_search', '--cities', '2000', '--queries', '50', stdout=out)
+        self.assertIn('p95', out.getvalue())
+
+
+class ActivitySearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        catalog = [
+            ('Louvre Museum', 'culture', 'easy', 17, 4.8, 'Paris', 'Home of the Mona Lisa'),
+            ('Seine Dinner Cruise', 'food', 'easy', 95, 4.5, 'Paris', 'Dinner while passing the museum quarter'),
+            ('Catacombs Tour', 'tours', 'moderate', 29, 4.6, 'Paris', 'Underground ossuary'),
+            ('Street Food Walk', 'food', 'easy', 0, None, 'Paris', 'Free tasting walk'),
+            ('Prado Museum', 'culture', 'easy', 15, 4.7, 'Madrid', 'Spanish masters'),
+        ]
+        for name, category, difficulty, cost, rating, city, description in catalog:
+            ActivityCatalog.objects.create(
+                name=name, category=category, difficulty_level=difficulty, average_cost=cost,
+                rating=rating, city_name=city, country='X', description=description, is_verified=True
+            )
+        ActivityCatalog.objects.create(name='Hidden Museum', category='culture', city_name='Paris', country='X')
+
+    def search(self, **params):
+        response = self.client.get('/api/search/activities', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_text_matches_are_ranked_by_field_weight(self):
+        names = [activity['name'] for activity in self.search(query='museum', city='paris')['items']]
+        self.assertEqual(names, ['Louvre Museum', 'Seine Dinner Cruise'])
+
+    def test_facets_ignore_their_own_filter(self):
+        data = self.search(city='Paris', category='food')
+        self.assertEqual({activity['name'] for activity in data['items']}, {'Seine Dinner Cruise', 'Street Food Walk'})
+        self.assertEqual(data['facets']['category'], {'culture': 1, 'food': 2, 'tours': 1})
+        self.assertEqual(data['facets']['difficulty'], {'easy': 2})
+        self.assertEqual(data['facets']['cost'], {'free': 1, '50_to_100': 1})
+
+    def test_cursor_walks_every_result_once(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            data = self.search(**params)
+            seen.extend(activity['name'] for activity in data['items'])
+            cursor = data['next']
+            if not cursor:
+                break
+        self.assertEqual(seen, [
+            'Louvre Museum', 'Prado Museum', 'Catacombs Tour', 'Seine Dinner Cruise', 'Street Food Walk'
+        ])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/search/activities', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_city_matches_part_of_the_name(self):
+        ActivityCatalog.objects.create(name='High Line', category='nature', city_name='New York', country='US', is_verified=True)
+        self.assertEqual([activity['name'] for activity in self.search(city='york')['items']], ['High Line'])
+
+    def test_facets_count_every_match(self):
+        for index in range(30):
+            ActivityCatalog.objects.create(name=f'Gallery {index}', category='culture', city_name='Rome', country='X', is_verified=True)
+        self.assertEqual(self.search(category='culture')['facets']['category']['culture'], 32)
+
+
+class NearbyActivityTests(TripTestMixin, TestCase):
+
+    def add_activity(self, name, latitude, longitude, **fields):
+        return ActivityCatalog.objects.create(
+            name=name, category=fields.pop('category', 'sightseeing'), city_name='Paris', country='France',
+            latitude=latitude, longitude=longitude, is_verified=True, **fields
+        )
+
+    def test_geohash_matches_reference_value(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(self.add_activity('Eiffel Tower', '48.858400', '2.294500').geohash, 'u09tunquc')
+
+    def test_results_are_within_radius_and_nearest_first(self):
+        self.add_activity('Eiffel Tower', '48.858400', '2.294500')
+        self.add_activity('Louvre', '48.860600', '2.337600')
+        self.add_activity('Versailles', '48.804900', '2.120400')
+
+        response = self.client.get('/api/search/activities/nearby', {'lat': 48.853, 'lng': 2.3499, 'radius_km': 5})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([activity['name'] for activity in results], ['Louvre', 'Eiffel Tower'])
+        self.assertLess(results[0]['distance_km'], results[1]['distance_km'])
+
+    def test_matches_brute_force_search(self):
+        import random
+        rng = random.Random(7)
+        points = [(rng.uniform(48.6, 49.1), rng.uniform(2.0, 2.7)) for _ in range(300)]
+        for index, (latitude, longitude) in enumerate(points):
+            self.add_activity(f'Spot {index}', f'{latitude:.6f}', f'{longitude:.6f}')
+
+        center, radius = (48.85, 2.35), 7.5
+        distances = haversine_km(*center, [round(p[0], 6) for p in points], [round(p[1], 6) for p in points])
+        expected = {f'Spot {index}' for index, distance in enumerate(distances) if distance <= radius}
+
+        response = self.client.get('/api/search/activities/nearby', {
+            'lat': center[0], 'lng': center[1], 'radius_km': radius, 'limit': 100
+        })
+        self.assertEqual({activity['name'] for activity in response.json()}, expected)
+
+    def test_invalid_radius_is_rejected(self):
+        response = self.client.get('/api/search/activities/nearby', {'lat': 48.85, 'lng': 2.35, 'radius_km': 500})
+        self.assertEqual(response.status_code, 400)
+
+    def test_stop_falls_back_to_city_coordinates(self):
+        self.add_activity('Louvre', '48.860600', '2.337600')
+        City.objects.create(name='Paris', country='France', country_code='FR', latitude='48.856600', longitude='2.352200')
+        stop = Stop.objects.create(
+            trip=self.trip, city_name='Paris', country='France',
+            start_date=date(2025, 6, 1), end_date=date(2025, 6, 3)
+        )
+        response = self.client.get(f'/api/stops/{stop.id}/nearby-activities', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([activity['name'] for activity in response.json()], ['Louvre'])
+
+
+class CursorPaginationTests(TripTestMixin, TestCase):
+
+    def get_page(self, url, **params):
+        response = self.client.get(url, params, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_trips_page_forward_and_back(self):
+        for index in range(4):
+            Trip.objects.create(
+                user=self.user, name=f'Trip {index}', start_date=date(2025, 1, 1), end_date=date(2025, 1, 2)
+            )
+        self.add_stops(2)
+
+        first = self.get_page('/api/trips', limit=2)
+        self.assertEqual([trip['name'] for trip in first['items']], ['Trip 3', 'Trip 2'])
+        self.assertIsNone(first['prev'])
+
+        second = self.get_page('/api/trips', limit=2, cursor=first['next'])
+        third = self.get_page('/api/trips', limit=2, cursor=second['next'])
+        self.assertEqual([trip['name'] for trip in second['items']], ['Trip 1', 'Trip 0'])
+        self.assertEqual([trip['name'] for trip in third['items']], ['Grand Tour'])
+        self.assertEqual((third['items'][0]['stops_count'], third['items'][0]['activities_count']), (2, 4))
+        self.assertIsNone(third['next'])
+
+        back = self.get_page('/api/trips', limit=2, cursor=third['prev'])
+        self.assertEqual(back['items'], second['items'])
+        self.assertEqual(self.get_page('/api/trips', limit=2, cursor=back['prev'])['items'], first['items'])
+
+    def test_activities_page_in_itinerary_order(self):
+        first_stop, second_stop = self.add_stops(2, activities_per_stop=0)
+        for stop, names in ((second_stop, ['Dinner']), (first_stop, ['Museum', 'Breakfast'])):
+            for hour, name in zip((14, 8), names):
+                Activity.objects.create(stop=stop, name=name, category='sightseeing', start_time=f'{hour}:00')
+        Activity.objects.create(stop=first_stop, name='Anytime', category='sightseeing')
+
+        url = f'/api/trips/{self.trip.id}/activities'
+        names = []
+        page = self.get_page(url, limit=3)
+        names.extend(activity['name'] for activity in page['items'])
+        page = self.get_page(url, limit=3, cursor=page['next'])
+        names.extend(activity['name'] for activity in page['items'])
+        self.assertEqual(names, ['Breakfast', 'Museum', 'Anytime', 'Dinner'])
+        self.assertIsNone(page['next'])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/trips', {'cursor': 'bm9wZQ'}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+
+
+class StreamingListTests(TripTestMixin, TestCase):
+
+    def stream(self, url, **params):
+        response = self.client.get(url, params, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_trips_stream_as_ndjson_with_constant_queries(self):
+        for index in range(30):
+            Trip.objects.create(user=self.user, name=f'Trip {index}', start_date=date(2025, 1, 1), end_date=date(2025, 1, 2))
+        self.add_stops(2)
+
+        # Authentication plus one query for the rows
+        with self.assertNumQueries(2):
+            response, body = self.stream('/api/trips/stream')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        trips = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(trips), 31)
+        self.assertEqual(trips[0]['name'], 'Trip 29')
+        self.assertEqual((trips[-1]['name'], trips[-1]['stops_count'], trips[-1]['activities_count']), ('Grand Tour', 2, 4))
+
+    def test_activities_stream_as_json_array(self):
+        self.add_stops(3, activities_per_stop=2)
+        _, body = self.stream(f'/api/trips/{self.trip.id}/activities/stream', format='json')
+        names = [activity['name'] for activity in json.loads(body)]
+        self.assertEqual([name[:len('Activity 0')] for name in names], ['Activity 0'] * 2 + ['Activity 1'] * 2 + ['Activity 2'] * 2)
+
+    def test_empty_json_stream_is_a_valid_array(self):
+        _, body = self.stream(f'/api/trips/{self.trip.id}/activities/stream', format='json')
+        self.assertEqual(json.loads(body), [])
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get('/api/trips/stream', {'format': 'xml'}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class TripExportTests(TripTestMixin, TestCase):
+
+    def export(self, url, **options):
+        response = self.client.post(url, options, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_trip_exports_as_nested_json(self):
+        self.add_stops(2)
+        Stop.objects.filter(trip=self.trip, order_index=0).update(notes='Bring an umbrella')
+
+        response, body = self.export(f'/api/trips/{self.trip.id}/export', format='json')
+        self.assertIn('attachment; filename="trip-', response['Content-Disposition'])
+
+        trip = json.loads(body)
+        self.assertEqual(trip['name'], 'Grand Tour')
+        self.assertEqual(trip['budget']['activity_cost'], '40.00')
+        self.assertEqual([stop['city_name'] for stop in trip['stops']], ['City 0', 'City 1'])
+        self.assertEqual(trip['stops'][0]['notes'], 'Bring an umbrella')
+        self.assertEqual(sorted(a['name'] for a in trip['stops'][1]['activities']), ['Activity 1-0', 'Activity 1-1'])
+
+    def test_flags_leave_out_activities_budget_and_notes(self):
+        self.add_stops(1)
+        _, body = self.export(
+            f'/api/trips/{self.trip.id}/export',
+            include_activities=False, include_budget=False, include_notes=False
+        )
+        trip = json.loads(body)
+        self.assertNotIn('budget', trip)
+        self.assertNotIn('activities', trip['stops'][0])
+        self.assertNotIn('notes', trip['stops'][0])
+
+    def test_bulk_export_merges_cursors_with_constant_queries(self):
+        other = Trip.objects.create(user=self.user, name='Weekend', start_date=date(2025, 8, 1), end_date=date(2025, 8, 3))
+        self.add_stops(3)
+        self.add_stops(1, activities_per_stop=0, trip=other)
+        Trip.objects.create(user=self.user, name='Someday', start_date=date(2026, 1, 1), end_date=date(2026, 1, 2))
+
+        # Authentication, then one query each for trips, stops and activities
+        with CaptureQueriesContext(connection) as queries:
+            _, body = self.export('/api/trips/export', format='ndjson')
+        self.assertEqual(sum(q['sql'].startswith('SELECT') for q in queries.captured_queries), 4)
+
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([r['name'] for r in records if r['type'] == 'trip'], ['Someday', 'Weekend', 'Grand Tour'])
+        stops = {r['id']: r for r in records if r['type'] == 'stop'}
+        self.assertEqual(sorted(s['trip_id'] for s in stops.values()), sorted([str(other.id)] + [str(self.trip.id)] * 3))
+        activities = [r for r in records if r['type'] == 'activity']
+        self.assertEqual(len(activities), 6)
+        self.assertTrue(all(stops[a['stop_id']]['city_name'] == f"City {a['name'][9]}" for a in activities))
+
+    def test_csv_has_one_row_per_activity(self):
+        self.add_stops(2)
+        Trip.objects.create(user=self.user, name='Empty', start_date=date(2026, 1, 1), end_date=date(2026, 1, 2))
+
+        response, body = self.export('/api/trips/export', format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+
+        import csv
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual((rows[0]['trip_name'], rows[0]['stop_city_name']), ('Empty', ''))
+        self.assertEqual([row['stop_city_name'] for row in rows[1:]], ['City 0', 'City 0', 'City 1', 'City 1'])
+        self.assertTrue(all(row['activity_name'].startswith(f"Activity {row['stop_city_name'][-1]}-") for row in rows[1:]))
+
+    def test_other_users_trips_and_pdf_are_rejected(self):
+        stranger = User.objects.create_user(email='stranger@example.com', first_name='S', last_name='T', password='secret123')
+        foreign = Trip.objects.create(user=stranger, name='Private', start_date=date(2025, 1, 1), end_date=date(2025, 1, 2))
+
+        response = self.client.post(f'/api/trips/{foreign.id}/export', {}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/api/trips/export', {'format': 'pdf'}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class TripImportTests(TripTestMixin, TestCase):
+
+    def export(self, format, trip=None):
+        url = f'/api/trips/{trip.id}/export' if trip else '/api/trips/export'
+        response = self.client.post(url, {'format': format}, content_type='application/json', **self.auth)
+        return b''.join(response.streaming_content).decode()
+
+    def import_trips(self, data, source_format='json', merge=False):
+        payload = {'data': data, 'source_format': source_format, 'merge_with_existing': merge}
+        return self.client.post('/api/trips/import', payload, content_type='application/json', **self.auth)
+
+    def test_json_export_imports_as_a_copy(self):
+        self.add_stops(2)
+        response = self.import_trips(json.loads(self.export('json', self.trip)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {k: response.json()[k] for k in ('trips_created', 'stops_created', 'activities_created')},
+            {'trips_created': 1, 'stops_created': 2, 'activities_created': 4}
+        )
+
+        copy = Trip.objects.exclude(id=self.trip.id).get(name='Grand Tour')
+        self.assertEqual(copy.stops.count(), 2)
+        self.assertEqual(Activity.objects.filter(stop__trip=copy).count(), 4)
+        # Budgets are created for bulk-created trips and recomputed from the imported rows
+        self.assertEqual(copy.budget.activity_cost, Decimal('40.00'))
+        self.assertEqual(copy.budget.stay_cost, Decimal('200.00'))
+
+    def test_csv_and_ndjson_round_trip(self):
+        self.add_stops(2)
+        for source_format in ('csv', 'ndjson'):
+            response = self.import_trips({'content': self.export(source_format, self.trip)}, source_format)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual((response.json()['stops_created'], response.json()['activities_created']), (2, 4))
+        self.assertEqual(Trip.objects.filter(user=self.user, name='Grand Tour').count(), 3)
+
+    def test_merge_updates_matching_rows_and_adds_new_ones(self):
+        self.add_stops(2)
+        document = json.loads(self.export('json', self.trip))
+        document['description'] = 'Updated'
+        document['stops'][0]['activities'][0]['cost'] = '25.00'
+        document['stops'].append({
+            'city_name': 'Lisbon', 'country': 'Portugal', 'start_date': '2025-06-10', 'end_date': '2025-06-12',
+            'activities': [{'name': 'Tram 28'}]
+        })
+
+        response = self.import_trips(document, merge=True)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(
+            [result[k] for k in ('trips_created', 'trips_updated', 'stops_created', 'stops_updated', 'activities_created', 'activities_updated')],
+            [0, 1, 1, 0, 1, 1]
+        )
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.description, 'Updated')
+        self.assertEqual(self.trip.stops.count(), 3)
+        self.assertEqual(self.trip.budget.activity_cost, Decimal('55.00'))
+
+    def test_invalid_rows_reject_the_whole_import(self):
+        document = {'trips': [
+            {'name': 'Fine', 'start_date': '2025-01-01', 'end_date': '2025-01-02'},
+            {'name': 'Broken', 'start_date': '2025-01-01', 'end_date': '2025-01-02', 'stops': [
+                {'city_name': 'Rome', 'country': 'Italy', 'start_date': 'soon', 'end_date': '2025-01-02'},
+                {'city_name': 'Oslo', 'country': 'Norway', 'start_date': '2025-01-01', 'end_date': '2025-01-02',
+                 'activities': [{'name': 'Fjord', 'category': 'not-a-category'}]}
+            ]},
+        ]}
+        response = self.import_trips(document)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual([e['index'] for e in errors], [1])
+        self.assertIn('stops.0.start_date', errors[0]['errors'])
+        self.assertFalse(Trip.objects.filter(name='Fine').exists())
+
+        document['trips'][1]['stops'].pop(0)
+        response = self.import_trips(document)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('stops.0.activities.0.category', response.json()['errors'][0]['errors'])
+        self.assertFalse(Trip.objects.filter(name='Fine').exists())
+
+    def test_csv_upload_is_read_line_by_line(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        self.add_stops(1)
+        upload = SimpleUploadedFile('trips.csv', self.export('csv').encode(), content_type='text/csv')
+        response = self.client.post('/api/trips/import/upload', {'file': upload}, **self.auth)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['activities_created'], 2)
+
+        response = self.import_trips({'content': 'not json'}, 'ndjson')
+        self.assertEqual(response.status_code, 400)
+
+
+class TripTotalsTests(TripTestMixin, TestCase):
+
+    def assertTotals(self, trip, stops, activities, activities_cost, accommodation_cost):
+        trip.refresh_from_db()
+        self.assertEqual(
+            (trip.stops_count, trip.activities_count, trip.activities_cost, trip.accommodation_cost),
+            (stops, activities, Decimal(activities_cost), Decimal(accommodation_cost))
+        )
+
+    def test_signals_keep_totals_current(self):
+        stops = self.add_stops(2)
+        self.assertTotals(self.trip, 2, 4, '40.00', '200.00')
+
+        activity = stops[0].activities.first()
+        activity.cost = Decimal('25.00')
+        activity.save()
+        stops[1].delete()
+        self.assertTotals(self.trip, 1, 2, '35.00', '100.00')
+
+        stops[0].refresh_from_db()
+        self.assertEqual((stops[0].activities_count, stops[0].activities_cost), (2, Decimal('35.00')))
+
+    def test_moving_a_stop_moves_its_totals(self):
+        stop = self.add_stops(1)[0]
+        other = Trip.objects.create(user=self.user, name='Other', start_date=date(2025, 6, 1), end_date=date(2025, 6, 5))
+
+        stop.trip = other
+        stop.save()
+        self.assertTotals(self.trip, 0, 0, '0.00', '0.00')
+        self.assertTotals(other, 1, 2, '20.00', '100.00')
+
+    def test_stale_instances_do_not_overwrite_totals(self):
+        stale = Trip.objects.get(id=self.trip.id)
+        self.add_stops(1)
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertTotals(self.trip, 1, 2, '20.00', '100.00')
+
+    def test_trip_list_reads_one_table(self):
+        self.add_stops(3)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/trips', **self.auth)
+
+        item = response.json()['items'][0]
+        self.assertEqual((item['stops_count'], item['activities_count'], item['activities_cost']), (3, 6, '60.00'))
+        listing = [q['sql'] for q in ctx.captured_queries if 'FROM "trips"' in q['sql']]
+        self.assertEqual(len(listing), 1)
+        self.assertNotIn('JOIN', listing[0])
+
+    def test_reconcile_command_fixes_drift(self):
+        self.add_stops(2)
+        Trip.objects.filter(id=self.trip.id).update(stops_count=7, activities_cost=Decimal('1.00'))
+
+        out = StringIO()
+        call_command('reconcile_trip_totals', '--dry-run', stdout=out)
+        self.assertIn('1 trip(s) out of sync', out.getvalue())
+
+        call_command('reconcile_trip_totals', stdout=StringIO())
+        self.assertTotals(self.trip, 2, 4, '40.00', '200.00')
+
+    def test_list_strategies_benchmark_agrees(self):
+        out = StringIO()
+        call_command('benchmark_trip_list', '--trips', '3', '--stops', '2', '--activities', '2', '--repeat', '1', stdout=out)
+        self.assertIn('All strategies returned the same counts', out.getvalue())
+        self.assertEqual(Trip.objects.filter(name__startswith='Benchmark trip').count(), 0)
+
+
+@override_settings(CACHE_SHARED=True, CACHE_TRACK_STATS=True)
+class TripStatsTests(TripTestMixin, TestCase):
+
+    def stats(self):
+        response = self.client.get(f'/api/trips/{self.trip.id}/stats', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_costs_are_spread_over_stop_and_trip_days(self):
+        first, second = self.add_stops(2)
+        second.end_date = date(2025, 6, 3)
+        second.save()
+        Budget.objects.filter(trip=self.trip).update(transport_cost=Decimal('300.00'))
+
+        # Authentication, ownership, then the trip with its budget and its stops
+        with self.assertNumQueries(4):
+            stats = self.stats()
+
+        self.assertEqual(Decimal(stats['total_cost']), Decimal('540.00'))
+        self.assertEqual({k: Decimal(v) for k, v in stats['cost_by_stop'].items()}, {
+            'City 0, Italy': Decimal('120.00'), 'City 1, Italy': Decimal('120.00'),
+        })
+        by_day = {day: Decimal(cost) for day, cost in stats['cost_by_day'].items()}
+        self.assertEqual(len(by_day), 30)
+        self.assertEqual(
+            [by_day['2025-06-01'], by_day['2025-06-02'], by_day['2025-06-03'], by_day['2025-06-04']],
+            [Decimal('130.00'), Decimal('70.00'), Decimal('70.00'), Decimal('10.00')]
+        )
+        self.assertEqual(sum(by_day.values()), Decimal('540.00'))
+        self.assertEqual(stats['most_expensive_day'], '2025-06-01')
+        self.assertEqual(Decimal(stats['daily_average']), Decimal('18.00'))
+
+    def test_report_is_cached_until_the_trip_changes(self):
+        self.add_stops(1)
+        self.stats()
+        with self.assertNumQueries(2):
+            self.stats()
+
+        Activity.objects.create(
+            stop=Stop.objects.create(
+                trip=self.trip, city_name='Rome', country='Italy', start_date=date(2025, 6, 9), end_date=date(2025, 6, 9)
+            ),
+            name='Opera', cost=Decimal('400.00')
+        )
+        stats = self.stats()
+        self.assertEqual(stats['most_expensive_day'], '2025-06-09')
+        self.assertEqual(Decimal(stats['cost_by_stop']['Rome, Italy']), Decimal('400.00'))
+
+        Budget.objects.get(trip=self.trip).delete()
+        response = self.client.get(f'/api/trips/{self.trip.id}/stats', **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class TripAnalyticsTests(TripTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_stops(2)
+        Budget.objects.filter(trip=self.trip).update(transport_cost=Decimal('300.00'))
+        self.later = Trip.objects.create(
+            user=self.user, name='Weekend', start_date=date(2025, 7, 1), end_date=date(2025, 7, 2)
+        )
+        Budget.objects.filter(trip=self.later).update(meal_cost=Decimal('50.00'))
+        stranger = User.objects.create_user(email='stranger@example.com', first_name='S', last_name='T', password='x')
+        Trip.objects.create(user=stranger, name='Elsewhere', start_date=date(2025, 6, 1), end_date=date(2025, 7, 31))
+
+    def analytics(self, payload, status=200):
+        response = self.client.post(
+            '/api/trips/analytics', json.dumps(payload), content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def test_series_cover_every_day_of_the_selected_trips(self):
+        # Authentication, then one query for every cost row
+        with self.assertNumQueries(2):
+            result = self.analytics({'trip_ids': [str(self.trip.id), str(self.later.id)]})
+
+        self.assertEqual(result['trip_count'], 2)
+        self.assertEqual(len(result['dates']), 32)
+        self.assertEqual((result['dates'][0], result['dates'][-1]), ('2025-06-01', '2025-07-02'))
+        series = result['cost_by_category']
+        self.assertEqual(series['stay'][:3], [100.0, 100.0, 0.0])
+        self.assertEqual(series['activity'][:3], [20.0, 20.0, 0.0])
+        self.assertEqual(series['meal'][-3:], [0.0, 25.0, 25.0])
+        self.assertEqual(result['daily_totals'][0], 130.0)
+        self.assertEqual(result['category_totals'], {
+            'transport': 300.0, 'stay': 200.0, 'activity': 40.0,
+            'meal': 50.0, 'shopping': 0.0, 'miscellaneous': 0.0,
+        })
+
+    def test_date_range_selects_and_clips(self):
+        result = self.analytics({'start_date': '2025-06-29', 'end_date': '2025-07-01'})
+
+        self.assertEqual(result['trip_count'], 2)
+        self.assertEqual(result['dates'], ['2025-06-29', '2025-06-30', '2025-07-01'])
+        self.assertEqual(result['cost_by_category']['transport'], [10.0, 10.0, 0.0])
+        self.assertEqual(result['daily_totals'], [10.0, 10.0, 25.0])
+
+        self.assertEqual(self.analytics({'start_date': '2030-01-01'})['dates'], [])
+        self.analytics({}, status=400)
+
+
+class ItineraryTimelineTests(TripTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.stop = Stop.objects.create(
+            trip=self.trip, city_name='Rome', country='Italy', start_date=date(2025, 6, 1), end_date=date(2025, 6, 3)
+        )
+        for name, start in [('Museum', '09:00'), ('Tour', '14:00'), ('Hike', '10:00'), ('Shopping', None),
+                            ('Market', '08:00'), ('Sunrise', '07:00')]:
+            Activity.objects.create(stop=self.stop, name=name, start_time=start)
+
+    def itinerary(self, status=200, **params):
+        response = self.client.get(f'/api/trips/{self.trip.id}/activities/by-date', params, **self.auth)
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def test_activities_roll_over_the_days_of_their_stop(self):
+        # Authentication, the trip, its stops, their activities
+        with self.assertNumQueries(4):
+            result = self.itinerary()
+        self.assertTrue(result['days_inferred'])
+        days = result['days']
+
+        self.assertEqual(len(days), 30)
+        self.assertEqual([day['date'] for day in days[:2]], ['2025-06-01', '2025-06-02'])
+        self.assertEqual(
+            [[a['name'] for a in day['activities']] for day in days[:4]],
+            [['Museum', 'Tour'], ['Hike', 'Shopping'], ['Sunrise', 'Market'], []]
+        )
+        self.assertEqual(days[2]['locations'], ['Rome, Italy'])
+        self.assertEqual(days[3]['locations'], [])
+        self.assertEqual(days[0]['activities'][0]['location'], 'Rome, Italy')
+
+    def test_sub_range_is_read_without_the_rest_of_the_trip(self):
+        result = self.itinerary(**{'from': '2025-06-02', 'to': '2025-06-03'})
+        self.assertEqual((result['start_date'], result['end_date']), ('2025-06-02', '2025-06-03'))
+        self.assertEqual([a['name'] for a in result['days'][1]['activities']], ['Sunrise', 'Market'])
+
+        # No stop overlaps: the days are there, nothing else is loaded
+        with self.assertNumQueries(3):
+            days = self.itinerary(**{'from': '2025-06-10', 'to': '2025-06-12'})['days']
+        self.assertEqual([day['activities'] for day in days], [[], [], []])
+
+        self.itinerary(status=400, **{'from': '2025-06-12', 'to': '2025-06-10'})
+
+    def test_long_trips_keep_a_constant_number_of_queries(self):
+        self.trip.end_date = date(2025, 8, 29)
+        self.trip.save()
+        self.add_stops(60, activities_per_stop=3)
+
+        with self.assertNumQueries(4):
+            result = self.itinerary()
+        self.assertTrue(result['days_inferred'])
+        days = result['days']
+        self.assertEqual(len(days), 90)
+
+
+class ScheduleConflictTests(TripTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rome = Stop.objects.create(
+            trip=self.trip, city_name='Rome', country='Italy', start_date=date(2025, 6, 1), end_date=date(2025, 6, 4)
+        )
+        # Check-out day of Rome: no overlap
+        Stop.objects.create(
+            trip=self.trip, city_name='Florence', country='Italy', start_date=date(2025, 6, 4), end_date=date(2025, 6, 6)
+        )
+
+    def post(self, url, payload):
+        return self.client.post(url, json.dumps(payload), content_type='application/json', **self.auth)
+
+    def conflicts(self):
+        response = self.client.get(f'/api/trips/{self.trip.id}/conflicts', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_overlapping_stops_and_activities_are_reported(self):
+        self.assertFalse(self.conflicts()['has_conflicts'])
+
+        Stop.objects.create(
+            trip=self.trip, city_name='Pisa', country='Italy', start_date=date(2025, 6, 5), end_date=date(2025, 6, 8)
+        )
+        for name, start, end, minutes in [('Museum', '09:00', '12:00', None), ('Lunch', '11:30', None, 60),
+                                          ('Walk', '13:00', '14:00', None), ('Colosseum', '10:00', '11:00', None),
+                                          ('Forum', '10:30', None, None)]:
+            Activity.objects.create(stop=self.rome, name=name, start_time=start, end_time=end, duration_minutes=minutes)
+
+        # Authentication, ownership, stops, activities
+        with self.assertNumQueries(4):
+            result = self.conflicts()
+
+        self.assertTrue(result['has_conflicts'])
+        [stops] = result['stop_conflicts']
+        self.assertEqual(
+            (stops['first_location'], stops['second_location'], stops['overlap_start'], stops['overlap_end']),
+            ('Florence, Italy', 'Pisa, Italy', '2025-06-05', '2025-06-06')
+        )
+        # Each activity is reported against the one reaching furthest before it
+        self.assertEqual(
+            [(c['first_name'], c['second_name'], c['overlap_start'], c['overlap_end'])
+             for c in result['activity_conflicts']],
+            [('Museum', 'Colosseum', '10:00:00', '11:00:00'), ('Museum', 'Forum', '10:30:00', '10:30:00'),
+             ('Museum', 'Lunch', '11:30:00', '12:00:00')]
+        )
+
+    def test_activity_overlap_does_not_depend_on_creation_order(self):
+        for order in (('A', 'B'), ('B', 'A')):
+            with self.subTest(order=order):
+                Activity.objects.filter(stop=self.rome).delete()
+                times = {'A': ('10:00', '12:00'), 'B': ('09:00', '11:00')}
+                for name in order:
+                    Activity.objects.create(stop=self.rome, name=name, start_time=times[name][0], end_time=times[name][1])
+
+                [conflict] = self.conflicts()['activity_conflicts']
+                self.assertEqual(
+                    (conflict['first_name'], conflict['second_name'], conflict['overlap_start'], conflict['overlap_end']),
+                    ('B', 'A', '10:00:00', '11:00:00')
+                )
+
+                Activity.objects.filter(stop=self.rome).delete()
+                rows = [{'name': name, 'start_time': times[name][0], 'end_time': times[name][1]} for name in order]
+                response = self.post(f'/api/stops/{self.rome.id}/activities/bulk', {'activities': rows, 'check_conflicts': True})
+                self.assertEqual(response.status_code, 400)
+
+    def test_bulk_endpoints_can_reject_conflicts(self):
+        Activity.objects.create(stop=self.rome, name='Museum', start_time='09:00', end_time='12:00')
+        activities = [
+            {'name': 'Tour', 'start_time': '13:00', 'end_time': '15:00'},
+            {'name': 'Gelato', 'start_time': '14:30', 'duration_minutes': 30},
+        ]
+
+        response = self.post(f'/api/stops/{self.rome.id}/activities/bulk', {'activities': activities, 'check_conflicts': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            {'index': 1, 'errors': {'start_time': ["Overlaps 'Tour' from 14:30 to 15:00"]}},
+        ])
+        self.assertEqual(self.rome.activities.count(), 1)
+
+        # Without the check, the same request is accepted
+        response = self.post(f'/api/stops/{self.rome.id}/activities/bulk', {'activities': activities})
+        self.assertEqual(response.status_code, 200)
+
+        stops = [{'city_name': 'Siena', 'country': 'Italy', 'start_date': '2025-06-02', 'end_date': '2025-06-03'}]
+        response = self.post(f'/api/trips/{self.trip.id}/stops/bulk', {'stops': stops, 'check_conflicts': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            {'index': 0, 'errors': {'start_date': ['Overlaps Rome, Italy from 2025-06-02 to 2025-06-03']}},
+        ])
+
+
+class StopRouteTests(TripTestMixin, TestCase):
+
+    def add_stop(self, name, latitude, longitude, order_index, day=1, nights=0):
+        start = date(2025, 6, day)
+        return Stop.objects.create(
+            trip=self.trip, city_name=name, country='Italy', start_date=start, end_date=start + timedelta(days=nights),
+            latitude=Decimal(str(latitude)), longitude=Decimal(str(longitude)), order_index=order_index
+        )
+
+    def optimize(self, **params):
+        url = f'/api/trips/{self.trip.id}/stops/optimize'
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        response = self.client.post(url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_free_stops_are_reordered_and_optionally_saved(self):
+        stops = [self.add_stop(name, 45.0, lng, index) for index, (name, lng) in enumerate(
+            [('A', 10.0), ('C', 12.0), ('B', 11.0), ('D', 13.0)]
+        )]
+
+        result = self.optimize()
+        self.assertEqual(
+            [entry['stop_id'] for entry in result['order']], [str(stops[i].id) for i in (0, 2, 1, 3)]
+        )
+        self.assertLess(result['distance_km'], result['original_distance_km'])
+        self.assertAlmostEqual(result['distance_km'], 3 * haversine_km(45.0, 10.0, 45.0, 11.0), places=2)
+        self.assertFalse(result['applied'])
+        self.assertEqual(Stop.objects.get(pk=stops[1].pk).order_index, 1)
+
+        self.assertTrue(self.optimize(apply='true')['applied'])
+        self.assertEqual(
+            list(self.trip.stops.order_by('order_index').values_list('city_name', flat=True)), ['A', 'B', 'C', 'D']
+        )
+
+    def test_dates_constrain_the_order(self):
+        # Rome and Naples are close together, but Milan's dates fall between them
+        self.add_stop('Rome', 41.9, 12.5, 0, day=1, nights=2)
+        self.add_stop('Milan', 45.46, 9.19, 1, day=3, nights=2)
+        self.add_stop('Naples', 40.85, 14.27, 2, day=5, nights=2)
+        self.add_stop('Florence', 43.77, 11.25, 3, day=5, nights=2)
+
+        order = [Stop.objects.get(pk=entry['stop_id']).city_name for entry in self.optimize()['order']]
+        self.assertEqual(order, ['Rome', 'Milan', 'Florence', 'Naples'])
+
+    def test_two_hundred_stops_are_optimized_quickly(self):
+        rng = np.random.default_rng(7)
+        stops = [
+            {'latitude': lat, 'longitude': lng, 'start_date': date(2025, 6, 1), 'end_date': date(2025, 6, 1)}
+            for lat, lng in zip(rng.uniform(35, 55, 200), rng.uniform(-5, 25, 200))
+        ]
+        started = time.perf_counter()
+        route, distance_km = optimize_route(stops)
+
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(sorted(route), list(range(200)))
+        self.assertLess(distance_km, path_length(stop_distances(stops), list(range(200))) / 5)
@@ -0,0 +1,84 @@
+"""
+Denormalized trip and stop totals.
+
+Trips store how many stops and activities they have and what those cost;
+stops store the same for their activities, so lists and detail views read
+columns instead of counting. Model signals shift the columns with F()
+expressions, one UPDATE per table in the transaction of the write, so
+concurrent writers never overwrite each other's changes. Writes that bypass
+signals (bulk_create, queryset.update) recompute them from subqueries, via
+budgeting.deferred_budget_updates().
+"""
+
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Trip, Stop, Activity
+
+ZERO = Decimal('0.00')
+
+TRIP_TOTAL_FIELDS = ('stops_count', 'activities_count', 'activities_cost', 'accommodation_cost')
+STOP_TOTAL_FIELDS = ('activities_count', 'activities_cost')
+
+
+def _shifted(amounts):
+    return {field: F(field) + amount for field, amount in amounts.items() if amount}
+
+
+def shift_trip_totals(trip_id, **amounts):
+    """Add amounts, keyed by TRIP_TOTAL_FIELDS, to a trip's totals in one UPDATE"""
+    changes = _shifted(amounts)
+    if not changes:
+        return 0
+    return Trip.objects.filter(pk=trip_id).update(**changes)
+
+
+def shift_activity_totals(stop_id, count, cost):
+    """Add count activities costing cost to a stop and to the trip it belongs to"""
+    changes = _shifted({'activities_count': count, 'activities_cost': cost})
+    if not changes:
+        return 0
+    Stop.objects.filter(pk=stop_id).update(**changes)
+    return Trip.objects.filter(stops__id=stop_id).update(**changes)
+
+
+def _count(queryset, group_by):
+    total = queryset.order_by().values(group_by).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(total), Value(0), output_field=IntegerField())
+
+
+def _cost(queryset, group_by, field):
+    total = queryset.order_by().values(group_by).annotate(total=Sum(field)).values('total')
+    return Coalesce(Subquery(total), Value(ZERO), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def stop_total_expressions():
+    """DB-side totals of the outer Stop row, keyed by STOP_TOTAL_FIELDS"""
+    activities = Activity.objects.filter(stop_id=OuterRef('pk'))
+    return {
+        'activities_count': _count(activities, 'stop'),
+        'activities_cost': _cost(activities, 'stop', 'cost'),
+    }
+
+
+def trip_total_expressions():
+    """DB-side totals of the outer Trip row, keyed by TRIP_TOTAL_FIELDS"""
+    stops = Stop.objects.filter(trip_id=OuterRef('pk'))
+    activities = Activity.objects.filter(stop__trip_id=OuterRef('pk'))
+    return {
+        'stops_count': _count(stops, 'trip'),
+        'activities_count': _count(activities, 'stop__trip'),
+        'activities_cost': _cost(activities, 'stop__trip', 'cost'),
+        'accommodation_cost': _cost(stops, 'trip', 'accommodation_cost'),
+    }
+
+
+def recalculate_totals(trip_ids):
+    """Recompute the totals of the given trips and their stops from their rows
+
+    Two UPDATEs with correlated subqueries: one for the stops, one for the trips.
+    """
+    Stop.objects.filter(trip_id__in=trip_ids).update(**stop_total_expressions())
+    return Trip.objects.filter(pk__in=trip_ids).update(**trip_total_expressions())
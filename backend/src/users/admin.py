@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, SavedDestination, UserPreferences
+from .models import UserProfile, SavedDestination, UserPreferences, UserTravelStats
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -93,3 +93,26 @@ class UserPreferencesAdmin(admin.ModelAdmin):
         return obj.user.email
     user_email.short_description = 'User Email'
     user_email.admin_order_field = 'user__email'
+
+@admin.register(UserTravelStats)
+class UserTravelStatsAdmin(admin.ModelAdmin):
+    """Admin configuration for UserTravelStats model
+
+    Rows are maintained by users.stats; run rebuild_user_stats to backfill them.
+    """
+    list_display = (
+        'user_email', 'total_trips', 'completed_trips', 'upcoming_trips', 'total_destinations',
+        'total_activities', 'total_spent', 'average_trip_duration', 'favorite_country', 'refreshed_at'
+    )
+    list_select_related = ('user',)
+    search_fields = ('user__email', 'user__first_name', 'user__last_name', 'favorite_country')
+    ordering = ('-total_trips',)
+    readonly_fields = [field.name for field in UserTravelStats._meta.fields]
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def user_email(self, obj):
+        return obj.user.email
+    user_email.short_description = 'User Email'
+    user_email.admin_order_field = 'user__email'
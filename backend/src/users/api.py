@@ -1,8 +1,10 @@
 from ninja import Router
+from ninja.pagination import paginate
 from ninja_jwt.authentication import JWTAuth
 from django.shortcuts import get_object_or_404
 from typing import List
 from .models import UserProfile, SavedDestination, UserPreferences
+from .stats import travel_stats, user_stats_report, user_trip_stats_report
 from .schemas import (
     UserProfileSchema, UserProfileCreateSchema, UserProfileUpdateSchema,
     SavedDestinationSchema, SavedDestinationCreateSchema, SavedDestinationUpdateSchema,
@@ -10,6 +12,8 @@ from .schemas import (
     CompleteUserProfileSchema, UserStatsSchema
 )
 from authentication.schemas import MessageResponseSchema
+from trips.schemas import UserTripStatsSchema
+from globetrotter.pagination import CursorPagination
 
 users_router = Router(tags=["User Management"])
 
@@ -51,9 +55,10 @@ def update_user_preferences(request, payload: UserPreferencesUpdateSchema):
 
 # Saved Destinations endpoints
 @users_router.get("/saved-destinations", response=List[SavedDestinationSchema], auth=JWTAuth())
+@paginate(CursorPagination, ordering=(('priority', True), ('saved_at', True), ('id', True)))
 def list_saved_destinations(request):
-    """List current user's saved destinations"""
-    return list(request.user.saved_destinations.all())
+    """List current user's saved destinations, highest priority first"""
+    return request.user.saved_destinations.all()
 
 @users_router.post("/saved-destinations", response=SavedDestinationSchema, auth=JWTAuth())
 def create_saved_destination(request, payload: SavedDestinationCreateSchema):
@@ -115,51 +120,9 @@ def get_complete_profile(request):
 @users_router.get("/stats", response=UserStatsSchema, auth=JWTAuth())
 def get_user_stats(request):
     """Get user's travel statistics"""
-    user = request.user
-    trips = user.trips.all()
-    
-    total_trips = trips.count()
-    completed_trips = trips.filter(status='completed')
-    
-    # Calculate total destinations visited
-    total_destinations = 0
-    total_activities = 0
-    total_budget_spent = 0
-    
-    for trip in completed_trips:
-        total_destinations += trip.stops.count()
-        for stop in trip.stops.all():
-            total_activities += stop.activities.count()
-        
-        if hasattr(trip, 'budget'):
-            total_budget_spent += float(trip.budget.total_cost)
-    
-    # Calculate average trip duration
-    total_duration = sum((trip.end_date - trip.start_date).days + 1 for trip in completed_trips)
-    avg_duration = total_duration / completed_trips.count() if completed_trips.count() > 0 else 0
-    
-    # Find favorite destination (most visited country)
-    country_counts = {}
-    for trip in completed_trips:
-        for stop in trip.stops.all():
-            country_counts[stop.country] = country_counts.get(stop.country, 0) + 1
-    
-    favorite_destination = max(country_counts.items(), key=lambda x: x[1])[0] if country_counts else None
-    
-    # Find most expensive trip
-    most_expensive_trip = None
-    max_cost = 0
-    for trip in completed_trips:
-        if hasattr(trip, 'budget') and trip.budget.total_cost > max_cost:
-            max_cost = trip.budget.total_cost
-            most_expensive_trip = trip.name
-    
-    return {
-        "total_trips": total_trips,
-        "total_destinations_visited": total_destinations,
-        "total_activities": total_activities,
-        "total_budget_spent": total_budget_spent,
-        "favorite_destination": favorite_destination,
-        "average_trip_duration": avg_duration,
-        "most_expensive_trip": most_expensive_trip
-    }
+    return user_stats_report(travel_stats(request.user))
+
+@users_router.get("/stats/trips", response=UserTripStatsSchema, auth=JWTAuth())
+def get_user_trip_stats(request):
+    """Get user's trip statistics"""
+    return user_trip_stats_report(travel_stats(request.user))
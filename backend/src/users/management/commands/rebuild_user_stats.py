@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from users.stats import rebuild_user_stats
+
+
+def _refresh_batch(user_ids):
+    # Worker threads open their own connection; close it once the batch is stored
+    try:
+        return rebuild_user_stats(user_ids)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized travel statistics of every user in parallel batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='users', default=[],
+            help='Only rebuild this user id (can be repeated)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of users recomputed per transaction'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of batches rebuilt concurrently (1 rebuilds in this thread)'
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk')
+        if options['users']:
+            users = users.filter(pk__in=options['users'])
+        user_ids = list(users.values_list('pk', flat=True))
+
+        batch_size = options['batch_size']
+        batches = [user_ids[start:start + batch_size] for start in range(0, len(user_ids), batch_size)]
+
+        if options['workers'] <= 1:
+            rebuilt = sum(rebuild_user_stats(batch) for batch in batches)
+        else:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                rebuilt = sum(executor.map(_refresh_batch, batches))
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt travel statistics of {rebuilt} user(s)"))
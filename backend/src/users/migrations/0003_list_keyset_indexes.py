@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_remove_userprofile_location_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='saveddestination',
+            index=models.Index(fields=['user', '-priority', '-saved_at', '-id'], name='saved_dest_user_order_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_auto_20250811_1223'),
+        ('users', '0003_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTravelStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='travel_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_trips', models.PositiveIntegerField(default=0)),
+                ('completed_trips', models.PositiveIntegerField(default=0)),
+                ('upcoming_trips', models.PositiveIntegerField(default=0)),
+                ('total_destinations', models.PositiveIntegerField(default=0)),
+                ('total_activities', models.PositiveIntegerField(default=0)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_trip_days', models.PositiveIntegerField(default=0)),
+                ('favorite_country', models.CharField(blank=True, max_length=100)),
+                ('favorite_category', models.CharField(blank=True, max_length=20)),
+                ('most_expensive_trip', models.CharField(blank=True, max_length=200)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User Travel Stats',
+                'verbose_name_plural': 'User Travel Stats',
+                'db_table': 'user_travel_stats',
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Existing rows were computed without per-trip contributions to diff against;
+# dropping them makes users.stats rebuild each user's row on first read.
+def clear_travel_stats(apps, schema_editor):
+    apps.get_model('users', 'UserTravelStats').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_travel_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripTravelStats',
+            fields=[
+                ('trip_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=200)),
+                ('trip_created_at', models.DateTimeField(null=True)),
+                ('completed', models.BooleanField(default=False)),
+                ('upcoming', models.BooleanField(default=False)),
+                ('destinations', models.PositiveIntegerField(default=0)),
+                ('activities', models.PositiveIntegerField(default=0)),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days', models.PositiveIntegerField(default=0)),
+                ('countries', models.JSONField(default=dict)),
+                ('categories', models.JSONField(default=dict)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trip_travel_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'trip_travel_stats',
+                'indexes': [models.Index(fields=['user', 'completed', '-spent'], name='trip_travel_stats_spent_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserCategoryCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=20)),
+                ('activities', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_category_counts',
+                'indexes': [models.Index(fields=['user', '-activities', 'category'], name='user_category_counts_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'category'), name='user_category_counts_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserCountryVisits',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(max_length=100)),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='country_visits', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_country_visits',
+                'indexes': [models.Index(fields=['user', '-visits', 'country'], name='user_country_visits_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'country'), name='user_country_visits_unique')],
+            },
+        ),
+        migrations.RunPython(clear_travel_stats, migrations.RunPython.noop),
+    ]
@@ -43,6 +43,10 @@ class SavedDestination(models.Model):
         verbose_name_plural = 'Saved Destinations'
         unique_together = ['user', 'city_name', 'country']
         ordering = ['-priority', '-saved_at']
+        indexes = [
+            # Keyset order of list_saved_destinations
+            models.Index(fields=['user', '-priority', '-saved_at', '-id'], name='saved_dest_user_order_idx'),
+        ]
     
     def __str__(self):
         return f"{self.city_name}, {self.country} - {self.user.email}"
@@ -102,3 +106,100 @@ class UserPreferences(models.Model):
     
     def __str__(self):
         return f"Preferences for {self.user.email}"
+
+class UserTravelStats(models.Model):
+    """Travel statistics of a user, materialized by users.stats
+
+    Trip, stop, activity and budget writes apply the changed trips' differences
+    to the row, so reading it never aggregates the user's trips. Statistics
+    other than the trip counts cover completed trips only.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='travel_stats'
+    )
+    total_trips = models.PositiveIntegerField(default=0)
+    completed_trips = models.PositiveIntegerField(default=0)
+    upcoming_trips = models.PositiveIntegerField(default=0)
+    total_destinations = models.PositiveIntegerField(default=0)
+    total_activities = models.PositiveIntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_trip_days = models.PositiveIntegerField(default=0)
+    favorite_country = models.CharField(max_length=100, blank=True)
+    favorite_category = models.CharField(max_length=20, blank=True)
+    most_expensive_trip = models.CharField(max_length=200, blank=True)
+    refreshed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'user_travel_stats'
+        verbose_name = 'User Travel Stats'
+        verbose_name_plural = 'User Travel Stats'
+    
+    def __str__(self):
+        return f"Travel stats for {self.user.email}"
+    
+    @property
+    def average_trip_duration(self):
+        """Average length in days of the completed trips"""
+        return self.total_trip_days / self.completed_trips if self.completed_trips else 0
+
+
+class TripTravelStats(models.Model):
+    """A trip's contribution to its owner's UserTravelStats, as last applied
+
+    users.stats diffs a changed trip against this row to find what to add to or
+    subtract from the owner's statistics. trip_id is not a foreign key, so the
+    row outlives the trip until its delete has been applied.
+    """
+    trip_id = models.UUIDField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='trip_travel_stats')
+    name = models.CharField(max_length=200, blank=True)
+    trip_created_at = models.DateTimeField(null=True)
+    completed = models.BooleanField(default=False)
+    upcoming = models.BooleanField(default=False)
+    destinations = models.PositiveIntegerField(default=0)
+    activities = models.PositiveIntegerField(default=0)
+    spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days = models.PositiveIntegerField(default=0)
+    # Stops per country and activities per category of a completed trip
+    countries = models.JSONField(default=dict)
+    categories = models.JSONField(default=dict)
+
+    class Meta:
+        db_table = 'trip_travel_stats'
+        indexes = [
+            # Most expensive completed trip of a user
+            models.Index(fields=['user', 'completed', '-spent'], name='trip_travel_stats_spent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Travel stats of trip {self.trip_id}"
+
+
+class UserCountryVisits(models.Model):
+    """Stops of a user's completed trips in one country, for favorite_country"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='country_visits')
+    country = models.CharField(max_length=100)
+    visits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'user_country_visits'
+        constraints = [models.UniqueConstraint(fields=['user', 'country'], name='user_country_visits_unique')]
+        indexes = [models.Index(fields=['user', '-visits', 'country'], name='user_country_visits_top_idx')]
+
+    def __str__(self):
+        return f"{self.country}: {self.visits}"
+
+
+class UserCategoryCount(models.Model):
+    """Activities of a user's completed trips in one category, for favorite_category"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='category_counts')
+    category = models.CharField(max_length=20)
+    activities = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'user_category_counts'
+        constraints = [models.UniqueConstraint(fields=['user', 'category'], name='user_category_counts_unique')]
+        indexes = [models.Index(fields=['user', '-activities', 'category'], name='user_category_counts_top_idx')]
+
+    def __str__(self):
+        return f"{self.category}: {self.activities}"
@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
+from trips.models import Trip, Stop, Activity, Budget
+from trips.budgeting import trips_recalculated
 from users.models import UserProfile, UserPreferences
+from users.stats import schedule_stats_refresh
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -26,3 +29,44 @@ def save_user_preferences(sender, instance, **kwargs):
     """Save UserPreferences when user is saved"""
     if hasattr(instance, 'preferences'):
         instance.preferences.save()
+
+# Travel statistics are updated for the changed trips
+def refresh_stats_on_change(model, changed_trips, cascade_from=()):
+    """Apply changed_trips(instance) to their owners' statistics whenever instances of model are saved or deleted
+
+    Deletes cascading from a cascade_from model are skipped, since that model's
+    own handler already covers the same trip.
+    """
+    def refresh(sender, instance, **kwargs):
+        if cascade_from and isinstance(kwargs.get('origin'), cascade_from) and kwargs.get('origin') is not instance:
+            return
+        schedule_stats_refresh(changed_trips(instance))
+
+    uid = f"travel-stats:{model._meta.label}"
+    post_save.connect(refresh, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(refresh, sender=model, weak=False, dispatch_uid=uid)
+
+# trips.signals remembers the stored row of a saved stop or activity in
+# _budget_previous, so a move also updates the trip it left
+def _previous(instance, field):
+    previous = getattr(instance, '_budget_previous', None)
+    return previous[field] if previous else None
+
+def _stop_trips(stop):
+    return [stop.trip_id, _previous(stop, 'trip_id')]
+
+def _activity_trips(activity):
+    previous_stop_id = _previous(activity, 'stop_id')
+    if Activity.stop.is_cached(activity) and previous_stop_id in (None, activity.stop_id):
+        return [activity.stop.trip_id]
+    return Stop.objects.filter(pk__in={activity.stop_id, previous_stop_id} - {None}).values_list('trip_id', flat=True)
+
+refresh_stats_on_change(Trip, lambda trip: [trip.pk])
+refresh_stats_on_change(Stop, _stop_trips, cascade_from=(Trip,))
+refresh_stats_on_change(Activity, _activity_trips, cascade_from=(Trip, Stop))
+refresh_stats_on_change(Budget, lambda budget: [budget.trip_id], cascade_from=(Trip,))
+
+@receiver(trips_recalculated)
+def refresh_stats_of_recalculated_trips(sender, trip_ids, **kwargs):
+    """Bulk writes recompute budgets and totals without model signals"""
+    schedule_stats_refresh(trip_ids)
@@ -0,0 +1,286 @@
+"""
+Materialized travel statistics for /users/stats.
+
+Each user's statistics are kept in a UserTravelStats row, so readers only
+ever fetch one row. Trip, stop, activity and budget writes collect the trips
+they touch (see users.signals; bulk writes report theirs through
+trips.budgeting.trips_recalculated) and every transaction applies them once,
+when it commits. Applying a trip diffs it against its TripTravelStats row, the
+contribution applied last time, and adds the difference to the owner's totals
+with F() expressions and to the per-country and per-category counts the
+favourites are read from. Users without a row are rebuilt from all of their
+trips, as the rebuild_user_stats command does.
+"""
+
+import threading
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from trips.models import Trip, Stop, Activity
+from .models import UserTravelStats, TripTravelStats, UserCountryVisits, UserCategoryCount
+
+ZERO = Decimal('0.00')
+NOT_STARTED = ('planning', 'upcoming')
+
+TOTAL_FIELDS = (
+    'total_trips', 'completed_trips', 'upcoming_trips', 'total_destinations', 'total_activities',
+    'total_spent', 'total_trip_days',
+)
+CONTRIBUTION_FIELDS = (
+    'user', 'name', 'trip_created_at', 'completed', 'upcoming', 'destinations', 'activities', 'spent', 'days',
+    'countries', 'categories',
+)
+
+# Trips of the current transaction waiting to be applied, per thread
+_pending = threading.local()
+
+
+def budget_total():
+    """DB-side Budget.total_cost of the outer trip's budget"""
+    return (
+        F('budget__transport_cost') + F('budget__stay_cost') + F('budget__activity_cost')
+        + F('budget__meal_cost') + F('budget__shopping_cost') + F('budget__miscellaneous_cost')
+    )
+
+
+def _totals(contribution):
+    """UserTravelStats totals a TripTravelStats row adds to"""
+    return {
+        'total_trips': 1,
+        'completed_trips': int(contribution.completed),
+        'upcoming_trips': int(contribution.upcoming),
+        'total_destinations': contribution.destinations,
+        'total_activities': contribution.activities,
+        'total_spent': contribution.spent,
+        'total_trip_days': contribution.days,
+    }
+
+
+def _count_by_trip(rows):
+    counts = defaultdict(dict)
+    for trip_id, value, count in rows:
+        counts[trip_id][value] = count
+    return counts
+
+
+def current_contributions(trips):
+    """Unsaved TripTravelStats of a queryset of trips, keyed by trip id"""
+    rows = trips.order_by().annotate(spent=budget_total()).values_list(
+        'pk', 'user_id', 'name', 'created_at', 'status', 'start_date', 'end_date',
+        'stops_count', 'activities_count', 'spent'
+    )
+    contributions = {}
+    for trip_id, user_id, name, created_at, status, start_date, end_date, stops, activities, spent in rows:
+        completed = status == 'completed'
+        contributions[trip_id] = TripTravelStats(
+            trip_id=trip_id, user_id=user_id, name=name, trip_created_at=created_at,
+            completed=completed, upcoming=status in NOT_STARTED,
+            destinations=stops if completed else 0,
+            activities=activities if completed else 0,
+            spent=(spent or ZERO) if completed else ZERO,
+            # Durations count both the first and the last day
+            days=max((end_date - start_date).days + 1, 0) if completed else 0,
+            countries={}, categories={},
+        )
+
+    completed = [trip_id for trip_id, contribution in contributions.items() if contribution.completed]
+    if completed:
+        countries = _count_by_trip(
+            Stop.objects.filter(trip_id__in=completed).order_by().values('trip_id', 'country').annotate(
+                count=Count('pk')
+            ).values_list('trip_id', 'country', 'count')
+        )
+        categories = _count_by_trip(
+            Activity.objects.filter(stop__trip_id__in=completed).order_by().values('stop__trip_id', 'category').annotate(
+                count=Count('pk')
+            ).values_list('stop__trip_id', 'category', 'count')
+        )
+        for trip_id in completed:
+            contributions[trip_id].countries = countries.get(trip_id, {})
+            contributions[trip_id].categories = categories.get(trip_id, {})
+    return contributions
+
+
+def _lock_users(user_ids):
+    """Lock the statistics rows of existing users among user_ids, creating missing ones
+
+    Returns (locked user ids, user ids whose row had to be created).
+    """
+    locked = set(UserTravelStats.objects.select_for_update().filter(user_id__in=user_ids).values_list(
+        'user_id', flat=True
+    ))
+    created = set(get_user_model().objects.filter(pk__in=set(user_ids) - locked).values_list('pk', flat=True))
+    if created:
+        UserTravelStats.objects.bulk_create([UserTravelStats(user_id=user_id) for user_id in created], ignore_conflicts=True)
+        list(UserTravelStats.objects.select_for_update().filter(user_id__in=created).values_list('pk', flat=True))
+    return locked | created, created
+
+
+def _reset(user_ids):
+    """Clear the statistics of users about to be rebuilt from all of their trips"""
+    TripTravelStats.objects.filter(user_id__in=user_ids).delete()
+    UserCountryVisits.objects.filter(user_id__in=user_ids).delete()
+    UserCategoryCount.objects.filter(user_id__in=user_ids).delete()
+    UserTravelStats.objects.filter(user_id__in=user_ids).update(**dict.fromkeys(TOTAL_FIELDS, 0))
+
+
+def _apply_counts(model, field, count_field, deltas):
+    """Add {(user_id, value): delta} to per-user count rows, dropping rows that reach zero"""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    rows = {
+        (row.user_id, getattr(row, field)): row
+        for row in model.objects.filter(
+            user_id__in={user_id for user_id, _ in deltas}, **{f'{field}__in': {value for _, value in deltas}}
+        )
+    }
+    changed, added, emptied = [], [], []
+    for (user_id, value), delta in deltas.items():
+        row = rows.get((user_id, value))
+        if row is None:
+            if delta > 0:
+                added.append(model(user_id=user_id, **{field: value, count_field: delta}))
+            continue
+        setattr(row, count_field, getattr(row, count_field) + delta)
+        (changed if getattr(row, count_field) > 0 else emptied).append(row)
+    model.objects.bulk_update(changed, [count_field])
+    model.objects.bulk_create(added)
+    model.objects.filter(pk__in=[row.pk for row in emptied]).delete()
+
+
+def _favorites():
+    """Expressions reading a UserTravelStats row's favourites from the count rows"""
+    user = OuterRef('pk')
+    return {
+        'favorite_country': Coalesce(Subquery(
+            UserCountryVisits.objects.filter(user_id=user).order_by('-visits', 'country').values('country')[:1]
+        ), Value('')),
+        'favorite_category': Coalesce(Subquery(
+            UserCategoryCount.objects.filter(user_id=user).order_by('-activities', 'category').values('category')[:1]
+        ), Value('')),
+        'most_expensive_trip': Coalesce(Subquery(
+            TripTravelStats.objects.filter(user_id=user, completed=True, spent__gt=0).order_by(
+                '-spent', '-trip_created_at'
+            ).values('name')[:1]
+        ), Value('')),
+    }
+
+
+def apply_trip_changes(trip_ids, rebuild=()):
+    """Bring the owners' statistics up to date with the given trips
+
+    Users in rebuild are recomputed from all of their trips. Returns the
+    number of users whose statistics were updated.
+    """
+    trip_ids = set(trip_ids)
+    with transaction.atomic():
+        owners = Trip.objects.filter(pk__in=trip_ids).order_by().values_list('user_id', flat=True).union(
+            TripTravelStats.objects.filter(trip_id__in=trip_ids).order_by().values_list('user_id', flat=True)
+        )
+        user_ids, created = _lock_users(set(owners) | set(rebuild))
+        if not user_ids:
+            return 0
+        rebuilt = created | (set(rebuild) & user_ids)
+        if rebuilt:
+            _reset(rebuilt)
+
+        # Read after locking, so a concurrent refresh of the same trips applies on top of this one
+        current = current_contributions(Trip.objects.filter(Q(pk__in=trip_ids) | Q(user_id__in=rebuilt)))
+        trip_ids |= set(current)
+        previous = {row.trip_id: row for row in TripTravelStats.objects.filter(trip_id__in=trip_ids)}
+
+        totals = defaultdict(Counter)
+        countries, categories = Counter(), Counter()
+        for sign, contributions in ((-1, previous.values()), (1, current.values())):
+            for contribution in contributions:
+                for field, value in _totals(contribution).items():
+                    totals[contribution.user_id][field] += sign * value
+                for country, count in contribution.countries.items():
+                    countries[contribution.user_id, country] += sign * count
+                for category, count in contribution.categories.items():
+                    categories[contribution.user_id, category] += sign * count
+
+        TripTravelStats.objects.bulk_create(
+            current.values(), update_conflicts=True, unique_fields=['trip_id'], update_fields=CONTRIBUTION_FIELDS
+        )
+        TripTravelStats.objects.filter(trip_id__in=set(previous) - set(current)).delete()
+        _apply_counts(UserCountryVisits, 'country', 'visits', countries)
+        _apply_counts(UserCategoryCount, 'category', 'activities', categories)
+
+        favorites = _favorites()
+        for user_id in user_ids:
+            deltas = {field: F(field) + delta for field, delta in totals[user_id].items() if delta}
+            UserTravelStats.objects.filter(pk=user_id).update(refreshed_at=timezone.now(), **deltas, **favorites)
+    return len(user_ids)
+
+
+def rebuild_user_stats(user_ids):
+    """Recompute the statistics of the given users from all of their trips"""
+    return apply_trip_changes((), rebuild=user_ids)
+
+
+def _apply_pending():
+    trip_ids, _pending.trip_ids = getattr(_pending, 'trip_ids', None), None
+    if trip_ids:
+        apply_trip_changes(trip_ids)
+
+
+def schedule_stats_refresh(trip_ids):
+    """Apply the given trips to their owners' statistics once the current transaction commits
+
+    Trips collected during a transaction are applied together, once. Every call
+    registers a callback, since those of rolled back blocks are dropped; the
+    first to run takes all pending trips.
+    """
+    trip_ids = {trip_id for trip_id in trip_ids if trip_id is not None}
+    if not trip_ids:
+        return
+    pending = getattr(_pending, 'trip_ids', None)
+    if pending is None:
+        pending = _pending.trip_ids = set()
+    pending.update(trip_ids)
+    transaction.on_commit(_apply_pending)
+
+
+def travel_stats(user):
+    """The user's UserTravelStats row, computed on first use"""
+    stats = UserTravelStats.objects.filter(user=user).first()
+    if stats is None:
+        rebuild_user_stats([user.pk])
+        stats = UserTravelStats.objects.get(user=user)
+    return stats
+
+
+def user_stats_report(stats):
+    """UserStatsSchema payload of a UserTravelStats row"""
+    return {
+        "total_trips": stats.total_trips,
+        "total_destinations_visited": stats.total_destinations,
+        "total_activities": stats.total_activities,
+        "total_budget_spent": float(stats.total_spent),
+        "favorite_destination": stats.favorite_country or None,
+        "average_trip_duration": stats.average_trip_duration,
+        "most_expensive_trip": stats.most_expensive_trip or None,
+    }
+
+
+def user_trip_stats_report(stats):
+    """UserTripStatsSchema payload of a UserTravelStats row"""
+    return {
+        "total_trips": stats.total_trips,
+        "total_destinations": stats.total_destinations,
+        "total_activities": stats.total_activities,
+        "total_spent": stats.total_spent,
+        "average_trip_duration": stats.average_trip_duration,
+        "favorite_category": stats.favorite_category or None,
+        "most_visited_country": stats.favorite_country or None,
+        "upcoming_trips": stats.upcoming_trips,
+        "completed_trips": stats.completed_trips,
+    }
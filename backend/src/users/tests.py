@@ -1,3 +1,203 @@
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from ninja_jwt.tokens import AccessToken
+
+from trips.models import Trip, Stop, Activity, Budget
+from .models import SavedDestination, UserTravelStats, UserCountryVisits
+from .stats import rebuild_user_stats
+
+User = get_user_model()
+
+
+class SavedDestinationListTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='traveler@example.com', first_name='Test', last_name='Traveler', password='secret123'
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_saved_destinations_are_paged_by_priority(self):
+        for city, priority in [('Lima', 1), ('Kyoto', 4), ('Oslo', 2), ('Cusco', 4)]:
+            SavedDestination.objects.create(user=self.user, city_name=city, country='X', priority=priority)
+
+        first = self.client.get('/api/users/saved-destinations', {'limit': 3}, **self.auth).json()
+        second = self.client.get(
+            '/api/users/saved-destinations', {'limit': 3, 'cursor': first['next']}, **self.auth
+        ).json()
+
+        self.assertEqual([d['city_name'] for d in first['items']], ['Cusco', 'Kyoto', 'Oslo'])
+        self.assertEqual([d['city_name'] for d in second['items']], ['Lima'])
+        self.assertIsNone(second['next'])
+
+
+class UserStatsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='traveler@example.com', first_name='Test', last_name='Traveler', password='secret123'
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def add_trip(self, name, country, stops, status='completed', days=3, meal_cost='0.00'):
+        trip = Trip.objects.create(
+            user=self.user, name=name, status=status, start_date=date(2025, 1, 1), end_date=date(2025, 1, days)
+        )
+        for i in range(stops):
+            stop = Stop.objects.create(
+                trip=trip, city_name=f'City {i}', country=country,
+                start_date=trip.start_date, end_date=trip.start_date, accommodation_cost=Decimal('50.00')
+            )
+            Activity.objects.create(stop=stop, name='Walk', cost=Decimal('10.00'))
+        Budget.objects.filter(trip=trip).update(meal_cost=Decimal(meal_cost))
+        return trip
+
+    def stats(self):
+        response = self.client.get('/api/users/stats', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_stats_cover_completed_trips(self):
+        self.add_trip('Italy', 'Italy', 3, days=4)
+        self.add_trip('Japan', 'Japan', 2, days=2, meal_cost='500.00')
+        self.add_trip('Someday', 'Peru', 5, status='planning')
+
+        self.assertEqual(self.stats(), {
+            'total_trips': 3,
+            'total_destinations_visited': 5,
+            'total_activities': 5,
+            'total_budget_spent': 800.0,
+            'favorite_destination': 'Italy',
+            'average_trip_duration': 3.0,
+            'most_expensive_trip': 'Japan',
+        })
+
+        response = self.client.get('/api/users/stats/trips', **self.auth)
+        self.assertEqual(response.json(), {
+            'total_trips': 3,
+            'total_destinations': 5,
+            'total_activities': 5,
+            'total_spent': '800.00',
+            'average_trip_duration': 3.0,
+            'favorite_category': 'other',
+            'most_visited_country': 'Italy',
+            'upcoming_trips': 1,
+            'completed_trips': 2,
+        })
+
+    def test_stats_are_read_from_one_row_refreshed_by_trip_writes(self):
+        trip = self.add_trip('Italy', 'Italy', 1)
+        self.assertEqual(self.stats()['total_activities'], 1)
+
+        # Authentication, then the materialized row
+        with self.assertNumQueries(2):
+            self.stats()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(10):
+                self.add_trip(f'Trip {i}', 'Spain', 2)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.stats()['favorite_destination'], 'Spain')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Activity.objects.create(stop=trip.stops.get(), name='Museum', cost=Decimal('5.00'))
+        self.assertEqual(self.stats()['total_activities'], 22)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Trip.objects.exclude(pk=trip.pk).delete()
+            Budget.objects.filter(trip=trip).update(meal_cost=Decimal('20.00'))
+            Budget.objects.get(trip=trip).save()
+        stats = self.stats()
+        self.assertEqual(stats['favorite_destination'], 'Italy')
+        self.assertEqual(stats['most_expensive_trip'], 'Italy')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Budget.objects.get(trip=trip).delete()
+        self.assertIsNone(self.stats()['most_expensive_trip'])
+
+    def test_rebuild_command_backfills_every_user(self):
+        other = User.objects.create_user(email='other@example.com', first_name='O', last_name='T', password='x')
+        self.add_trip('Italy', 'Italy', 2)
+        Trip.objects.create(user=other, name='Later', start_date=date(2026, 1, 1), end_date=date(2026, 1, 2))
+
+        out = StringIO()
+        call_command('rebuild_user_stats', batch_size=1, workers=1, stdout=out)
+
+        self.assertIn('Rebuilt travel statistics of 2 user(s)', out.getvalue())
+        mine, theirs = UserTravelStats.objects.get(user=self.user), UserTravelStats.objects.get(user=other)
+        self.assertEqual((mine.completed_trips, mine.total_destinations, mine.total_spent), (1, 2, Decimal('120.00')))
+        self.assertEqual((theirs.total_trips, theirs.upcoming_trips, theirs.favorite_country), (1, 1, ''))
+
+    def row(self):
+        stats = UserTravelStats.objects.get(user=self.user)
+        return {field.name: getattr(stats, field.name) for field in UserTravelStats._meta.fields[1:-1]}
+
+    def apply_queries(self, write):
+        """Queries run on commit to apply write() to the statistics"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            write()
+        with CaptureQueriesContext(connection) as ctx:
+            for callback in callbacks:
+                callback()
+        return len(ctx)
+
+    def test_apply_cost_does_not_grow_with_history(self):
+        italy = self.add_trip('Italy', 'Italy', 2)
+        self.stats()
+        stop = italy.stops.first()
+        small = self.apply_queries(lambda: Activity.objects.create(stop=stop, name='Museum', cost=Decimal('5.00')))
+
+        for i in range(10):
+            self.add_trip(f'Old {i}', 'Spain', 2)
+        rebuild_user_stats([self.user.pk])
+        large = self.apply_queries(lambda: Activity.objects.create(stop=stop, name='Opera', cost=Decimal('5.00')))
+        self.assertEqual(large, small)
+        self.assertEqual(self.stats()['total_activities'], 24)
+
+    def test_transaction_applies_its_trips_once(self):
+        self.stats()
+        with self.captureOnCommitCallbacks() as callbacks:
+            trip = self.add_trip('Italy', 'Italy', 3)
+            trip.name = 'Italia'
+            trip.save()
+        with CaptureQueriesContext(connection) as ctx:
+            for callback in callbacks:
+                callback()
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "user_travel_stats"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.stats()['most_expensive_trip'], 'Italia')
+
+    def test_incremental_statistics_match_a_rebuild(self):
+        self.stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            italy = self.add_trip('Italy', 'Italy', 3, days=4)
+            japan = self.add_trip('Japan', 'Japan', 2, meal_cost='500.00')
+            later = self.add_trip('Later', 'Peru', 2, status='planning')
+        with self.captureOnCommitCallbacks(execute=True):
+            later.status = 'completed'
+            later.save()
+            Stop.objects.filter(trip=italy).update(country='Peru')
+            italy.save()
+            stop = japan.stops.first()
+            stop.trip = italy
+            stop.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            japan.delete()
 
-# Create your tests here.
+        incremental = self.row()
+        self.assertEqual((incremental['total_trips'], incremental['favorite_country']), (2, 'Peru'))
+        rebuild_user_stats([self.user.pk])
+        self.assertEqual(incremental, self.row())
+        self.assertEqual(
+            dict(UserCountryVisits.objects.filter(user=self.user).values_list('country', 'visits')),
+            {'Peru': 5, 'Japan': 1}
+        )